@@ -0,0 +1,53 @@
+"""add hnsw and document id indexes to the pg vector store table
+
+Revision ID: 7d4e0b6a9c21
+Revises: 5f2a9c7e1b38
+Create Date: 2024-02-12 11:26:09.482519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d4e0b6a9c21'
+down_revision: Union[str, None] = '5f2a9c7e1b38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+table_name = f"data_{settings.VECTOR_STORE_TABLE_NAME}"
+
+
+def _table_exists() -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name)
+
+
+def upgrade() -> None:
+    # The table itself is created by the pg vector store setup on app startup, which also
+    # creates these indexes for fresh databases. This migration adds them to existing tables.
+    if not _table_exists():
+        return
+    # CONCURRENTLY so that building the indexes on a large table doesn't block writes
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {table_name}_embedding_hnsw_idx "
+            f"ON {table_name} USING hnsw (embedding vector_cosine_ops) "
+            f"WITH (m = {settings.PGVECTOR_HNSW_M}, ef_construction = {settings.PGVECTOR_HNSW_EF_CONSTRUCTION})"
+        )
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {table_name}_db_document_id_idx "
+            f"ON {table_name} ((metadata_->>'db_document_id'))"
+        )
+    # Give the planner statistics on the new expression index
+    op.execute(f"ANALYZE {table_name}")
+
+
+def downgrade() -> None:
+    if not _table_exists():
+        return
+    op.execute(f"DROP INDEX IF EXISTS {table_name}_db_document_id_idx")
+    op.execute(f"DROP INDEX IF EXISTS {table_name}_embedding_hnsw_idx")
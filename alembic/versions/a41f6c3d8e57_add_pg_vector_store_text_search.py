@@ -0,0 +1,51 @@
+"""add a generated tsvector column and gin index to the pg vector store table
+
+Revision ID: a41f6c3d8e57
+Revises: 7d4e0b6a9c21
+Create Date: 2024-02-14 09:52:40.318274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f6c3d8e57'
+down_revision: Union[str, None] = '7d4e0b6a9c21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+table_name = f"data_{settings.VECTOR_STORE_TABLE_NAME}"
+# The name llama-index gives the gin index of tables it creates with hybrid search
+index_name = f"{settings.VECTOR_STORE_TABLE_NAME}_idx"
+
+
+def _table_exists() -> bool:
+    return sa.inspect(op.get_bind()).has_table(table_name)
+
+
+def upgrade() -> None:
+    # As with the other vector store indexes, fresh tables get these from the vector store
+    # setup on app startup. Adding a stored generated column rewrites the table once.
+    if not _table_exists():
+        return
+    op.execute(
+        f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS text_search_tsv tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{settings.TEXT_SEARCH_CONFIG}', text)) STORED"
+    )
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+            f"ON {table_name} USING gin (text_search_tsv)"
+        )
+
+
+def downgrade() -> None:
+    if not _table_exists():
+        return
+    op.execute(f"DROP INDEX IF EXISTS {index_name}")
+    op.execute(f"ALTER TABLE {table_name} DROP COLUMN IF EXISTS text_search_tsv")
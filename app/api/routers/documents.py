@@ -1,7 +1,9 @@
 
-from fastapi import APIRouter, UploadFile, HTTPException, File, Depends
+from fastapi import APIRouter, UploadFile, HTTPException, File, Form, Depends, status
 
-from io import BytesIO
+import asyncio
+import hashlib
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 from fastapi.encoders import jsonable_encoder
 import s3fs
@@ -16,18 +18,31 @@ from llama_index.vector_stores.types import (
 )
 
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from uuid import UUID
+from uuid import UUID, uuid4
 
 from app.api.deps import get_db
 from app.core.config import settings
 from app.core.constants import DB_DOC_ID_KEY
-from app.engine.indexing import create_index_from_doc, index_to_query_engine, build_description_for_document
-from app.engine.context import create_tool_service_context
-from app.schemas.base import DocumentSchema
-from app.services.document import upsert_single_document, fetch_documents
-from app.utils.file_utils import get_Document_url, get_s3_fs
+from app.core.executors import run_cpu
+from app.engine.jobs import indexing_queue, IndexingQueueFull
+from app.models.db import IndexingJobStatus
+from app.schemas.base import DocumentSchema, IndexingJobSchema
+from app.services.document import (
+    build_document_for_url,
+    fetch_documents,
+    upsert_document_by_url,
+    upsert_single_document,
+)
+from app.services.indexing_job import fetch_indexing_job
+from app.utils.file_utils import (
+    UploadTooLarge,
+    get_Document_url,
+    get_async_s3_fs,
+    upload_stream,
+)
 
 
 router = APIRouter()
@@ -37,11 +52,47 @@ class FileData(BaseModel):
     file: UploadFile
 
 ALLOWED_EXTENSIONS = ["pdf", "txt", "md", "jpg", "jpeg", "png", "gif"]
+UPLOAD_STAGING_PREFIX = ".uploads"
 
 def is_allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+class _BatchUploadError(BaseModel):
+    name: str
+    detail: str
+
+
+class _BatchUploadResult(BaseModel):
+    documents: List[DocumentSchema]
+    jobs: List[IndexingJobSchema]
+    errors: List[_BatchUploadError]
+
+
+async def _stage_upload(file: UploadFile, concurrency: int) -> Tuple[str, str]:
+    """
+    Streams the file into a staging object while hashing it, so that identical content
+    never creates a second document or overwrites another document's file.
+    Returns the staging path and the sha256 of the contents.
+    """
+    staging_path = f"{settings.S3_ASSET_BUCKET_NAME}/{UPLOAD_STAGING_PREFIX}/{uuid4()}"
+    sha256 = hashlib.sha256()
+
+    async def read_parts():
+        # Read whole parts from the spooled upload so they go to S3 without being re-buffered
+        while chunk := await file.read(settings.S3_UPLOAD_PART_SIZE):
+            await run_cpu(sha256.update, chunk)
+            yield chunk
+
+    await upload_stream(
+        staging_path,
+        read_parts(),
+        concurrency=concurrency,
+        max_size=settings.UPLOAD_MAX_SIZE_BYTES,
+    )
+    return staging_path, sha256.hexdigest()
+
+
 @router.get("/{document_id}")
 async def get_document(
     document_id: UUID,
@@ -57,53 +108,193 @@ async def get_document(
     return docs[0]
 
 @router.post("/upload")
-async def upload_file_to_s3(file: UploadFile = File()):
+async def upload_file_to_s3(
+    file: UploadFile = File(),
+    db: AsyncSession = Depends(get_db),
+):
     print(file.filename)
     if not is_allowed_file(file.filename):
         raise HTTPException(status_code=400, detail="File type not allowed")
-    s3 = get_s3_fs(settings.S3_ASSET_BUCKET_NAME)
+    if file.size is not None and file.size > settings.UPLOAD_MAX_SIZE_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File too large"
+        )
+    s3 = get_async_s3_fs()
 
-    with BytesIO() as file_stream:
-        # Read the file into memory
-        file_stream.write(await file.read())
-        file_stream.seek(0)
+    try:
+        staging_path, content_hash = await _stage_upload(
+            file, concurrency=settings.S3_UPLOAD_CONCURRENCY
+        )
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File too large"
+        )
 
-        # Upload the file to S3 using s3fs
-        with s3.open(f"{settings.S3_ASSET_BUCKET_NAME}/{file.filename}", "wb") as s3_file:
-            s3_file.write(file_stream.read())
+    existing_docs = await fetch_documents(db, content_hash=content_hash)
+    if existing_docs:
+        await s3._rm(staging_path)
+        return jsonable_encoder(existing_docs[0])
 
     url: str = get_Document_url(file_name=file.filename)
-    doc = await upsert_single_document(url)
+    try:
+        # The row claims the file name first, so the object under it is only replaced
+        # once its content hash is the one recorded for it
+        try:
+            doc = await upsert_single_document(url, content_hash=content_hash)
+        except IntegrityError:
+            # The same content was uploaded concurrently under another name
+            existing_docs = await fetch_documents(db, content_hash=content_hash)
+            if not existing_docs:
+                raise
+            return jsonable_encoder(existing_docs[0])
+        await s3._cp_file(staging_path, f"{settings.S3_ASSET_BUCKET_NAME}/{file.filename}")
+    finally:
+        await s3._rm(staging_path)
     doc_dict = jsonable_encoder(doc)
     return doc_dict
 
 
-@router.post("/index")
-async def upload_file_to_s3(document: DocumentSchema):
-    
+@router.post("/batch")
+async def upload_documents_batch(
+    files: List[UploadFile] = File(default=[]),
+    urls: List[str] = Form(default=[]),
+    index: bool = Form(False),
+    db: AsyncSession = Depends(get_db),
+) -> _BatchUploadResult:
+    """
+    Uploads many files and/or registers many document URLs at once.
+    Files are uploaded to S3 with a bounded fan-out and all documents are upserted in one
+    statement. With `index`, indexing is queued for every document of the batch.
+    Per-item failures are reported in `errors` instead of failing the whole batch.
+    """
+    if len(files) + len(urls) > settings.BATCH_UPLOAD_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.BATCH_UPLOAD_MAX_ITEMS} files and urls per batch",
+        )
+    s3 = get_async_s3_fs()
+    errors: List[_BatchUploadError] = []
+    fan_out = asyncio.Semaphore(settings.BATCH_UPLOAD_CONCURRENCY)
+
+    accepted_files = []
+    for file in files:
+        if not is_allowed_file(file.filename):
+            errors.append(_BatchUploadError(name=file.filename, detail="File type not allowed"))
+        elif any(other.filename == file.filename for other in accepted_files):
+            errors.append(_BatchUploadError(name=file.filename, detail="Duplicate file name"))
+        else:
+            accepted_files.append(file)
+
+    async def stage(file: UploadFile) -> Optional[Tuple[UploadFile, str, str]]:
+        async with fan_out:
+            try:
+                # Parts of one file go up one at a time, the fan-out is across files
+                return (file, *await _stage_upload(file, concurrency=1))
+            except UploadTooLarge:
+                errors.append(_BatchUploadError(name=file.filename, detail="File too large"))
+            except Exception as e:
+                print(e)
+                errors.append(_BatchUploadError(name=file.filename, detail="Upload failed"))
+            return None
+
+    staged = [item for item in await asyncio.gather(*map(stage, accepted_files)) if item]
+
+    # Content that is already stored, or repeated within the batch, isn't stored again
+    content_hashes = [content_hash for _, _, content_hash in staged]
+    existing_docs = {
+        doc.content_hash: doc
+        for doc in (await fetch_documents(db, content_hashes=content_hashes) if content_hashes else [])
+    }
+    new_docs = {}
+    finalize = []
+    for file, staging_path, content_hash in staged:
+        if content_hash in existing_docs or content_hash in new_docs:
+            finalize.append((staging_path, None))
+            continue
+        finalize.append((staging_path, f"{settings.S3_ASSET_BUCKET_NAME}/{file.filename}"))
+        new_docs[content_hash] = build_document_for_url(
+            get_Document_url(file_name=file.filename), content_hash=content_hash
+        )
+
+    async def move_or_remove(staging_path: str, path: Optional[str]) -> None:
+        async with fan_out:
+            if path is not None:
+                await s3._cp_file(staging_path, path)
+            await s3._rm(staging_path)
+
+    url_docs = []
+    for url in urls:
+        doc = build_document_for_url(url)
+        if doc is None:
+            errors.append(_BatchUploadError(name=url, detail="Not an http(s) url"))
+        else:
+            url_docs.append(doc)
+
+    async def discard_staged() -> None:
+        await asyncio.gather(*(move_or_remove(staging_path, None) for staging_path, _ in finalize))
+
+    # The rows are upserted first, so a file under a document's name is only replaced
+    # once the new content hash is the one recorded for it
+    try:
+        upserted_docs = await upsert_document_by_url(db, [*new_docs.values(), *url_docs])
+    except IntegrityError:
+        await discard_staged()
+        # Some of the content was uploaded concurrently under another name
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Some files were uploaded concurrently, retry the batch",
+        )
+    except BaseException:
+        await discard_staged()
+        raise
+    await asyncio.gather(*(move_or_remove(*item) for item in finalize))
+    documents = list({doc.id: doc for doc in [*existing_docs.values(), *upserted_docs]}.values())
+
+    jobs = []
+    if index:
+        for doc in documents:
+            try:
+                jobs.append(await indexing_queue.enqueue(doc))
+            except IndexingQueueFull:
+                errors.append(_BatchUploadError(name=doc.url, detail="Indexing queue is full"))
+    return _BatchUploadResult(documents=documents, jobs=jobs, errors=errors)
+
+
+@router.post("/index", status_code=status.HTTP_202_ACCEPTED)
+async def index_document(document: DocumentSchema) -> IndexingJobSchema:
+    """
+    Queues the document for background indexing and returns the job to poll
+    """
     print(document)
-    
-    service_context = create_tool_service_context()
-    fs = get_s3_fs()
 
     try:
-        doc_id = str(document.id)
-        indexDict = await create_index_from_doc(service_context=service_context, document=document, fs=fs)
-        print(indexDict)
-        index = indexDict[str(document.id)]
+        return await indexing_queue.enqueue(document)
+    except IndexingQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many documents are being indexed, try again later",
+        )
+
+
+@router.get("/jobs/{job_id}")
+async def get_indexing_job(
+    job_id: UUID,
+    wait: float = 0,
+    db: AsyncSession = Depends(get_db),
+) -> IndexingJobSchema:
+    """
+    Get the status of an indexing job.
+    Pass `wait` (seconds) to long-poll until the job finishes or the wait elapses.
+    """
+    job = await fetch_indexing_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Indexing job not found")
 
-        filters = MetadataFilters(
-            filters=[ExactMatchFilter(key=DB_DOC_ID_KEY, value=doc_id)]
+    if wait > 0 and job.status in (IndexingJobStatus.QUEUED, IndexingJobStatus.RUNNING):
+        await indexing_queue.wait_for(
+            job_id, timeout=min(wait, settings.INDEXING_JOB_MAX_WAIT_SECONDS)
         )
-        
-        query_engine = index.as_query_engine(filters=filters, similarity_top_k=3)
-
-        
-        response = query_engine.query(f"Summarize the document {doc_id} within 500 words")
-        return {
-            "message": "Indexing Completed", 
-            "result": response.response
-        }
-    except Exception as e:
-        print(e)
-        raise HTTPException(status_code=500, detail="Failed to index the Document")
+        # Read the latest state from a fresh transaction
+        await db.rollback()
+        job = await fetch_indexing_job(db, job_id)
+    return job
@@ -1,24 +1,39 @@
-from typing import List, Optional
+import json
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from llama_index.core.base_query_engine import BaseQueryEngine
 from llama_index.query_engine import CitationQueryEngine
+from llama_index.schema import NodeWithScore, QueryBundle
 from llama_index.vector_stores.types import (
     MetadataFilters,
     ExactMatchFilter,
 )
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_db
+from app.core.config import settings
 from app.core.constants import DB_DOC_ID_KEY
-from app.engine.context import create_tool_service_context
-from app.engine.indexing import create_index_from_doc
+from app.core.executors import iterate_io, run_cpu, run_io
+from app.core.metrics import observe_query_stage
+from app.engine.cache import index_cache
+from app.engine.context_assembly import aassemble_context, context_stats, count_tokens
+from app.engine.indexing import (
+    get_index_for_document,
+    retriever_query_kwargs,
+    vector_store_query_kwargs,
+)
+from app.engine.query_embedding_cache import query_embedding_cache
+from app.engine.rerank import CrossEncoderRerank, create_reranker, rerank_stats
+from app.engine.semantic_cache import semantic_answer_cache
 from app.schemas.base import CitationSchema
 from app.services.document import fetch_documents
-from app.utils.file_utils import  get_s3_fs
 
 
 router = r = APIRouter()
@@ -27,6 +42,17 @@ router = r = APIRouter()
 class _QueryData(BaseModel):
     query: str
     assistant_id: str
+    # HNSW search breadth for this query, defaults to settings.PGVECTOR_HNSW_EF_SEARCH
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)
+    # Stream the answer as Server-Sent Events instead of returning a single _Result
+    stream: bool = False
+    # Cross-encoder rerank of the retrieved chunks, each defaulting to the RERANK_* settings
+    rerank: Optional[bool] = None
+    rerank_candidates: Optional[int] = Field(None, ge=1, le=100)
+    rerank_top_n: Optional[int] = Field(None, ge=1, le=20)
+    rerank_score_cutoff: Optional[float] = None
+    # Tokens of chunk text sent to the LLM, defaults to settings.CONTEXT_TOKEN_BUDGET
+    context_token_budget: Optional[int] = Field(None, ge=64, le=16000)
 
 
 class _Result(BaseModel):
@@ -35,10 +61,128 @@ class _Result(BaseModel):
     forwardToClientEnabled: bool
 
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+def _answer_variant(data: _QueryData) -> str:
+    """
+    The request parameters that change the answer, with their defaults applied. Part of
+    the semantic cache key, so answers are only reused for queries asked the same way.
+    """
+    rerank = data.rerank if data.rerank is not None else settings.RERANK_ENABLED
+    return json.dumps(
+        {
+            "ef_search": data.ef_search or settings.PGVECTOR_HNSW_EF_SEARCH,
+            "context_token_budget": data.context_token_budget or settings.CONTEXT_TOKEN_BUDGET,
+            "rerank": [
+                data.rerank_candidates or settings.RERANK_CANDIDATES,
+                data.rerank_top_n or settings.RERANK_TOP_N,
+                data.rerank_score_cutoff
+                if data.rerank_score_cutoff is not None
+                else settings.RERANK_SCORE_CUTOFF,
+            ]
+            if rerank
+            else None,
+        },
+        sort_keys=True,
+    )
+
+
+async def _retrieve(
+    query_engine: CitationQueryEngine,
+    query_bundle: QueryBundle,
+    reranker: Optional[CrossEncoderRerank],
+    token_budget: int,
+) -> List[NodeWithScore]:
+    """
+    Retrieves, optionally reranks, and fits the chunks into the context token budget.
+    """
+    with observe_query_stage("retrieval"):
+        nodes = await query_engine.aretrieve(query_bundle)
+    if reranker is not None:
+        with observe_query_stage("rerank"):
+            nodes = await reranker.apostprocess_nodes(nodes, query_bundle)
+    with observe_query_stage("context_assembly"):
+        context = await aassemble_context(nodes, token_budget)
+    prompt_tokens = context_stats.record(count_tokens(query_bundle.query_str), context)
+    print(
+        f"Prompt context: {prompt_tokens} tokens from {len(context.nodes)} chunks "
+        f"({context.merged} merged, {context.truncated} truncated, {context.dropped} dropped)"
+    )
+    return context.nodes
+
+
+async def _stream_answer(
+    doc_id: str,
+    query_bundle: QueryBundle,
+    query_engine: CitationQueryEngine,
+    reranker: Optional[CrossEncoderRerank],
+    token_budget: int,
+    variant: str,
+    version: Optional[datetime],
+) -> AsyncIterator[str]:
+    """
+    Yields `token` events as the answer is generated, then a `sources` event with the
+    citations and a final `done` event carrying the full answer in the `_Result` shape.
+    """
+    try:
+        nodes = await _retrieve(query_engine, query_bundle, reranker, token_budget)
+        # The streaming synthesizer is blocking, so it runs (and is iterated) on the I/O pool
+        with observe_query_stage("synthesis"):
+            streaming_response = await run_io(query_engine.synthesize, query_bundle, nodes)
+            tokens = []
+            async for token in iterate_io(streaming_response.response_gen):
+                tokens.append(token)
+                yield _sse_event("token", {"token": token})
+
+        with observe_query_stage("citations"):
+            citations = [
+                CitationSchema.from_node(node_w_score=node)
+                for node in streaming_response.source_nodes
+            ]
+        yield _sse_event("sources", {"sources": citations})
+
+        answer = "".join(tokens)
+        print(answer)
+        if settings.SEMANTIC_CACHE_ENABLED and answer:
+            semantic_answer_cache.set(
+                doc_id,
+                query_bundle.query_str,
+                query_bundle.embedding,
+                result=answer,
+                sources=citations,
+                variant=variant,
+                version=version,
+            )
+        yield _sse_event(
+            "done",
+            _Result(result=answer, sources=citations, forwardToClientEnabled=True).dict(),
+        )
+    except Exception as e:
+        # Headers are already sent, so failures can only be reported in-band
+        print(e)
+        yield _sse_event("error", {"detail": "Failed to query the Document"})
+
+
+def _stream_headers(response: Response) -> Dict[str, str]:
+    # Keep proxies from buffering or caching the stream
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if "X-Semantic-Cache" in response.headers:
+        headers["X-Semantic-Cache"] = response.headers["X-Semantic-Cache"]
+    return headers
+
+
+async def _stream_cached_answer(result: _Result) -> AsyncIterator[str]:
+    yield _sse_event("token", {"token": result.result})
+    yield _sse_event("sources", {"sources": result.sources})
+    yield _sse_event("done", result.dict())
+
 
 @r.post("")
 async def query_document(
     data: _QueryData,
+    response: Response,
     db: AsyncSession = Depends(get_db),
 ) -> _Result:
     # check preconditions and get last message
@@ -54,36 +198,111 @@ async def query_document(
             detail="No assistant id provided",
         )
 
-    service_context = create_tool_service_context()
-    fs = get_s3_fs()
-
     try:
         assistant_id = data.assistant_id
-        documents = await fetch_documents(db=db, assistant_id=assistant_id)
+        with observe_query_stage("document_lookup"):
+            documents = await fetch_documents(db=db, assistant_id=assistant_id)
         document = documents[0]
         if document is not None:
             doc_id = str(document.id)
-            indexDict = await create_index_from_doc(service_context=service_context, document=document, fs=fs)
-            print(indexDict)
-            index = indexDict[str(document.id)]
+            with observe_query_stage("index_load"):
+                index = await get_index_for_document(document)
+            embed_model = index.service_context.embed_model
+
+            query_embedding = None
+            variant = _answer_variant(data)
+            if settings.SEMANTIC_CACHE_ENABLED:
+                cached, query_embedding = await semantic_answer_cache.alookup(
+                    doc_id,
+                    data.query,
+                    embed_model.aget_query_embedding,
+                    variant=variant,
+                    version=document.indexed_at,
+                )
+                response.headers["X-Semantic-Cache"] = "hit" if cached else "miss"
+                if cached is not None:
+                    print(f"Semantic cache hit for {data.query!r}: {cached.query!r}")
+                    result = _Result(
+                        result=cached.result,
+                        sources=cached.sources,
+                        forwardToClientEnabled=True
+                    )
+                    if data.stream:
+                        return StreamingResponse(
+                            _stream_cached_answer(result),
+                            media_type="text/event-stream",
+                            headers=_stream_headers(response),
+                        )
+                    return result
+                if query_embedding is None:
+                    # Embedded once here so retrieval and the cache share the same vector
+                    query_embedding = await embed_model.aget_query_embedding(data.query)
 
-            print(index)
             filters = MetadataFilters(
                 filters=[ExactMatchFilter(key=DB_DOC_ID_KEY, value=doc_id)]
             )
+            similarity_top_k = 5
+            reranker = None
+            if data.rerank if data.rerank is not None else settings.RERANK_ENABLED:
+                # Over-fetch, and let the cross-encoder pick the chunks the LLM gets to see
+                similarity_top_k = data.rerank_candidates or settings.RERANK_CANDIDATES
+                # The first use loads (or downloads) the model, which must not block the loop
+                reranker = await run_cpu(
+                    create_reranker,
+                    top_n=data.rerank_top_n,
+                    score_cutoff=data.rerank_score_cutoff,
+                )
             # query_engine = index.as_query_engine(filters=filters, similarity_top_k=3)
-            query_engine = CitationQueryEngine.from_args(index=index,filters=filters, similarity_top_k=5)
+            query_engine = CitationQueryEngine.from_args(
+                index=index,
+                filters=filters,
+                similarity_top_k=similarity_top_k,
+                streaming=data.stream,
+                vector_store_kwargs=vector_store_query_kwargs(data.ef_search),
+                **retriever_query_kwargs(),
+            )
+            query_bundle = QueryBundle(query_str=data.query, embedding=query_embedding)
+            token_budget = data.context_token_budget or settings.CONTEXT_TOKEN_BUDGET
+
+            if data.stream:
+                return StreamingResponse(
+                    _stream_answer(
+                        doc_id,
+                        query_bundle,
+                        query_engine,
+                        reranker,
+                        token_budget,
+                        variant,
+                        document.indexed_at,
+                    ),
+                    media_type="text/event-stream",
+                    headers=_stream_headers(response),
+                )
             
-            response = await query_engine.aquery(data.query)
-            print(response.response)
+            nodes = await _retrieve(query_engine, query_bundle, reranker, token_budget)
+            with observe_query_stage("synthesis"):
+                query_response = await query_engine.asynthesize(query_bundle, nodes)
+            print(query_response.response)
             
-            citations = [
-                CitationSchema.from_node(node_w_score=node)
-                for node in response.source_nodes
-            ]
+            with observe_query_stage("citations"):
+                citations = [
+                    CitationSchema.from_node(node_w_score=node)
+                    for node in query_response.source_nodes
+                ]
+
+            if settings.SEMANTIC_CACHE_ENABLED and query_response.response:
+                semantic_answer_cache.set(
+                    doc_id,
+                    data.query,
+                    query_embedding,
+                    result=query_response.response,
+                    sources=citations,
+                    variant=variant,
+                    version=document.indexed_at,
+                )
             
             return _Result(
-                result=response.response, 
+                result=query_response.response, 
                 sources=citations,
                 forwardToClientEnabled=True
             )
@@ -94,3 +313,41 @@ async def query_document(
         raise HTTPException(status_code=500, detail="Failed to index the Document")
 
 
+@r.get("/cache")
+async def query_cache_stats() -> Dict[str, Any]:
+    """
+    Hit/miss counters of the in-process per-document index cache
+    """
+    return index_cache.stats()
+
+
+@r.get("/semantic-cache")
+async def semantic_cache_stats() -> Dict[str, Any]:
+    """
+    Hit/miss counters of the per-document semantic answer cache
+    """
+    return semantic_answer_cache.stats()
+
+
+@r.get("/embedding-cache")
+async def query_embedding_cache_stats() -> Dict[str, Any]:
+    """
+    Hit/miss counters of the memoized query embeddings
+    """
+    return query_embedding_cache.stats()
+
+
+@r.get("/rerank")
+async def rerank_stage_stats() -> Dict[str, Any]:
+    """
+    Latency and candidate counters of the cross-encoder rerank stage
+    """
+    return rerank_stats.stats()
+
+
+@r.get("/context")
+async def context_assembly_stats() -> Dict[str, Any]:
+    """
+    Prompt token counters of the context sent to synthesis
+    """
+    return context_stats.stats()
@@ -64,10 +64,129 @@ class Settings(PreviewPrefixedSettings):
     CDN_BASE_URL: str
     AWS_ENDPOINT_URL: str
     VECTOR_STORE_TABLE_NAME: str = "pg_vector_store"
+    # Must match the embedding model (1536 for ada-002, 384 for the default local model).
+    # Switching models means a new table name and a re-index (scripts/bulk_index.py)
+    VECTOR_STORE_EMBED_DIM: int = 1536
+    # HNSW index build parameters of the vector store table, and the default search breadth.
+    # Raise ef_search when documents are a small fraction of the table, as the document
+    # filter is applied to the candidates the index returns.
+    PGVECTOR_HNSW_M: int = 16
+    PGVECTOR_HNSW_EF_CONSTRUCTION: int = 64
+    PGVECTOR_HNSW_EF_SEARCH: int = 100
+    # Hybrid retrieval: vector and full-text (`TEXT_SEARCH_CONFIG` tsvector) candidates
+    # fused with reciprocal-rank fusion, k being the usual RRF damping constant
+    HYBRID_SEARCH_ENABLED: bool = True
+    TEXT_SEARCH_CONFIG: str = "english"
+    HYBRID_SEARCH_CANDIDATES: int = 20
+    HYBRID_SEARCH_RRF_K: int = 60
+    # Optional cross-encoder rerank of the retrieved chunks before synthesis: over-fetch
+    # RERANK_CANDIDATES chunks and send the LLM the best RERANK_TOP_N above the cutoff
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 20
+    RERANK_TOP_N: int = 3
+    RERANK_SCORE_CUTOFF: Optional[float] = None
+    RERANK_MAX_LENGTH: int = 512
+    RERANK_THREADS: int = max(1, cpu_count() // 2)
+    # Tokens of retrieved chunk text sent to synthesis per query, after same-page dedupe
+    CONTEXT_TOKEN_BUDGET: int = 2048
+    CONTEXT_TOKEN_COUNT_CACHE_SIZE: int = 16384
     SENTRY_DSN: Optional[str] = ""
     RENDER_GIT_COMMIT: Optional[str] = ""
+    # Alternative OpenAI-compatible endpoint, e.g. the mock served by scripts/load_generator.py
+    OPENAI_API_BASE: Optional[str] = None
     VAPI_BASE_URL: str = ""
     VAPI_API_SECRET: str = ""
+    # Shared async S3 filesystem
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    # Part size of multipart uploads, S3 requires at least 5MB
+    S3_UPLOAD_PART_SIZE: int = 8 * 1024 * 1024
+    # Parts uploaded at once; an upload buffers at most (concurrency + 1) parts in memory
+    S3_UPLOAD_CONCURRENCY: int = 4
+    UPLOAD_MAX_SIZE_BYTES: int = 200 * 1024 * 1024
+    # Files of a batch upload sent to S3 at once, and the maximum files + urls per batch
+    BATCH_UPLOAD_CONCURRENCY: int = 4
+    BATCH_UPLOAD_MAX_ITEMS: int = 500
+    # Look up documents indexed before per-document storage in the old global docstore blob
+    DOCSTORE_LEGACY_FALLBACK_ENABLED: bool = True
+    # Bounded thread pools for blocking work done on behalf of async code
+    IO_EXECUTOR_MAX_WORKERS: int = 32
+    CPU_EXECUTOR_MAX_WORKERS: int = cpu_count()
+    # Worker processes parsing PDF page ranges in parallel (0 parses on the CPU thread pool).
+    # Each one is spawned and re-imports llama-index and the app, costing a few hundred MB
+    # that isn't shared, per serving worker, so only raise it where memory allows
+    PDF_PARSER_PROCESSES: int = 0
+    PDF_PARSER_PAGES_PER_TASK: int = 16
+    # `poetry run serve`: gunicorn workers forked from a master that preloaded the app,
+    # tokenizers and local models, sharing those pages. Unless SERVING_WORKER_COUNT is set,
+    # the count is sized from the first worker's private memory once it has warmed up.
+    # Each worker keeps its own caches, checked against the document's indexed_at, and
+    # runs the indexing jobs it queued; long-polls of other workers' jobs read the table
+    SERVING_WORKER_COUNT: Optional[int] = None
+    SERVING_MAX_WORKERS: int = 2 * cpu_count() + 1
+    SERVING_MEASURE_DELAY_SECONDS: float = 20.0
+    SERVING_WORKER_TIMEOUT_SECONDS: int = 120
+    # Share of the memory limit kept free, and the allowance for workers' caches filling up
+    SERVING_MEMORY_HEADROOM_FRACTION: float = 0.15
+    SERVING_WORKER_MEMORY_GROWTH_FACTOR: float = 1.5
+    # Budget for each of a worker's PDF_PARSER_PROCESSES not yet started when it's measured
+    SERVING_PDF_PARSER_PROCESS_MEMORY_MB: int = 300
+    # Log a warning whenever the event loop is blocked for longer than the threshold
+    EVENT_LOOP_LAG_CHECK_INTERVAL_SECONDS: float = 0.5
+    EVENT_LOOP_LAG_THRESHOLD_SECONDS: float = 0.1
+    # In-process cache of loaded per-document indices used by /query
+    INDEX_CACHE_MAX_SIZE: int = 32
+    INDEX_CACHE_TTL_SECONDS: int = 1800
+    # Memoized query embeddings: an in-process LRU, optionally backed by a backend shared
+    # across workers. "postgres" (the `embeddingcache` table, rows expiring after the TTL),
+    # "memory" (stand-in) or "none"
+    QUERY_EMBEDDING_CACHE_ENABLED: bool = True
+    QUERY_EMBEDDING_CACHE_MAX_SIZE: int = 4096
+    QUERY_EMBEDDING_CACHE_BACKEND: str = "none"
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    QUERY_EMBEDDING_CACHE_PRUNE_INTERVAL_SECONDS: int = 3600
+    # Per-document cache of /query answers, matched by query embedding similarity. Off by
+    # default: with ada-002, different questions about the same document ("summarize section
+    # 2" / "section 3") score above 0.95, so validate the threshold on real query pairs first
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_SIMILARITY_THRESHOLD: float = 0.98
+    SEMANTIC_CACHE_MAX_DOCUMENTS: int = 256
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_DOCUMENT: int = 128
+    SEMANTIC_CACHE_TTL_SECONDS: int = 3600
+    # Background indexing jobs
+    INDEXING_WORKER_COUNT: int = 2
+    INDEXING_QUEUE_MAX_SIZE: int = 100
+    INDEXING_JOB_MAX_WAIT_SECONDS: int = 30
+    # How often a long-poll re-reads a job run by another worker process
+    INDEXING_JOB_POLL_SECONDS: float = 1.0
+    # Jobs of a running process are heartbeated; queued or running jobs without a heartbeat
+    # for INDEXING_JOB_STALE_SECONDS were orphaned by a restart and get run again
+    INDEXING_JOB_HEARTBEAT_SECONDS: int = 30
+    INDEXING_JOB_STALE_SECONDS: int = 120
+    # Streaming ingestion: nodes embedded and written per batch while later pages are parsed
+    INDEXING_NODE_BATCH_SIZE: int = 256
+    DOCUMENT_FETCH_TIMEOUT_SECONDS: int = 60
+    # Embedding stage. "openai", "local" (in-process CPU model, see LOCAL_EMBEDDING_*) or
+    # "stand_in" (deterministic offline vectors for benchmarks)
+    EMBEDDING_BACKEND: str = "openai"
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_MAX_IN_FLIGHT: int = 4
+    # Size these to the account's API quota
+    EMBEDDING_REQUESTS_PER_MINUTE: int = 3000
+    EMBEDDING_TOKENS_PER_MINUTE: int = 1000000
+    EMBEDDING_MAX_RETRIES: int = 6
+    # Reuse embeddings of previously indexed chunks from the `embeddingcache` table
+    EMBEDDING_CACHE_ENABLED: bool = True
+    # Local embedding backend. "torch" or "onnx" (needs optimum[onnxruntime]) runtime,
+    # optionally with int8 weights. Loaded and warmed up once per process at startup
+    LOCAL_EMBEDDING_MODEL: str = "BAAI/bge-small-en-v1.5"
+    LOCAL_EMBEDDING_RUNTIME: str = "torch"
+    LOCAL_EMBEDDING_QUANTIZE: bool = False
+    LOCAL_EMBEDDING_THREADS: int = max(1, cpu_count() // 2)
+    LOCAL_EMBEDDING_BATCH_SIZE: int = 32
+    LOCAL_EMBEDDING_MAX_LENGTH: int = 512
+    LOCAL_EMBEDDING_POOLING: str = "cls"
+    LOCAL_EMBEDDING_QUERY_INSTRUCTION: str = "Represent this sentence for searching relevant passages: "
 
     # BACKEND_CORS_ORIGINS is a JSON-formatted list of origins
     # e.g: '["http://localhost", "http://localhost:4200", "http://localhost:3000", \
@@ -145,7 +264,8 @@ class Settings(PreviewPrefixedSettings):
         # The recommended number of workers is (2 x $num_cores) + 1:
         # Source: https://docs.gunicorn.org/en/stable/design.html#how-many-workers
         # But the Render.com servers don't have enough memory to support that many workers,
-        # so we instead go by the number of server instances that can be run given the memory
+        # so we instead go by the number of server instances that can be run given the memory.
+        # `poetry run serve` runs memory-sized workers sharing preloaded state instead
         return 1
 
     @property
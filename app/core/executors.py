@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, TypeVar
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Blocking network / disk calls: S3, storage context persistence, sync DB clients, LLM streams
+io_executor = ThreadPoolExecutor(
+    max_workers=settings.IO_EXECUTOR_MAX_WORKERS, thread_name_prefix="io"
+)
+# CPU-heavy work: PDF parsing, chunking, local models. Kept small so it can't starve I/O
+cpu_executor = ThreadPoolExecutor(
+    max_workers=settings.CPU_EXECUTOR_MAX_WORKERS, thread_name_prefix="cpu"
+)
+
+# GIL-bound work that threads can't parallelize, such as PDF text extraction. Started on
+# first use; spawned rather than forked, as forking a process running threads is unsafe
+_process_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_executor() -> ProcessPoolExecutor:
+    global _process_executor
+    if _process_executor is None:
+        _process_executor = ProcessPoolExecutor(
+            max_workers=settings.PDF_PARSER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_executor
+
+
+async def _run_in(executor: Executor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    # Carry context variables over, as asyncio.to_thread does
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking I/O-bound call on the I/O pool.
+    """
+    return await _run_in(io_executor, func, *args, **kwargs)
+
+
+async def run_cpu(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a CPU-bound call on the CPU pool.
+    """
+    return await _run_in(cpu_executor, func, *args, **kwargs)
+
+
+async def run_process(func: Callable[..., T], *args: Any) -> T:
+    """
+    Runs a picklable module-level function on the process pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_executor(), func, *args)
+
+
+async def iterate_io(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """
+    Drives a blocking iterator on the I/O pool, one item at a time.
+    """
+    done = object()
+    while True:
+        item = await run_io(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def iterate_cpu(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """
+    Drives a CPU-bound iterator on the CPU pool, one item at a time.
+    """
+    done = object()
+    while True:
+        item = await run_cpu(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def shutdown_executors() -> None:
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
+    if _process_executor is not None:
+        _process_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class EventLoopLagMonitor:
+    """
+    Periodically measures how late the event loop wakes up from a sleep and logs a
+    warning whenever it was blocked for longer than `threshold_seconds`.
+    """
+
+    def __init__(self, interval_seconds: float, threshold_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_seconds
+        self._task: Optional[asyncio.Task] = None
+        self.stalls = 0
+        self.max_lag_seconds = 0.0
+        self.last_lag_seconds = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="event-loop-lag-monitor")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval_seconds)
+            lag = time.perf_counter() - start - self.interval_seconds
+            self.last_lag_seconds = lag
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+            if lag > self.threshold_seconds:
+                self.stalls += 1
+                logger.warning("Event loop was blocked for %.3fs", lag)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stalls": self.stalls,
+            "threshold_seconds": self.threshold_seconds,
+            "last_lag_seconds": round(self.last_lag_seconds, 4),
+            "max_lag_seconds": round(self.max_lag_seconds, 4),
+        }
+
+
+loop_lag_monitor = EventLoopLagMonitor(
+    interval_seconds=settings.EVENT_LOOP_LAG_CHECK_INTERVAL_SECONDS,
+    threshold_seconds=settings.EVENT_LOOP_LAG_THRESHOLD_SECONDS,
+)
@@ -0,0 +1,211 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from llama_index.callbacks.base_handler import BaseCallbackHandler
+from llama_index.callbacks.schema import CBEventType, EventPayload
+from llama_index.callbacks.token_counting import get_llm_token_counts
+from llama_index.utilities.token_counting import TokenCounter
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.executors import loop_lag_monitor
+from app.core.serving import read_memory_usage
+
+
+logger = logging.getLogger(__name__)
+
+# Spans fast cache hits up to slow streamed LLM answers
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template, until the last byte of the body is sent",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+QUERY_STAGE_LATENCY = Histogram(
+    "query_stage_duration_seconds",
+    "Latency of the stages of /query",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens",
+    "LLM tokens, from the API's usage when reported and the tokenizer otherwise",
+    ["type"],
+)
+EMBEDDING_TOKENS = Counter(
+    "embedding_tokens",
+    "Estimated embedding tokens requested; query embeddings include cache hits",
+    ["source"],
+)
+
+
+@contextmanager
+def observe_query_stage(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        QUERY_STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+class MetricsMiddleware:
+    """
+    Records request latency per route template. Plain ASGI rather than BaseHTTPMiddleware,
+    so streamed responses pass through untouched and the cost is a couple of clock reads.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The matched route is left in the scope by the router. Unmatched paths share
+            # a label so scanners can't blow up the number of series
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], route.path if route is not None else "unmatched", status_code
+            ).observe(time.perf_counter() - start)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Feeds LLM and embedding token counts from llama-index callback events into counters.
+    Unlike `TokenCountingHandler` it keeps no per-event history, so it can stay attached
+    for the lifetime of the process.
+    """
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self._token_counter: Optional[TokenCounter] = None
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        if payload is None:
+            return
+        try:
+            if event_type == CBEventType.LLM:
+                if self._token_counter is None:
+                    self._token_counter = TokenCounter()
+                counts = get_llm_token_counts(self._token_counter, payload)
+                LLM_TOKENS.labels("prompt").inc(counts.prompt_token_count)
+                LLM_TOKENS.labels("completion").inc(counts.completion_token_count)
+            elif event_type == CBEventType.EMBEDDING:
+                # imported here as the embedding stage records its own tokens through this module
+                from app.engine.embeddings import estimate_tokens
+
+                EMBEDDING_TOKENS.labels("query").inc(
+                    sum(estimate_tokens(chunk) for chunk in payload.get(EventPayload.CHUNKS, []))
+                )
+        except Exception:
+            # Metrics must never fail a query
+            logger.exception("Failed to record token metrics")
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        pass
+
+
+metrics_callback_handler = MetricsCallbackHandler()
+
+
+class RuntimeCollector:
+    """
+    DB pool, event loop and process memory gauges, read only when Prometheus scrapes.
+    With several workers they describe the worker serving the scrape, labelled by pid.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+
+    def collect(self) -> Iterator[Any]:
+        pool = self.engine.sync_engine.pool
+        for name, documentation, value in (
+            ("db_pool_size", "Connections the pool keeps open", pool.size()),
+            ("db_pool_checked_out", "Connections currently in use", pool.checkedout()),
+            ("db_pool_checked_in", "Idle connections in the pool", pool.checkedin()),
+            ("db_pool_overflow", "Connections open beyond the pool size", pool.overflow()),
+        ):
+            yield GaugeMetricFamily(name, documentation, value=value)
+        lag = loop_lag_monitor.stats()
+        yield GaugeMetricFamily(
+            "event_loop_lag_seconds", "Last measured event loop lag", value=lag["last_lag_seconds"]
+        )
+        yield CounterMetricFamily(
+            "event_loop_stalls", "Times the event loop lag exceeded the threshold", value=lag["stalls"]
+        )
+        try:
+            memory = read_memory_usage()
+        except OSError:
+            # Not on Linux
+            return
+        family = GaugeMetricFamily(
+            "process_memory_bytes",
+            "Memory of this worker, private being what it doesn't share with the others",
+            labels=["pid", "type"],
+        )
+        for memory_type in ("rss", "pss", "shared", "private"):
+            family.add_metric([str(os.getpid()), memory_type], getattr(memory, memory_type))
+        yield family
+
+
+_runtime_collector: Optional[RuntimeCollector] = None
+
+
+def register_runtime_collector(engine: AsyncEngine) -> None:
+    global _runtime_collector
+    _runtime_collector = RuntimeCollector(engine)
+    REGISTRY.register(_runtime_collector)
+
+
+def render_metrics() -> bytes:
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest()
+    # Preloaded gunicorn workers (app.core.serving): request and token metrics summed
+    # across workers, plus the runtime gauges of this one
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if _runtime_collector is not None:
+        registry.register(_runtime_collector)
+    return generate_latest(registry)
@@ -0,0 +1,277 @@
+import gc
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# cgroup v1 reports "no limit" as a huge number rather than "max"
+_UNLIMITED = 2**60
+
+
+@dataclass
+class MemoryUsage:
+    rss: int
+    # Proportional set size: shared pages divided between the processes sharing them
+    pss: int
+    shared: int
+    private: int
+
+
+def read_memory_usage(pid: Any = "self") -> MemoryUsage:
+    """
+    Memory of a process from /proc/<pid>/smaps_rollup (Linux only). `private` is what
+    forking one more worker costs, as shared copy-on-write pages are counted once.
+    """
+    values: Dict[str, int] = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return MemoryUsage(
+        rss=values.get("Rss", 0),
+        pss=values.get("Pss", 0),
+        shared=values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        private=values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    )
+
+
+def child_pids(pid: Any) -> List[int]:
+    """
+    Pids of a process's children, such as the PDF parser processes a worker spawned.
+    """
+    pids: List[int] = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as file:
+                pids.extend(int(child) for child in file.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as file:
+            value = file.read().strip()
+    except OSError:
+        return None
+    return None if value == "max" else int(value)
+
+
+def _read_stat(path: str, key: str) -> int:
+    try:
+        with open(path) as file:
+            for line in file:
+                name, value = line.split()[:2]
+                if name == key:
+                    return int(value)
+    except OSError:
+        pass
+    return 0
+
+
+def memory_limit_and_usage() -> Tuple[int, int]:
+    """
+    Memory limit and current usage of the container (cgroup v2, then v1), falling back to
+    the host's when unlimited. Usage excludes reclaimable page cache, like `docker stats`.
+    """
+    with open("/proc/meminfo") as file:
+        meminfo = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in file}
+    host_limit = meminfo["MemTotal"]
+    host_usage = meminfo["MemTotal"] - meminfo["MemAvailable"]
+
+    for limit_path, usage_path, stat_path, cache_key in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.stat", "inactive_file"),
+        (
+            "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+            "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+            "/sys/fs/cgroup/memory/memory.stat",
+            "total_inactive_file",
+        ),
+    ):
+        limit = _read_int(limit_path)
+        usage = _read_int(usage_path)
+        if limit is not None and limit < min(host_limit, _UNLIMITED) and usage is not None:
+            return limit, usage - _read_stat(stat_path, cache_key)
+    return host_limit, host_usage
+
+
+def worker_count_for_memory(
+    limit: int, usage: int, current_workers: int, worker_private: int
+) -> int:
+    """
+    Workers fitting in the memory left under the limit (minus the headroom), each new one
+    budgeted at the measured private memory of a running worker plus its expected growth.
+    """
+    available = limit * (1 - settings.SERVING_MEMORY_HEADROOM_FRACTION) - usage
+    per_worker = max(worker_private * settings.SERVING_WORKER_MEMORY_GROWTH_FACTOR, 1)
+    count = current_workers + math.floor(available / per_worker)
+    return max(1, min(count, settings.SERVING_MAX_WORKERS))
+
+
+def preload_shared_state() -> None:
+    """
+    Loads what every worker needs before gunicorn forks them, so the pages are shared
+    copy-on-write instead of being loaded by each worker: the app and llama-index imports,
+    the NLTK sentence tokenizer, the tiktoken encodings and, when enabled, the local
+    embedding and rerank models. Nothing here may start threads, which don't survive a fork.
+    """
+    start = time.perf_counter()
+    from llama_index.node_parser.text.utils import split_by_sentence_tokenizer
+    from llama_index.utils import get_tokenizer
+
+    from app.engine.context_assembly import get_encoding
+
+    try:
+        split_by_sentence_tokenizer()
+    except FileExistsError:
+        logger.info("Tried to re-download NLTK files but already exists.")
+    # The splitter's tokenizer and the synthesis LLM's one
+    get_tokenizer()
+    get_encoding()
+    if settings.EMBEDDING_BACKEND == "local":
+        from app.engine.local_embeddings import create_local_embedding
+
+        create_local_embedding()
+    if settings.RERANK_ENABLED:
+        from app.engine.rerank import create_reranker
+
+        create_reranker()
+
+    # Keep the collector from touching (and so copying) the preloaded objects in workers
+    gc.collect()
+    gc.freeze()
+    logger.info(
+        "Preloaded shared state in %.2fs, master RSS %.0fMB",
+        time.perf_counter() - start,
+        read_memory_usage().rss / MB,
+    )
+
+
+def worker_private_memory(worker: MemoryUsage, parsers: List[MemoryUsage]) -> int:
+    """
+    Private memory a worker costs along with its PDF parser processes. They are started on
+    the first PDF parsed, so those not running yet are budgeted at
+    SERVING_PDF_PARSER_PROCESS_MEMORY_MB each.
+    """
+    missing = max(settings.PDF_PARSER_PROCESSES - len(parsers), 0)
+    return (
+        worker.private
+        + sum(parser.private for parser in parsers)
+        + missing * settings.SERVING_PDF_PARSER_PROCESS_MEMORY_MB * MB
+    )
+
+
+def _size_workers(server: Any) -> None:
+    """
+    Runs in a thread of the gunicorn master: once the first worker has started up and
+    warmed up, measures it (and its PDF parser processes) and sets the worker count that
+    fits in memory.
+    """
+    time.sleep(settings.SERVING_MEASURE_DELAY_SECONDS)
+    try:
+        pids = list(server.WORKERS)
+        if not pids:
+            logger.warning("No worker running to measure, keeping %s workers", server.num_workers)
+            return
+        master = read_memory_usage()
+        workers = {pid: read_memory_usage(pid) for pid in pids}
+        parsers = {pid: [read_memory_usage(child) for child in child_pids(pid)] for pid in pids}
+        limit, usage = memory_limit_and_usage()
+    except OSError:
+        logger.exception("Could not measure memory, keeping %s workers", server.num_workers)
+        return
+
+    worker_private = max(
+        worker_private_memory(worker, parsers[pid]) for pid, worker in workers.items()
+    )
+    count = worker_count_for_memory(limit, usage, len(pids), worker_private)
+    logger.info("Master: RSS %.0fMB", master.rss / MB)
+    for pid, worker in workers.items():
+        logger.info(
+            "Worker %s: RSS %.0fMB, PSS %.0fMB, shared %.0fMB, private %.0fMB, "
+            "%s PDF parser processes with %.0fMB private",
+            pid,
+            worker.rss / MB,
+            worker.pss / MB,
+            worker.shared / MB,
+            worker.private / MB,
+            len(parsers[pid]),
+            sum(parser.private for parser in parsers[pid]) / MB,
+        )
+    logger.info(
+        "Memory limit %.0fMB, %.0fMB in use: running %s workers, budgeting %.0fMB each",
+        limit / MB,
+        usage / MB,
+        count,
+        worker_private * settings.SERVING_WORKER_MEMORY_GROWTH_FACTOR / MB,
+    )
+    if count != server.num_workers:
+        # The same as what SIGTTIN/SIGTTOU do, the arbiter spawns or stops workers to match
+        server.num_workers = count
+        server.wakeup()
+
+
+def _when_ready(server: Any) -> None:
+    if settings.SERVING_WORKER_COUNT is None:
+        threading.Thread(target=_size_workers, args=(server,), name="worker-sizing", daemon=True).start()
+
+
+def _child_exit(server: Any, worker: Any) -> None:
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def run_preloaded_workers(bind: str) -> None:
+    """
+    Serves main:app from gunicorn uvicorn workers forked from a master that preloaded it.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self) -> None:
+            for key, value in {
+                "bind": bind,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "workers": settings.SERVING_WORKER_COUNT or 1,
+                "preload_app": True,
+                # Workers load and warm up models before they heartbeat
+                "timeout": settings.SERVING_WORKER_TIMEOUT_SECONDS,
+                "when_ready": _when_ready,
+                "child_exit": _child_exit,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self) -> Any:
+            from main import app
+
+            preload_shared_state()
+            return app
+
+    PreloadedApplication().run()
+
+
+def serve() -> None:
+    """
+    Launched with `poetry run serve` at root level.
+    """
+    # Metrics are written to files shared by the workers and summed when scraped. This has
+    # to be set before prometheus_client is first imported, which importing main does
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+
+    import main
+
+    main.serve()
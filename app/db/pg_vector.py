@@ -1,11 +1,17 @@
-from llama_index.vector_stores.types import VectorStore
-from llama_index.vector_stores.postgres import PGVectorStore
+from typing import Any, Dict, List
+from uuid import uuid4
+
+from llama_index.schema import BaseNode, MetadataMode
+from llama_index.vector_stores.types import VectorStore, VectorStoreQuery
+from llama_index.vector_stores.postgres import DBEmbeddingRow, PGVectorStore
+from llama_index.vector_stores.utils import node_to_metadata_dict
 from sqlalchemy.engine import make_url
 from app.db.session import SessionLocal as AppSessionLocal, engine as app_engine
 import sqlalchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core.constants import DB_DOC_ID_KEY
 
 singleton_instance = None
 did_run_setup = False
@@ -51,8 +57,205 @@ class CustomPGVectorStore(PGVectorStore):
             async with session.begin():
                 conn = await session.connection()
                 await conn.run_sync(self._base.metadata.create_all)
+
+        async with self._async_session() as session:
+            async with session.begin():
+                for statement in self._index_statements():
+                    await session.execute(sqlalchemy.text(statement))
         did_run_setup = True
 
+    def _index_statements(self) -> List[str]:
+        """
+        HNSW index for the similarity search and an expression index for the per-document
+        metadata filter. Existing tables get these through an alembic migration; this only
+        covers tables freshly created by `run_setup`.
+        """
+        table_name = f"{self.schema_name}.data_{self.table_name}"
+        index_prefix = f"data_{self.table_name}"
+        return [
+            f"CREATE INDEX IF NOT EXISTS {index_prefix}_embedding_hnsw_idx "
+            f"ON {table_name} USING hnsw (embedding vector_cosine_ops) "
+            f"WITH (m = {settings.PGVECTOR_HNSW_M}, ef_construction = {settings.PGVECTOR_HNSW_EF_CONSTRUCTION})",
+            f"CREATE INDEX IF NOT EXISTS {index_prefix}_db_document_id_idx "
+            f"ON {table_name} ((metadata_->>'{DB_DOC_ID_KEY}'))",
+        ]
+
+    def _build_hybrid_query(self, query: VectorStoreQuery) -> Any:
+        """
+        Reciprocal-rank fusion of the vector and full-text searches in a single statement.
+        Each search ranks its own candidates and a node scores the sum of `1 / (k + rank)`
+        over the searches that found it, so exact identifiers that only match lexically
+        still make it into the results.
+        """
+        rrf_k = settings.HYBRID_SEARCH_RRF_K
+        candidates = max(query.similarity_top_k, settings.HYBRID_SEARCH_CANDIDATES)
+        dense = self._build_query(query.query_embedding, candidates, query.filters).subquery()
+        sparse = self._build_sparse_query(
+            query.query_str, query.sparse_top_k or candidates, query.filters
+        ).subquery()
+        dense_ranks = sqlalchemy.select(
+            dense.c.id,
+            sqlalchemy.func.row_number().over(order_by=dense.c.distance.asc()).label("rank"),
+        ).cte("dense")
+        sparse_ranks = sqlalchemy.select(
+            sparse.c.id,
+            sqlalchemy.func.row_number().over(order_by=sparse.c.rank.desc()).label("rank"),
+        ).cte("sparse")
+        score = (
+            sqlalchemy.func.coalesce(1.0 / (rrf_k + dense_ranks.c.rank), 0)
+            + sqlalchemy.func.coalesce(1.0 / (rrf_k + sparse_ranks.c.rank), 0)
+        ).label("score")
+        table = self._table_class
+        return (
+            sqlalchemy.select(table.node_id, table.text, table.metadata_, score)
+            .select_from(
+                dense_ranks.join(sparse_ranks, dense_ranks.c.id == sparse_ranks.c.id, full=True)
+            )
+            .join(table, table.id == sqlalchemy.func.coalesce(dense_ranks.c.id, sparse_ranks.c.id))
+            .order_by(score.desc())
+            .limit(query.similarity_top_k)
+        )
+
+    @staticmethod
+    def _hybrid_rows(result: Any) -> List[DBEmbeddingRow]:
+        return [
+            DBEmbeddingRow(
+                node_id=item.node_id,
+                text=item.text,
+                metadata=item.metadata_,
+                similarity=float(item.score),
+            )
+            for item in result.all()
+        ]
+
+    async def _async_hybrid_query(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> List[DBEmbeddingRow]:
+        stmt = self._build_hybrid_query(query)
+        async with self._async_session() as session, session.begin():
+            if kwargs.get("hnsw_ef_search"):
+                await session.execute(
+                    sqlalchemy.text(f"SET hnsw.ef_search = {int(kwargs['hnsw_ef_search'])}")
+                )
+            return self._hybrid_rows(await session.execute(stmt))
+
+    def _hybrid_query(self, query: VectorStoreQuery, **kwargs: Any) -> List[DBEmbeddingRow]:
+        stmt = self._build_hybrid_query(query)
+        with self._session() as session, session.begin():
+            if kwargs.get("hnsw_ef_search"):
+                session.execute(
+                    sqlalchemy.text(f"SET hnsw.ef_search = {int(kwargs['hnsw_ef_search'])}")
+                )
+            return self._hybrid_rows(session.execute(stmt))
+
+    async def adelete_document_nodes(self, doc_id: str) -> None:
+        """
+        Deletes all nodes that were indexed for the given app document.
+        """
+        self._initialize()
+        async with self._async_session() as session:
+            async with session.begin():
+                statement = sqlalchemy.text(
+                    f"DELETE FROM {self.schema_name}.data_{self.table_name} "
+                    f"WHERE metadata_->>'{DB_DOC_ID_KEY}' = :doc_id"
+                )
+                await session.execute(statement, {"doc_id": doc_id})
+
+    def _node_rows(self, nodes: List[BaseNode], doc_key: str) -> List[Dict[str, Any]]:
+        """
+        Table rows of the nodes, filed under `doc_key` in the filtered metadata column.
+        """
+        rows = []
+        for node in nodes:
+            metadata = node_to_metadata_dict(
+                node, remove_text=True, flat_metadata=self.flat_metadata
+            )
+            metadata[DB_DOC_ID_KEY] = doc_key
+            rows.append(
+                {
+                    "node_id": node.node_id,
+                    "embedding": node.get_embedding(),
+                    "text": node.get_content(metadata_mode=MetadataMode.NONE),
+                    "metadata_": metadata,
+                }
+            )
+        return rows
+
+    async def _insert_rows(
+        self, session: Any, rows: List[Dict[str, Any]], batch_size: int
+    ) -> None:
+        table = self._table_class.__table__
+        for start in range(0, len(rows), batch_size):
+            await session.execute(sqlalchemy.insert(table).values(rows[start:start + batch_size]))
+
+    async def areplace_document_nodes(
+        self, doc_id: str, nodes: List[BaseNode], batch_size: int = 500
+    ) -> List[str]:
+        """
+        Replaces all nodes of the given app document in one transaction, so queries never
+        see a half-written document. Rows go out as multi-row INSERTs of `batch_size`
+        rows instead of one ORM object per node as in `async_add`.
+        """
+        self._initialize()
+        rows = self._node_rows(nodes, doc_id)
+        async with self._async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    sqlalchemy.text(
+                        f"DELETE FROM {self.schema_name}.data_{self.table_name} "
+                        f"WHERE metadata_->>'{DB_DOC_ID_KEY}' = :doc_id"
+                    ),
+                    {"doc_id": doc_id},
+                )
+                await self._insert_rows(session, rows, batch_size)
+        return [node.node_id for node in nodes]
+
+    async def astage_document_nodes(
+        self, staging_id: str, nodes: List[BaseNode], batch_size: int = 500
+    ) -> List[str]:
+        """
+        Writes nodes of a document being rebuilt under `staging_id` (see
+        `staging_document_id`) instead of the document's id, so queries of the document
+        don't see them until `aswap_staged_document_nodes`.
+        """
+        self._initialize()
+        rows = self._node_rows(nodes, staging_id)
+        async with self._async_session() as session:
+            async with session.begin():
+                await self._insert_rows(session, rows, batch_size)
+        return [node.node_id for node in nodes]
+
+    async def aswap_staged_document_nodes(self, doc_id: str, staging_id: str) -> None:
+        """
+        Replaces the document's nodes with the ones staged under `staging_id`, in one
+        transaction that only deletes and relabels rows already in the table.
+        """
+        self._initialize()
+        table_name = f"{self.schema_name}.data_{self.table_name}"
+        async with self._async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    sqlalchemy.text(
+                        f"DELETE FROM {table_name} WHERE metadata_->>'{DB_DOC_ID_KEY}' = :doc_id"
+                    ),
+                    {"doc_id": doc_id},
+                )
+                await session.execute(
+                    sqlalchemy.text(
+                        f"UPDATE {table_name} "
+                        f"SET metadata_ = jsonb_set(metadata_::jsonb, '{{{DB_DOC_ID_KEY}}}', to_jsonb(CAST(:doc_id AS text)))::json "
+                        f"WHERE metadata_->>'{DB_DOC_ID_KEY}' = :staging_id"
+                    ),
+                    {"doc_id": doc_id, "staging_id": staging_id},
+                )
+
+
+def staging_document_id(doc_id: str) -> str:
+    """
+    A unique key to stage the nodes of one rebuild of the document under.
+    """
+    return f"{doc_id}:rebuild:{uuid4()}"
+
 
 async def get_vector_store_singleton() -> VectorStore:
     global singleton_instance
@@ -66,5 +269,9 @@ async def get_vector_store_singleton() -> VectorStore:
         url.username,
         url.password,
         settings.VECTOR_STORE_TABLE_NAME,
+        embed_dim=settings.VECTOR_STORE_EMBED_DIM,
+        # Adds the generated `text_search_tsv` column and its GIN index to the table model
+        hybrid_search=settings.HYBRID_SEARCH_ENABLED,
+        text_search_config=settings.TEXT_SEARCH_CONFIG,
     )
     return singleton_instance
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+from llama_index import VectorStoreIndex
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class IndexCache:
+    """
+    Bounded LRU/TTL cache of ready-to-query indices keyed by document id.
+
+    A warm entry lets `/query` skip the service context, the S3 filesystem and
+    `load_indices_from_storage` entirely. Entries are stored with the `version` of the
+    document's index (its `indexed_at`) and a lookup with another version drops them, so
+    every worker process notices a re-index, not only the one that ran it.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = Lock()
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _lookup(self, doc_id: str, version: Any) -> Optional[VectorStoreIndex]:
+        entry = self._cache.get(doc_id)
+        if entry is None:
+            return None
+        cached_version, index = entry
+        if cached_version != version:
+            # The document was re-indexed, possibly by another worker process
+            del self._cache[doc_id]
+            self.invalidations += 1
+            logger.info("Dropped outdated cached index for document %s", doc_id)
+            return None
+        return index
+
+    def get(self, doc_id: str, version: Any = None) -> Optional[VectorStoreIndex]:
+        with self._lock:
+            index = self._lookup(doc_id, version)
+            if index is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return index
+
+    def peek(self, doc_id: str, version: Any = None) -> Optional[VectorStoreIndex]:
+        """
+        Looks up an entry without counting it as a hit or miss.
+        """
+        with self._lock:
+            return self._lookup(doc_id, version)
+
+    def set(self, doc_id: str, index: VectorStoreIndex, version: Any = None) -> None:
+        with self._lock:
+            self._cache[doc_id] = (version, index)
+
+    def invalidate(self, doc_id: str) -> None:
+        with self._lock:
+            if self._cache.pop(doc_id, None) is not None:
+                self.invalidations += 1
+                logger.info("Invalidated cached index for document %s", doc_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def load_lock(self, doc_id: str) -> asyncio.Lock:
+        """
+        Per-document lock so concurrent misses for the same document only load it once.
+        """
+        with self._lock:
+            lock = self._load_locks.get(doc_id)
+            if lock is None:
+                lock = self._load_locks[doc_id] = asyncio.Lock()
+                # Drop idle locks of documents that have since fallen out of the cache
+                stale_ids = [
+                    key
+                    for key, value in self._load_locks.items()
+                    if key != doc_id and key not in self._cache and not value.locked()
+                ]
+                for stale_id in stale_ids:
+                    del self._load_locks[stale_id]
+            return lock
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttl": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+index_cache = IndexCache(
+    maxsize=settings.INDEX_CACHE_MAX_SIZE,
+    ttl=settings.INDEX_CACHE_TTL_SECONDS,
+)
@@ -1,4 +1,8 @@
+from typing import Optional
+
 from llama_index import ServiceContext
+from llama_index.callbacks import CallbackManager
+from llama_index.embeddings.base import BaseEmbedding
 from llama_index.embeddings.openai import (
     OpenAIEmbedding,
     OpenAIEmbeddingMode,
@@ -9,7 +13,11 @@ from llama_index.node_parser import SentenceSplitter
 
 from app.context import create_base_context
 from app.core.config import settings
+from app.core.metrics import metrics_callback_handler
 from app.engine.constants import NODE_PARSER_CHUNK_OVERLAP, NODE_PARSER_CHUNK_SIZE
+from app.engine.embeddings import StandInEmbedding
+from app.engine.local_embeddings import create_local_embedding
+from app.engine.query_embedding_cache import CachedEmbedding, query_embedding_cache
 
 
 
@@ -17,18 +25,38 @@ OPENAI_TOOL_LLM_NAME = "gpt-3.5-turbo-0613"
 OPENAI_CHAT_LLM_NAME = "gpt-3.5-turbo-0613"
 
 
+def create_embedding_model(max_retries: Optional[int] = None) -> BaseEmbedding:
+    """
+    Builds the embedding model selected by `settings.EMBEDDING_BACKEND`.
+    """
+    if settings.EMBEDDING_BACKEND == "stand_in":
+        return StandInEmbedding()
+    if settings.EMBEDDING_BACKEND == "local":
+        return create_local_embedding()
+    kwargs = {} if max_retries is None else {"max_retries": max_retries}
+    return OpenAIEmbedding(
+        mode=OpenAIEmbeddingMode.SIMILARITY_MODE,
+        model_type=OpenAIEmbeddingModelType.TEXT_EMBED_ADA_002,
+        api_key=settings.OPENAI_API_KEY,
+        api_base=settings.OPENAI_API_BASE,
+        embed_batch_size=settings.EMBEDDING_BATCH_SIZE,
+        **kwargs,
+    )
+
+
 def create_tool_service_context() -> ServiceContext:
     llm = OpenAI(
         temperature=0,
         model=OPENAI_TOOL_LLM_NAME,
         streaming=False,
         api_key=settings.OPENAI_API_KEY,
+        api_base=settings.OPENAI_API_BASE,
     )
-    embedding_model = OpenAIEmbedding(
-        mode=OpenAIEmbeddingMode.SIMILARITY_MODE,
-        model_type=OpenAIEmbeddingModelType.TEXT_EMBED_ADA_002,
-        api_key=settings.OPENAI_API_KEY,
-    )
+    embedding_model = create_embedding_model()
+    if settings.QUERY_EMBEDDING_CACHE_ENABLED:
+        embedding_model = CachedEmbedding(
+            embed_model=embedding_model, cache=query_embedding_cache
+        )
     # Use a smaller chunk size to retrieve more granular results
     node_parser = SentenceSplitter.from_defaults(
         chunk_size=NODE_PARSER_CHUNK_SIZE,
@@ -38,5 +66,6 @@ def create_tool_service_context() -> ServiceContext:
         llm=llm,
         embed_model=embedding_model,
         node_parser=node_parser,
+        callback_manager=CallbackManager([metrics_callback_handler]),
     )
     return service_context
\ No newline at end of file
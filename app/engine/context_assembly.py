@@ -0,0 +1,184 @@
+import functools
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+from llama_index.schema import MetadataMode, NodeWithScore
+
+from app.core.config import settings
+from app.core.constants import DB_DOC_ID_KEY
+from app.core.executors import run_cpu
+
+
+# Chunks of the same page overlap by NODE_PARSER_CHUNK_OVERLAP tokens, so a shared run of
+# this many characters reliably marks two chunks as neighbours
+MIN_OVERLAP_CHARS = 24
+# A trimmed chunk shorter than this is more noise than context, so it's dropped instead
+MIN_TRUNCATED_TOKENS = 32
+
+_token_counts = LRUCache(maxsize=settings.CONTEXT_TOKEN_COUNT_CACHE_SIZE)
+_token_counts_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def get_encoding() -> Any:
+    """
+    The tokenizer of the synthesis LLM, loaded once per process.
+    """
+    import tiktoken
+
+    # imported here as the service context module pulls in the embedding models
+    from app.engine.context import OPENAI_TOOL_LLM_NAME
+
+    return tiktoken.encoding_for_model(OPENAI_TOOL_LLM_NAME)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count of `text`, memoized as the same chunks come back for many queries.
+    """
+    key = (hash(text), len(text))
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+    if count is None:
+        count = len(get_encoding().encode(text, disallowed_special=()))
+        with _token_counts_lock:
+            _token_counts[key] = count
+    return count
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def _merge_overlapping(first: str, second: str) -> Optional[str]:
+    """
+    Joins two chunks if one contains the other or the tail of `first` is the head of
+    `second`, returning None if they don't overlap.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    if len(second) < MIN_OVERLAP_CHARS:
+        return None
+    # The earliest match is the longest overlap
+    start = first.find(second[:MIN_OVERLAP_CHARS])
+    while start >= 0:
+        if second.startswith(first[start:]):
+            return first[:start] + second
+        start = first.find(second[:MIN_OVERLAP_CHARS], start + 1)
+    return None
+
+
+def _with_text(node: NodeWithScore, text: str, score: Optional[float]) -> NodeWithScore:
+    new_node = node.node.copy()
+    new_node.set_content(text)
+    return NodeWithScore(node=new_node, score=score)
+
+
+@dataclass
+class AssembledContext:
+    nodes: List[NodeWithScore]
+    tokens: int = 0
+    merged: int = 0
+    dropped: int = 0
+    truncated: int = 0
+
+
+def dedupe_nodes(nodes: List[NodeWithScore]) -> Tuple[List[NodeWithScore], int]:
+    """
+    Merges chunks of the same page that overlap or repeat one another into a single chunk,
+    keeping the rank and best score of the first. Returns the nodes and how many were merged.
+    """
+    kept: List[NodeWithScore] = []
+    merged = 0
+    for node in nodes:
+        text = node.node.get_content(metadata_mode=MetadataMode.NONE)
+        page = (node.node.metadata.get(DB_DOC_ID_KEY), node.node.metadata.get("page_label"))
+        for i, other in enumerate(kept):
+            if page != (other.node.metadata.get(DB_DOC_ID_KEY), other.node.metadata.get("page_label")):
+                continue
+            other_text = other.node.get_content(metadata_mode=MetadataMode.NONE)
+            joined = _merge_overlapping(other_text, text) or _merge_overlapping(text, other_text)
+            if joined is not None:
+                score = max((s for s in (other.score, node.score) if s is not None), default=None)
+                kept[i] = _with_text(other, joined, score)
+                merged += 1
+                break
+        else:
+            kept.append(node)
+    return kept, merged
+
+
+def assemble_context(nodes: List[NodeWithScore], token_budget: int) -> AssembledContext:
+    """
+    Dedupes the retrieved chunks and keeps them, in rank order, until `token_budget`
+    tokens of chunk text are used. The chunk crossing the budget is cut to fit.
+    """
+    nodes, merged = dedupe_nodes(nodes)
+    context = AssembledContext(nodes=[], merged=merged)
+    for node in nodes:
+        remaining = token_budget - context.tokens
+        text = node.node.get_content(metadata_mode=MetadataMode.NONE)
+        tokens = count_tokens(text)
+        if tokens <= remaining:
+            context.nodes.append(node)
+            context.tokens += tokens
+        elif remaining >= MIN_TRUNCATED_TOKENS:
+            context.nodes.append(_with_text(node, _truncate(text, remaining), node.score))
+            context.tokens += remaining
+            context.truncated += 1
+        else:
+            context.dropped += 1
+    return context
+
+
+async def aassemble_context(nodes: List[NodeWithScore], token_budget: int) -> AssembledContext:
+    # Tokenizing a few thousand tokens is quick, but still CPU work off the event loop
+    return await run_cpu(assemble_context, nodes, token_budget)
+
+
+class ContextStats:
+    """
+    Prompt size counters: query plus context tokens sent to synthesis per query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.last_prompt_tokens = 0
+        self.merged = 0
+        self.dropped = 0
+        self.truncated = 0
+
+    def record(self, query_tokens: int, context: AssembledContext) -> int:
+        prompt_tokens = query_tokens + context.tokens
+        with self._lock:
+            self.queries += 1
+            self.prompt_tokens += prompt_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+            self.last_prompt_tokens = prompt_tokens
+            self.merged += context.merged
+            self.dropped += context.dropped
+            self.truncated += context.truncated
+        return prompt_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.queries, 1) if self.queries else 0.0,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "last_prompt_tokens": self.last_prompt_tokens,
+                "merged_chunks": self.merged,
+                "dropped_chunks": self.dropped,
+                "truncated_chunks": self.truncated,
+            }
+
+
+context_stats = ContextStats()
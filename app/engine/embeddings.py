@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import struct
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+from llama_index.bridge.pydantic import Field
+from llama_index.embeddings.base import BaseEmbedding, Embedding
+from llama_index.schema import BaseNode, MetadataMode
+
+from app.core.config import settings
+from app.core.metrics import EMBEDDING_TOKENS
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `rate_per_minute` up to `capacity`.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        # A single request larger than the bucket can only ever wait for a full bucket
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate_per_second)
+                self._refill()
+            self._tokens -= amount
+
+
+@dataclass
+class EmbeddingStats:
+    texts: int = 0
+    batches: int = 0
+    retries: int = 0
+    estimated_tokens: int = 0
+    seconds: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        values = {**asdict(self), "cache_hit_ratio": self.cache_hit_ratio}
+        return {key: round(value, 3) if isinstance(value, float) else value for key, value in values.items()}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, good enough for rate limiting
+    return len(text) // 4 + 1
+
+
+def _is_retryable(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    # Connection errors and timeouts don't carry a status code
+    return isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)) or (
+        type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+    )
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingStage:
+    """
+    Embeds texts in fixed-size batches with a bounded number of requests in flight.
+    Requests are paced by request and token buckets sized to the API quota, and
+    rate-limited or transient failures are retried with full-jitter exponential backoff.
+    """
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        batch_size: int = 64,
+        max_in_flight: int = 4,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 6,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 30.0,
+        use_persistent_cache: bool = False,
+    ):
+        self.embed_model = embed_model
+        self.use_persistent_cache = use_persistent_cache
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    @property
+    def model_name(self) -> str:
+        return self.embed_model.model_name
+
+    async def _embed_batch(self, texts: List[str], stats: EmbeddingStats) -> List[Embedding]:
+        tokens = sum(estimate_tokens(text) for text in texts)
+        attempt = 0
+        while True:
+            if self._request_bucket is not None:
+                await self._request_bucket.acquire(1)
+            if self._token_bucket is not None:
+                await self._token_bucket.acquire(tokens)
+            try:
+                async with self._semaphore:
+                    embeddings = await self.embed_model._aget_text_embeddings(texts)
+                stats.batches += 1
+                stats.estimated_tokens += tokens
+                EMBEDDING_TOKENS.labels("indexing").inc(tokens)
+                return embeddings
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                delay = _retry_after_seconds(e) or random.uniform(
+                    0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2**attempt)
+                )
+                attempt += 1
+                stats.retries += 1
+                logger.warning(
+                    "Embedding batch failed (%s), retry %s/%s in %.2fs",
+                    e, attempt, self.max_retries, delay,
+                )
+                await asyncio.sleep(delay)
+
+    async def aembed_texts(self, texts: List[str], stats: Optional[EmbeddingStats] = None) -> List[Embedding]:
+        stats = stats if stats is not None else EmbeddingStats()
+        start = time.perf_counter()
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch, stats) for batch in batches))
+        stats.texts += len(texts)
+        stats.seconds += time.perf_counter() - start
+        return [embedding for embeddings in results for embedding in embeddings]
+
+    async def _aembed_texts_with_cache(self, texts: List[str], stats: EmbeddingStats) -> List[Embedding]:
+        """
+        Serves texts from the Postgres embedding cache and only embeds (and then caches) the misses.
+        """
+        # imported here to keep the stage usable without a database, e.g. in benchmarks
+        from app.db.session import SessionLocal
+        from app.services.embedding_cache import (
+            fetch_cached_embeddings,
+            hash_text,
+            insert_cached_embeddings,
+        )
+
+        text_hashes = [hash_text(text) for text in texts]
+        async with SessionLocal() as db:
+            cached = await fetch_cached_embeddings(db, self.model_name, text_hashes)
+
+        # Identical texts within the batch are only embedded once
+        missing = {
+            text_hash: text for text_hash, text in zip(text_hashes, texts) if text_hash not in cached
+        }
+        hits = sum(1 for text_hash in text_hashes if text_hash in cached)
+        stats.cache_hits += hits
+        stats.cache_misses += len(texts) - hits
+        if missing:
+            embeddings = await self.aembed_texts(list(missing.values()), stats=stats)
+            new_embeddings = dict(zip(missing.keys(), embeddings))
+            async with SessionLocal() as db:
+                await insert_cached_embeddings(db, self.model_name, new_embeddings)
+            cached.update(new_embeddings)
+        return [cached[text_hash] for text_hash in text_hashes]
+
+    async def aembed_nodes(self, nodes: List[BaseNode], stats: Optional[EmbeddingStats] = None) -> List[BaseNode]:
+        """
+        Sets embeddings on the nodes that don't have one yet, so that inserting them
+        into the index won't trigger another round of embedding calls.
+        """
+        stats = stats if stats is not None else EmbeddingStats()
+        pending = [node for node in nodes if node.embedding is None]
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in pending]
+        if self.use_persistent_cache:
+            embeddings = await self._aembed_texts_with_cache(texts, stats=stats)
+        else:
+            embeddings = await self.aembed_texts(texts, stats=stats)
+        for node, embedding in zip(pending, embeddings):
+            node.embedding = embedding
+        return nodes
+
+
+class StandInRateLimitError(Exception):
+    status_code = 429
+
+
+class StandInEmbedding(BaseEmbedding):
+    """
+    Deterministic offline stand-in for the remote embedding API.
+    Vectors are derived from a hash of the text, and an optional simulated latency and
+    rate-limit error rate make it usable for benchmarking the embedding stage.
+    """
+
+    dimensions: int = Field(default=1536, description="Size of the generated vectors.")
+    latency_seconds: float = Field(default=0.0, description="Simulated latency per request.")
+    error_rate: float = Field(default=0.0, description="Fraction of requests failing with a 429.")
+    model_name: str = Field(default="stand-in", description="The name of the embedding model.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StandInEmbedding"
+
+    def _embed(self, text: str) -> Embedding:
+        values: List[float] = []
+        counter = 0
+        while len(values) < self.dimensions:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend(value / 2**31 - 1 for value in struct.unpack("<8I", digest))
+            counter += 1
+        values = values[: self.dimensions]
+        norm = math.sqrt(sum(value * value for value in values)) or 1.0
+        return [value / norm for value in values]
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and random.random() < self.error_rate:
+            raise StandInRateLimitError("Simulated rate limit")
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        time.sleep(self.latency_seconds)
+        self._maybe_fail()
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        await asyncio.sleep(self.latency_seconds)
+        self._maybe_fail()
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_query_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        time.sleep(self.latency_seconds)
+        self._maybe_fail()
+        return [self._embed(text) for text in texts]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        await asyncio.sleep(self.latency_seconds)
+        self._maybe_fail()
+        return [self._embed(text) for text in texts]
+
+
+_embedding_stage: Optional[EmbeddingStage] = None
+
+
+def get_embedding_stage() -> EmbeddingStage:
+    """
+    Process-wide embedding stage, so that every indexing run shares the same
+    rate limits and in-flight budget.
+    """
+    global _embedding_stage
+    if _embedding_stage is None:
+        # imported here as the service context module builds on this one
+        from app.engine.context import create_embedding_model
+
+        # A local model has no API quota, and a single batch already uses all its threads
+        remote = settings.EMBEDDING_BACKEND != "local"
+        _embedding_stage = EmbeddingStage(
+            # The stage handles retries itself, so don't let the client retry on top of it
+            embed_model=create_embedding_model(max_retries=0),
+            batch_size=settings.EMBEDDING_BATCH_SIZE if remote else settings.LOCAL_EMBEDDING_BATCH_SIZE,
+            max_in_flight=settings.EMBEDDING_MAX_IN_FLIGHT if remote else 1,
+            requests_per_minute=settings.EMBEDDING_REQUESTS_PER_MINUTE if remote else None,
+            tokens_per_minute=settings.EMBEDDING_TOKENS_PER_MINUTE if remote else None,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+            use_persistent_cache=settings.EMBEDDING_CACHE_ENABLED,
+        )
+    return _embedding_stage
@@ -1,13 +1,13 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 import logging
+import time
 
 from pathlib import Path
 from tempfile import TemporaryDirectory
-import requests
-from fsspec.asyn import AsyncFileSystem
 
 
-from cachetools import cached, TTLCache
+import s3fs
+from cachetools import TTLCache
 from datetime import timedelta
 
 from llama_index import (
@@ -17,12 +17,12 @@ from llama_index import (
     load_indices_from_storage,
 )
 from llama_index.indices.query.base import BaseQueryEngine
-from llama_index.readers.file.docs_reader import PDFReader
 from llama_index.schema import Document as LlamaIndexDocument
 from llama_index.vector_stores.types import (
     VectorStore,
     MetadataFilters,
     ExactMatchFilter,
+    VectorStoreQueryMode,
 )
 
 
@@ -32,24 +32,80 @@ from app.core.constants import (
     DB_DOC_ID_KEY
 )
 from app.core.config import settings
-from app.db.pg_vector import get_vector_store_singleton
+from app.core.executors import run_io
+from app.db.pg_vector import get_vector_store_singleton, staging_document_id
+from app.engine.cache import index_cache
+from app.engine.context import create_tool_service_context
+from app.engine.embeddings import EmbeddingStats, get_embedding_stage
+from app.engine.ingestion import download_document, iter_node_batches, iter_pdf_pages, prefetch
+from app.engine.progress import IndexingProgress
+from app.engine.semantic_cache import semantic_answer_cache
+from app.engine.storage import (
+    aload_storage_context,
+    apersist_storage_context,
+    document_persist_dir,
+    extract_document_storage_context,
+)
+from app.utils.file_utils import get_async_s3_fs
 
 
 
 logger = logging.getLogger(__name__)
 
 
-@cached(
-    TTLCache(maxsize=10, ttl=timedelta(minutes=5).total_seconds()),
-    key=lambda *args, **kwargs: "global_storage_context",
-)
-def get_storage_context(
-    persist_dir: str, vector_store: VectorStore, fs: Optional[AsyncFileSystem] = None
+_storage_context_cache = TTLCache(maxsize=10, ttl=timedelta(minutes=5).total_seconds())
+
+
+async def get_storage_context(
+    persist_dir: str, vector_store: VectorStore, fs: s3fs.S3FileSystem
 ) -> StorageContext:
-    logger.info("Creating new storage context.")
-    return StorageContext.from_defaults(
-        persist_dir=persist_dir, vector_store=vector_store, fs=fs
+    """
+    The legacy storage context holding every document in one docstore/index store blob.
+    It is only read to migrate documents indexed before storage was sharded per document.
+    """
+    storage_context = _storage_context_cache.get(persist_dir)
+    if storage_context is None:
+        logger.info("Creating new storage context.")
+        storage_context = await aload_storage_context(persist_dir, vector_store, fs)
+        _storage_context_cache[persist_dir] = storage_context
+    return storage_context
+
+
+async def load_document_storage_context(
+    persist_dir: str, doc_id: str, vector_store: VectorStore, fs: s3fs.S3FileSystem
+) -> StorageContext:
+    """
+    Loads only the given document's docstore and index store.
+    Raises FileNotFoundError when nothing was persisted for the document.
+    """
+    doc_persist_dir = document_persist_dir(persist_dir, doc_id)
+    try:
+        return await aload_storage_context(doc_persist_dir, vector_store, fs)
+    except FileNotFoundError:
+        if not settings.DOCSTORE_LEGACY_FALLBACK_ENABLED:
+            raise
+
+    # Copy documents indexed before sharding out of the global blob, once
+    legacy_storage_context = await get_storage_context(persist_dir, vector_store, fs)
+    storage_context = extract_document_storage_context(
+        legacy_storage_context, doc_id, vector_store
     )
+    if storage_context.index_store.get_index_struct(doc_id) is None:
+        raise FileNotFoundError(f"No index persisted for document {doc_id}")
+    await apersist_storage_context(storage_context, doc_persist_dir, fs)
+    logger.info("Migrated document %s to per-document storage.", doc_id)
+    return storage_context
+
+
+
+def invalidate_document_index(doc_id: str) -> None:
+    """
+    Drops every cached view of a document's index in this process after it has been
+    (re)built. Other worker processes drop theirs once they see the new `indexed_at`.
+    """
+    index_cache.invalidate(doc_id)
+    # Answers given from the previous version of the document are stale
+    semantic_answer_cache.invalidate(doc_id)
 
 
 
@@ -60,79 +116,182 @@ def build_description_for_document(document: DocumentSchema) -> str:
 
 
 
+def vector_store_query_kwargs(ef_search: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Per-query options passed through the retriever to the pg vector store.
+    """
+    return {"hnsw_ef_search": ef_search or settings.PGVECTOR_HNSW_EF_SEARCH}
+
+
+def retriever_query_kwargs() -> Dict[str, Any]:
+    """
+    Retriever options selecting hybrid lexical + vector search when it's enabled.
+    """
+    if not settings.HYBRID_SEARCH_ENABLED:
+        return {}
+    return {"vector_store_query_mode": VectorStoreQueryMode.HYBRID}
+
+
 def index_to_query_engine(doc_id: str, index: VectorStoreIndex) -> BaseQueryEngine:
     filters = MetadataFilters(
         filters=[ExactMatchFilter(key=DB_DOC_ID_KEY, value=doc_id)]
     )
-    kwargs = {"similarity_top_k": 3, "filters": filters}
+    kwargs = {
+        "similarity_top_k": 3,
+        "filters": filters,
+        "vector_store_kwargs": vector_store_query_kwargs(),
+        **retriever_query_kwargs(),
+    }
     return index.as_query_engine(**kwargs)
 
 
-def fetch_and_read_document(
+async def fetch_and_read_document(
     document: DocumentSchema,
 ) -> List[LlamaIndexDocument]:
-    # Super hacky approach to get this to feature complete on time.
-    # TODO: Come up with better abstractions for this and the other methods in this module.
+    """
+    Downloads the document and returns all of its pages.
+    Indexing streams pages through `iter_pdf_pages` instead of collecting them here.
+    """
     with TemporaryDirectory() as temp_dir:
         temp_file_path = Path(temp_dir) / f"{str(document.id)}.pdf"
-        with open(temp_file_path, "wb") as temp_file:
-            with requests.get(document.url, stream=True) as r:
-                r.raise_for_status()
-                for chunk in r.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-            temp_file.seek(0)
-            reader = PDFReader()
-            return reader.load_data(
+        await download_document(document.url, temp_file_path)
+        return [
+            page
+            async for page in iter_pdf_pages(
                 temp_file_path, extra_info={DB_DOC_ID_KEY: str(document.id)}
             )
+        ]
 
 
 async def create_index_from_doc(
     service_context: ServiceContext,
     document: DocumentSchema,
-    fs: Optional[AsyncFileSystem] = None,
+    fs: Optional[s3fs.S3FileSystem] = None,
+    progress: Optional[IndexingProgress] = None,
+    force_rebuild: bool = False,
 ):
-    
+    """
+    Loads the document's index from storage, building it if it doesn't exist yet.
+    With `force_rebuild` any existing index and vector nodes of the document are
+    discarded and the index is built from the current file contents. The new nodes are
+    written batch by batch under a staging id and swapped in once they are all written.
+    """
     persist_dir = f"{settings.S3_BUCKET_NAME}"
+    fs = fs or get_async_s3_fs()
+    progress = progress or IndexingProgress()
+    doc_id_to_index = None
 
     vector_store = await get_vector_store_singleton()
-    try:
-        try:
-            storage_context = get_storage_context(persist_dir, vector_store, fs=fs)
-        except FileNotFoundError:
-            logger.info(
-                "Could not find storage context in S3. Creating new storage context."
-            )
-            storage_context = StorageContext.from_defaults(
-                vector_store=vector_store, fs=fs
-            )
-            storage_context.persist(persist_dir=persist_dir, fs=fs)
-        index_ids = [str(document.id)]
-        indices = load_indices_from_storage(
-            storage_context,
-            index_ids=index_ids,
-            service_context=service_context,
-        )
-        doc_id_to_index = dict(zip(index_ids, indices))
-        logger.debug("Loaded indices from storage.")
-    except ValueError:
-        logger.error(
-            "Failed to load indices from storage. Creating new indices. "
-            "If you're running the seed_db script, this is normal and expected."
-        )
-        storage_context = StorageContext.from_defaults(
-            persist_dir=persist_dir, vector_store=vector_store, fs=fs
-        )
+    if not force_rebuild:
+        async with progress.stage("load") as stage:
+            try:
+                storage_context = await load_document_storage_context(
+                    persist_dir, str(document.id), vector_store, fs
+                )
+                index_ids = [str(document.id)]
+                indices = load_indices_from_storage(
+                    storage_context,
+                    index_ids=index_ids,
+                    service_context=service_context,
+                )
+                doc_id_to_index = dict(zip(index_ids, indices))
+                logger.debug("Loaded indices from storage.")
+                stage["found"] = True
+            except (FileNotFoundError, ValueError):
+                logger.error(
+                    "Failed to load indices from storage. Creating new indices. "
+                    "If you're running the seed_db script, this is normal and expected."
+                )
+                stage["found"] = False
+
+    if doc_id_to_index is None:
+        # A fresh storage context holds just this document and replaces its previous shard
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
         doc_id_to_index = {}
 
-        llama_index_docs = fetch_and_read_document(document)
-        storage_context.docstore.add_documents(llama_index_docs)
-        index = VectorStoreIndex.from_documents(
-            llama_index_docs,
+        index = VectorStoreIndex(
+            nodes=[],
             storage_context=storage_context,
             service_context=service_context,
         )
         index.set_index_id(str(document.id))
-        index.storage_context.persist(persist_dir=persist_dir, fs=fs)
+
+        # A rebuild writes its nodes under a staging id, keeping the previous ones
+        # queryable until all the new ones are written, then swaps them in
+        staging_id = staging_document_id(str(document.id)) if force_rebuild else None
+        try:
+            with TemporaryDirectory() as temp_dir:
+                temp_file_path = Path(temp_dir) / f"{str(document.id)}.pdf"
+                async with progress.stage("fetch") as stage:
+                    stage["bytes"] = await download_document(document.url, temp_file_path)
+
+                # Pages are parsed and chunked in the background while the previous
+                # batch of nodes is being embedded and written to the vector store.
+                async with progress.stage("ingest") as stage:
+                    start = time.perf_counter()
+                    pages = iter_pdf_pages(
+                        temp_file_path, extra_info={DB_DOC_ID_KEY: str(document.id)}
+                    )
+                    batches = iter_node_batches(
+                        pages,
+                        service_context.transformations,
+                        batch_size=settings.INDEXING_NODE_BATCH_SIZE,
+                    )
+                    embedding_stage = get_embedding_stage()
+                    embedding_stats = EmbeddingStats()
+                    stage.update(pages=0, chunks=0)
+                    async for page_docs, nodes in prefetch(batches):
+                        storage_context.docstore.add_documents(page_docs)
+                        nodes = await embedding_stage.aembed_nodes(nodes, stats=embedding_stats)
+                        if staging_id is not None:
+                            await vector_store.astage_document_nodes(staging_id, nodes)
+                        else:
+                            await run_io(index.insert_nodes, nodes)
+                        if not stage["chunks"] and nodes:
+                            stage["first_chunk_seconds"] = round(time.perf_counter() - start, 3)
+                        stage["pages"] += len(page_docs)
+                        stage["chunks"] += len(nodes)
+                    stage["embedding"] = embedding_stats.to_dict()
+                    logger.info(
+                        "Embedded document %s: %s chunks, cache hit ratio %.2f",
+                        document.id, stage["chunks"], embedding_stats.cache_hit_ratio,
+                    )
+
+            if staging_id is not None:
+                async with progress.stage("replace"):
+                    await vector_store.aswap_staged_document_nodes(str(document.id), staging_id)
+        except BaseException:
+            if staging_id is not None:
+                await vector_store.adelete_document_nodes(staging_id)
+            raise
+
+        async with progress.stage("persist"):
+            await apersist_storage_context(
+                index.storage_context, document_persist_dir(persist_dir, str(document.id)), fs
+            )
         doc_id_to_index[str(document.id)] = index
-    return doc_id_to_index
\ No newline at end of file
+    return doc_id_to_index
+
+
+async def get_index_for_document(document: DocumentSchema) -> VectorStoreIndex:
+    """
+    Returns a ready-to-query index for the document.
+    Served from the in-process index cache when warm, so repeat queries never touch S3.
+    """
+    doc_id = str(document.id)
+    index = index_cache.get(doc_id, version=document.indexed_at)
+    if index is not None:
+        return index
+
+    async with index_cache.load_lock(doc_id):
+        # Another request may have loaded it while we were waiting for the lock
+        index = index_cache.peek(doc_id, version=document.indexed_at)
+        if index is not None:
+            return index
+        service_context = create_tool_service_context()
+        doc_id_to_index = await create_index_from_doc(
+            service_context=service_context, document=document
+        )
+        index = doc_id_to_index[doc_id]
+        index_cache.set(doc_id, index, version=document.indexed_at)
+        return index
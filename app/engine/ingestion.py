@@ -0,0 +1,198 @@
+import asyncio
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import httpx
+from llama_index.ingestion import run_transformations
+from llama_index.node_parser import SentenceSplitter
+from llama_index.schema import BaseNode, Document as LlamaIndexDocument, TransformComponent
+
+from app.core.config import settings
+from app.core.constants import DB_DOC_ID_KEY
+from app.core.executors import iterate_cpu, run_cpu, run_process
+from app.engine.constants import NODE_PARSER_CHUNK_OVERLAP, NODE_PARSER_CHUNK_SIZE
+from app.utils.file_utils import get_async_s3_fs, get_s3_path_from_url
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Metadata specific to a document or indexing run rather than to the chunk's content
+EMBED_EXCLUDED_METADATA_KEYS = ("file_name", DB_DOC_ID_KEY)
+
+
+async def download_document(url: str, destination: Path) -> int:
+    """
+    Streams the document at `url` into `destination` without blocking the event loop.
+    Documents in our own bucket are read through the shared S3 filesystem.
+    Returns the number of bytes written.
+    """
+    s3_path = get_s3_path_from_url(url)
+    if s3_path is not None:
+        await get_async_s3_fs()._get_file(s3_path, str(destination))
+        return destination.stat().st_size
+
+    size = 0
+    timeout = httpx.Timeout(settings.DOCUMENT_FETCH_TIMEOUT_SECONDS)
+    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            with open(destination, "wb") as file:
+                async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    size += len(chunk)
+    return size
+
+
+def _read_pdf_pages(
+    path: Path, extra_info: Dict[str, Any], start: int = 0, stop: Optional[int] = None
+) -> Iterator[LlamaIndexDocument]:
+    """
+    Lazily extracts one llama-index Document per PDF page in `[start, stop)`,
+    mirroring `PDFReader.load_data`.
+    """
+    import pypdf
+
+    with open(path, "rb") as fp:
+        pdf = pypdf.PdfReader(fp)
+        # `page_labels` walks the whole page tree, so only compute it once per call
+        page_labels = pdf.page_labels
+        stop = len(pdf.pages) if stop is None else stop
+        for page_number in range(start, stop):
+            metadata = {"page_label": page_labels[page_number], "file_name": Path(path).name}
+            metadata.update(extra_info)
+            yield LlamaIndexDocument(
+                text=pdf.pages[page_number].extract_text(),
+                metadata=metadata,
+                # Kept out of the embedded (and reranked) text, so the same chunk embeds the
+                # same in every document and run, and the embedding cache can serve it
+                excluded_embed_metadata_keys=list(EMBED_EXCLUDED_METADATA_KEYS),
+            )
+
+
+def _count_pdf_pages(path: Path) -> int:
+    import pypdf
+
+    return len(pypdf.PdfReader(path).pages)
+
+
+def _read_pdf_page_range(
+    path: Path, extra_info: Dict[str, Any], start: int, stop: int
+) -> List[LlamaIndexDocument]:
+    # Runs in a worker process, which has to return the pages all at once
+    return list(_read_pdf_pages(path, extra_info, start, stop))
+
+
+async def iter_pdf_pages(path: Path, extra_info: Dict[str, Any]) -> AsyncIterator[LlamaIndexDocument]:
+    """
+    Yields PDF pages in order as they are parsed, doing the parsing off the event loop.
+    Page ranges of `PDF_PARSER_PAGES_PER_TASK` pages are parsed in parallel on the
+    process pool, with at most two ranges per worker process in flight.
+    """
+    if settings.PDF_PARSER_PROCESSES <= 0:
+        async for page in iterate_cpu(_read_pdf_pages(path, extra_info)):
+            yield page
+        return
+
+    page_count = await run_cpu(_count_pdf_pages, path)
+    pages_per_task = settings.PDF_PARSER_PAGES_PER_TASK
+    ranges = iter(
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    )
+    in_flight: Deque[asyncio.Future] = deque()
+
+    def submit_next() -> None:
+        page_range = next(ranges, None)
+        if page_range is not None:
+            in_flight.append(
+                asyncio.ensure_future(
+                    run_process(_read_pdf_page_range, path, extra_info, *page_range)
+                )
+            )
+
+    try:
+        for _ in range(settings.PDF_PARSER_PROCESSES * 2):
+            submit_next()
+        while in_flight:
+            pages = await in_flight.popleft()
+            submit_next()
+            for page in pages:
+                yield page
+    finally:
+        for future in in_flight:
+            future.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+def parse_and_chunk_pdf(
+    path: str, extra_info: Dict[str, Any]
+) -> Tuple[List[LlamaIndexDocument], List[BaseNode]]:
+    """
+    Parses a PDF and chunks it with the same splitter as `create_tool_service_context`.
+    Meant to run on a process pool: it only takes and returns picklable values.
+    """
+    pages = list(_read_pdf_pages(Path(path), extra_info))
+    node_parser = SentenceSplitter.from_defaults(
+        chunk_size=NODE_PARSER_CHUNK_SIZE,
+        chunk_overlap=NODE_PARSER_CHUNK_OVERLAP,
+    )
+    return pages, run_transformations(pages, [node_parser])
+
+
+async def iter_node_batches(
+    pages: AsyncIterator[LlamaIndexDocument],
+    transformations: List[TransformComponent],
+    batch_size: int,
+) -> AsyncIterator[Tuple[List[LlamaIndexDocument], List[BaseNode]]]:
+    """
+    Chunks pages into nodes and yields them in batches of roughly `batch_size` nodes,
+    together with the pages they came from.
+    """
+    batch_pages: List[LlamaIndexDocument] = []
+    batch_nodes: List[BaseNode] = []
+    async for page in pages:
+        batch_pages.append(page)
+        batch_nodes.extend(
+            await run_cpu(run_transformations, [page], transformations)
+        )
+        if len(batch_nodes) >= batch_size:
+            yield batch_pages, batch_nodes
+            batch_pages, batch_nodes = [], []
+    if batch_pages:
+        yield batch_pages, batch_nodes
+
+
+async def prefetch(iterator: AsyncIterator[T], maxsize: int = 2) -> AsyncIterator[T]:
+    """
+    Drives `iterator` in a background task so the producer keeps working while the
+    consumer handles the previous item. At most `maxsize` items are buffered.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+    done = object()
+
+    async def produce() -> None:
+        try:
+            async for item in iterator:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from uuid import UUID
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.engine.context import create_tool_service_context
+from app.engine.indexing import (
+    create_index_from_doc,
+    index_to_query_engine,
+    invalidate_document_index,
+)
+from app.engine.progress import IndexingProgress
+from app.models.db import IndexingJobStatus
+from app.schemas.base import DocumentSchema, IndexingJobSchema
+from app.services.document import fetch_documents, mark_document_indexed
+from app.services.indexing_job import (
+    claim_stale_indexing_jobs,
+    create_indexing_job,
+    fetch_indexing_job,
+    touch_indexing_jobs,
+    update_indexing_job,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class IndexingQueueFull(Exception):
+    pass
+
+
+class IndexingJobQueue:
+    """
+    Bounded in-process worker pool that runs indexing jobs in the background.
+    Job state and per-stage progress are persisted to the `indexingjob` table. The jobs of
+    this process are heartbeated there, and jobs whose process stopped heartbeating (a
+    restart or deploy) are taken over and run again.
+    """
+
+    def __init__(self, worker_count: int, max_queue_size: int):
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue[Tuple[UUID, DocumentSchema]]] = None
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._done_events: Dict[UUID, asyncio.Event] = {}
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"indexing-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(), name="indexing-heartbeat")
+        logger.info("Started %s indexing workers", self.worker_count)
+
+    async def stop(self) -> None:
+        tasks = self._workers + ([self._heartbeat_task] if self._heartbeat_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat_task = None
+
+    async def enqueue(self, document: DocumentSchema) -> IndexingJobSchema:
+        if self._queue is None:
+            raise RuntimeError("Indexing job queue has not been started")
+        if self._queue.full():
+            raise IndexingQueueFull()
+        async with SessionLocal() as db:
+            job = await create_indexing_job(db, document_id=document.id)
+        self._done_events[job.id] = asyncio.Event()
+        self._queue.put_nowait((job.id, document))
+        return job
+
+    async def wait_for(self, job_id: UUID, timeout: float) -> None:
+        """
+        Waits up to `timeout` seconds for a job to finish. Jobs run by this process are
+        awaited directly, those of other worker processes by polling their row.
+        """
+        event = self._done_events.get(job_id)
+        try:
+            if event is not None:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            else:
+                await asyncio.wait_for(self._poll_until_finished(job_id), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _poll_until_finished(self, job_id: UUID) -> None:
+        while True:
+            async with SessionLocal() as db:
+                job = await fetch_indexing_job(db, job_id)
+            if job is None or job.status in (
+                IndexingJobStatus.COMPLETED.value,
+                IndexingJobStatus.FAILED.value,
+            ):
+                return
+            # Taken over by this process after its own stopped heartbeating
+            event = self._done_events.get(job_id)
+            if event is not None:
+                await event.wait()
+                return
+            await asyncio.sleep(settings.INDEXING_JOB_POLL_SECONDS)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            try:
+                async with SessionLocal() as db:
+                    await touch_indexing_jobs(db, self._done_events.keys())
+                await self._recover_stale_jobs()
+            except Exception:
+                logger.exception("Failed to heartbeat or recover indexing jobs")
+            await asyncio.sleep(settings.INDEXING_JOB_HEARTBEAT_SECONDS)
+
+    async def _recover_stale_jobs(self) -> None:
+        free_slots = self.max_queue_size - self._queue.qsize()
+        if free_slots <= 0:
+            return
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.INDEXING_JOB_STALE_SECONDS)
+        async with SessionLocal() as db:
+            jobs = await claim_stale_indexing_jobs(db, stale_before, limit=free_slots)
+        for job in jobs:
+            async with SessionLocal() as db:
+                documents = await fetch_documents(db, id=str(job.document_id))
+            if not documents:
+                await self._update(
+                    job.id,
+                    status=IndexingJobStatus.FAILED.value,
+                    error="The document no longer exists",
+                    finished_at=datetime.utcnow(),
+                )
+                continue
+            logger.warning(
+                "Re-queued indexing job %s for document %s, its process stopped",
+                job.id,
+                job.document_id,
+            )
+            self._done_events[job.id] = asyncio.Event()
+            self._queue.put_nowait((job.id, documents[0]))
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, document = await self._queue.get()
+            try:
+                await self._run(job_id, document)
+            except Exception:
+                # Keep the worker alive even if the job status itself couldn't be saved
+                logger.exception("Indexing worker failed while running job %s", job_id)
+            finally:
+                self._queue.task_done()
+                event = self._done_events.pop(job_id, None)
+                if event is not None:
+                    event.set()
+
+    async def _update(self, job_id: UUID, **values) -> None:
+        async with SessionLocal() as db:
+            await update_indexing_job(db, job_id, **values)
+
+    async def _run(self, job_id: UUID, document: DocumentSchema) -> None:
+        doc_id = str(document.id)
+
+        async def save_progress(progress: IndexingProgress) -> None:
+            await self._update(job_id, stage=progress.current_stage, stages=progress.stages)
+
+        progress = IndexingProgress(on_change=save_progress)
+        try:
+            await self._update(
+                job_id, status=IndexingJobStatus.RUNNING.value, started_at=datetime.utcnow()
+            )
+            # The stored row is the source of truth for the content hashes
+            async with SessionLocal() as db:
+                documents = await fetch_documents(db, id=doc_id)
+            if documents:
+                document = documents[0]
+            # Reuse the existing vector nodes unless the file contents changed since they were built
+            force_rebuild = (
+                document.content_hash is not None
+                and document.content_hash != document.indexed_content_hash
+            )
+
+            service_context = create_tool_service_context()
+            doc_id_to_index = await create_index_from_doc(
+                service_context=service_context,
+                document=document,
+                progress=progress,
+                force_rebuild=force_rebuild,
+            )
+            invalidate_document_index(doc_id)
+            async with SessionLocal() as db:
+                await mark_document_indexed(db, document.id, document.content_hash)
+            index = doc_id_to_index[doc_id]
+
+            async with progress.stage("summarize"):
+                query_engine = index_to_query_engine(doc_id, index)
+                response = await query_engine.aquery(
+                    f"Summarize the document {doc_id} within 500 words"
+                )
+            await self._update(
+                job_id,
+                status=IndexingJobStatus.COMPLETED.value,
+                result=response.response,
+                finished_at=datetime.utcnow(),
+            )
+        except Exception as e:
+            logger.exception("Indexing job %s for document %s failed", job_id, doc_id)
+            await self._update(
+                job_id,
+                status=IndexingJobStatus.FAILED.value,
+                error=str(e),
+                finished_at=datetime.utcnow(),
+            )
+
+
+indexing_queue = IndexingJobQueue(
+    worker_count=settings.INDEXING_WORKER_COUNT,
+    max_queue_size=settings.INDEXING_QUEUE_MAX_SIZE,
+)
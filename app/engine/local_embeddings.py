@@ -0,0 +1,166 @@
+import functools
+import logging
+import threading
+import time
+from typing import Any, List, Tuple
+
+from llama_index.bridge.pydantic import Field, PrivateAttr
+from llama_index.embeddings.base import BaseEmbedding, Embedding
+
+from app.core.config import settings
+from app.core.executors import run_cpu
+
+
+logger = logging.getLogger(__name__)
+
+# Inference already uses every thread torch / onnxruntime is given, so concurrent batches
+# would only oversubscribe the cores. One batch at a time per process
+_inference_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_model(model_name: str, runtime: str, quantize: bool, num_threads: int) -> Tuple[Any, Any]:
+    """
+    Loads the tokenizer and model once per process, whatever the number of
+    `LocalEmbedding` instances (one is built per service context).
+    """
+    from transformers import AutoTokenizer
+
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if runtime == "onnx":
+        try:
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+        except ImportError:
+            raise ImportError(
+                "The onnx runtime needs optimum, install it with "
+                "`pip install optimum[onnxruntime]`"
+            )
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = num_threads
+        model = ORTModelForFeatureExtraction.from_pretrained(
+            model_name, export=True, session_options=session_options
+        )
+        if quantize:
+            logger.warning("Quantization is only applied with the torch runtime")
+    elif runtime == "torch":
+        import torch
+        from transformers import AutoModel
+
+        torch.set_num_threads(num_threads)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        if quantize:
+            # int8 weights for the linear layers, which dominate CPU inference time
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+    else:
+        raise ValueError(f"Unknown local embedding runtime {runtime!r}")
+    logger.info(
+        "Loaded local embedding model %s (%s%s) in %.2fs",
+        model_name, runtime, ", int8" if quantize else "", time.perf_counter() - start,
+    )
+    return tokenizer, model
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    Sentence-transformer style embedding model run in-process on the CPU, with torch or,
+    optionally, onnxruntime. Texts are embedded in batches sorted by length to keep
+    padding down, and inference runs on the CPU pool so it never blocks the event loop.
+    """
+
+    runtime: str = Field(default="torch", description="'torch' or 'onnx'.")
+    quantize: bool = Field(default=False, description="Dynamic int8 quantization (torch only).")
+    num_threads: int = Field(default=1, description="Threads used by the inference runtime.")
+    max_length: int = Field(default=512, description="Maximum tokens per text.")
+    pooling: str = Field(default="cls", description="'cls' or 'mean' pooling.")
+    normalize: bool = Field(default=True, description="Normalize embeddings to unit length.")
+    query_instruction: str = Field(default="", description="Prefix added to queries.")
+
+    _tokenizer: Any = PrivateAttr()
+    _model: Any = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._tokenizer, self._model = _load_model(
+            self.model_name, self.runtime, self.quantize, self.num_threads
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    def _pool(self, last_hidden_state: Any, attention_mask: Any) -> Any:
+        if self.pooling == "cls":
+            return last_hidden_state[:, 0]
+        mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        return (last_hidden_state * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        import torch
+
+        # Sorting by length keeps texts of similar size in a batch, so little is padded
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings: List[Embedding] = [[] for _ in texts]
+        with _inference_lock, torch.inference_mode():
+            for start in range(0, len(order), self.embed_batch_size):
+                batch = order[start : start + self.embed_batch_size]
+                encoded = self._tokenizer(
+                    [texts[i] for i in batch],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt",
+                )
+                output = self._model(**encoded)
+                vectors = self._pool(output.last_hidden_state, encoded["attention_mask"])
+                if self.normalize:
+                    vectors = torch.nn.functional.normalize(vectors, p=2, dim=1)
+                for i, vector in zip(batch, vectors.tolist()):
+                    embeddings[i] = vector
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed([self.query_instruction + query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await run_cpu(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await run_cpu(self._get_text_embedding, text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await run_cpu(self._embed, texts)
+
+
+def create_local_embedding() -> LocalEmbedding:
+    return LocalEmbedding(
+        model_name=settings.LOCAL_EMBEDDING_MODEL,
+        runtime=settings.LOCAL_EMBEDDING_RUNTIME,
+        quantize=settings.LOCAL_EMBEDDING_QUANTIZE,
+        num_threads=settings.LOCAL_EMBEDDING_THREADS,
+        max_length=settings.LOCAL_EMBEDDING_MAX_LENGTH,
+        pooling=settings.LOCAL_EMBEDDING_POOLING,
+        query_instruction=settings.LOCAL_EMBEDDING_QUERY_INSTRUCTION,
+        embed_batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE,
+    )
+
+
+async def warm_up_local_embedding() -> None:
+    """
+    Loads the model and runs one inference at startup, so the first request doesn't
+    pay for loading weights and the runtime's lazy initialization.
+    """
+    start = time.perf_counter()
+    embed_model = await run_cpu(create_local_embedding)
+    await embed_model.aget_query_embedding("warm up")
+    logger.info("Warmed up local embedding model in %.2fs", time.perf_counter() - start)
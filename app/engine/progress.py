@@ -0,0 +1,54 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class IndexingProgress:
+    """
+    Records status, timings and counters of each stage of an indexing run.
+    An optional `on_change` callback is awaited whenever a stage starts or ends.
+    """
+
+    def __init__(self, on_change: Optional[Callable[["IndexingProgress"], Awaitable[None]]] = None):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.current_stage: Optional[str] = None
+        self._on_change = on_change
+
+    async def _notify(self) -> None:
+        if self._on_change is None:
+            return
+        try:
+            await self._on_change(self)
+        except Exception:
+            # Progress reporting must never fail the indexing run itself
+            logger.exception("Failed to report indexing progress")
+
+    @asynccontextmanager
+    async def stage(self, name: str) -> AsyncIterator[Dict[str, Any]]:
+        record = self.stages.setdefault(name, {})
+        record.update(status="running", started_at=datetime.utcnow().isoformat())
+        self.current_stage = name
+        await self._notify()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        else:
+            record["status"] = "completed"
+        finally:
+            record["duration_seconds"] = round(time.perf_counter() - start, 3)
+            logger.info("Indexing stage %s %s in %.3fs", name, record["status"], record["duration_seconds"])
+            await self._notify()
+
+    def update(self, name: str, **counters: Any) -> None:
+        """
+        Sets counters (pages, chunks, ...) on a stage without notifying.
+        """
+        self.stages.setdefault(name, {}).update(counters)
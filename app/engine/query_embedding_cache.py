@@ -0,0 +1,241 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from cachetools import LRUCache
+from llama_index.bridge.pydantic import Field, PrivateAttr
+from llama_index.embeddings.base import BaseEmbedding, Embedding
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class MemoryQueryEmbeddingBackend:
+    """
+    In-memory stand-in for the shared backend, e.g. for benchmarks or a single worker.
+    """
+
+    def __init__(self, maxsize: int):
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = Lock()
+
+    async def get(self, model_name: str, query: str) -> Optional[Embedding]:
+        with self._lock:
+            return self._cache.get((model_name, query))
+
+    async def set(self, model_name: str, query: str, embedding: Embedding) -> None:
+        with self._lock:
+            self._cache[(model_name, query)] = embedding
+
+
+class PostgresQueryEmbeddingBackend:
+    """
+    Query embeddings stored in the `embeddingcache` table, shared by every worker.
+    Rows are namespaced by model so they never mix with cached chunk embeddings. They
+    expire after `ttl` seconds and expired rows are pruned at most every `prune_interval`
+    seconds, so one-off queries don't accumulate forever.
+    """
+
+    def __init__(self, ttl: float, prune_interval: float):
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._last_pruned = 0.0
+
+    async def get(self, model_name: str, query: str) -> Optional[Embedding]:
+        # imported here to keep the cache usable without a database, e.g. in benchmarks
+        from app.db.session import SessionLocal
+        from app.services.embedding_cache import fetch_cached_embeddings, hash_text
+
+        text_hash = hash_text(query)
+        async with SessionLocal() as db:
+            cached = await fetch_cached_embeddings(
+                db,
+                f"{model_name}#query",
+                [text_hash],
+                created_after=datetime.utcnow() - timedelta(seconds=self.ttl),
+            )
+        return cached.get(text_hash)
+
+    async def set(self, model_name: str, query: str, embedding: Embedding) -> None:
+        from app.db.session import SessionLocal
+        from app.services.embedding_cache import hash_text, insert_cached_embeddings
+
+        async with SessionLocal() as db:
+            # An expired row is still there until it's pruned, and would otherwise keep
+            # every worker missing on the query
+            await insert_cached_embeddings(
+                db, f"{model_name}#query", {hash_text(query): embedding}, refresh=True
+            )
+        if time.monotonic() - self._last_pruned >= self.prune_interval:
+            self._last_pruned = time.monotonic()
+            await self._prune(model_name)
+
+    async def _prune(self, model_name: str) -> None:
+        from app.db.session import SessionLocal
+        from app.services.embedding_cache import delete_cached_embeddings
+
+        async with SessionLocal() as db:
+            deleted = await delete_cached_embeddings(
+                db,
+                f"{model_name}#query",
+                created_before=datetime.utcnow() - timedelta(seconds=self.ttl),
+            )
+        logger.info("Pruned %s expired query embeddings of %s", deleted, model_name)
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded in-process LRU of query embeddings keyed by model and normalized query text,
+    optionally backed by a shared backend so repeats are also served across workers.
+    """
+
+    def __init__(self, maxsize: int, shared_backend: Optional[Any] = None):
+        self._local: LRUCache = LRUCache(maxsize=maxsize)
+        self.shared_backend = shared_backend
+        self._lock = Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get_local(self, model_name: str, query: str) -> Optional[Embedding]:
+        """
+        Looks up the in-process LRU only, as used by the blocking embedding API.
+        """
+        with self._lock:
+            embedding = self._local.get((model_name, normalize_query(query)))
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return embedding
+
+    def set_local(self, model_name: str, query: str, embedding: Embedding) -> None:
+        with self._lock:
+            self._local[(model_name, normalize_query(query))] = embedding
+
+    async def get(self, model_name: str, query: str) -> Optional[Embedding]:
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._local.get((model_name, key))
+            if embedding is not None:
+                self.hits += 1
+                return embedding
+        if self.shared_backend is not None:
+            try:
+                embedding = await self.shared_backend.get(model_name, key)
+            except Exception:
+                # The cache must never fail a query, fall back to embedding it
+                logger.exception("Failed to read query embedding from the shared cache")
+                with self._lock:
+                    self.errors += 1
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._local[(model_name, key)] = embedding
+            return embedding
+
+    async def set(self, model_name: str, query: str, embedding: Embedding) -> None:
+        self.set_local(model_name, query, embedding)
+        if self.shared_backend is not None:
+            try:
+                await self.shared_backend.set(model_name, normalize_query(query), embedding)
+            except Exception:
+                logger.exception("Failed to write query embedding to the shared cache")
+                with self._lock:
+                    self.errors += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._local),
+                "maxsize": self._local.maxsize,
+                "shared_backend": type(self.shared_backend).__name__ if self.shared_backend else None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model so query embeddings are memoized in a `QueryEmbeddingCache`.
+    Text (document) embeddings are passed through unchanged.
+    """
+
+    embed_model: BaseEmbedding = Field(description="The wrapped embedding model.")
+    _cache: QueryEmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: QueryEmbeddingCache, **kwargs: Any):
+        super().__init__(
+            embed_model=embed_model,
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            callback_manager=embed_model.callback_manager,
+            **kwargs,
+        )
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        embedding = self._cache.get_local(self.model_name, query)
+        if embedding is None:
+            embedding = self.embed_model._get_query_embedding(query)
+            self._cache.set_local(self.model_name, query, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        embedding = await self._cache.get(self.model_name, query)
+        if embedding is None:
+            embedding = await self.embed_model._aget_query_embedding(query)
+            await self._cache.set(self.model_name, query, embedding)
+        return embedding
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self.embed_model._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self.embed_model._aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self.embed_model._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self.embed_model._aget_text_embeddings(texts)
+
+
+def _create_shared_backend() -> Optional[Any]:
+    if settings.QUERY_EMBEDDING_CACHE_BACKEND == "postgres":
+        return PostgresQueryEmbeddingBackend(
+            ttl=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+            prune_interval=settings.QUERY_EMBEDDING_CACHE_PRUNE_INTERVAL_SECONDS,
+        )
+    if settings.QUERY_EMBEDDING_CACHE_BACKEND == "memory":
+        return MemoryQueryEmbeddingBackend(maxsize=settings.QUERY_EMBEDDING_CACHE_MAX_SIZE)
+    return None
+
+
+query_embedding_cache = QueryEmbeddingCache(
+    maxsize=settings.QUERY_EMBEDDING_CACHE_MAX_SIZE,
+    shared_backend=_create_shared_backend(),
+)
@@ -0,0 +1,163 @@
+import functools
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.bridge.pydantic import Field, PrivateAttr
+from llama_index.postprocessor.types import BaseNodePostprocessor
+from llama_index.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from app.core.config import settings
+from app.core.executors import run_cpu
+
+
+logger = logging.getLogger(__name__)
+
+# One scoring pass at a time per process, as each one already uses all its threads
+_inference_lock = threading.Lock()
+# Concurrent first requests load the model once
+_load_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _load_cross_encoder(model_name: str, num_threads: int) -> Tuple[Any, Any]:
+    """
+    Loads the cross-encoder once per process.
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    start = time.perf_counter()
+    torch.set_num_threads(num_threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+    logger.info("Loaded cross-encoder %s in %.2fs", model_name, time.perf_counter() - start)
+    return tokenizer, model
+
+
+class RerankStats:
+    """
+    Latency and candidate counters of the rerank stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.candidates = 0
+        self.kept = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, candidates: int, kept: int, seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.candidates += candidates
+            self.kept += kept
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "candidates": self.candidates,
+                "kept": self.kept,
+                "avg_ms": round(self.total_seconds / self.calls * 1000, 2) if self.calls else 0.0,
+                "max_ms": round(self.max_seconds * 1000, 2),
+            }
+
+
+rerank_stats = RerankStats()
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """
+    Scores every (query, chunk) pair with a local cross-encoder in one batched pass and
+    keeps the `top_n` best chunks scoring at least `score_cutoff`. Use `apostprocess_nodes`
+    from async code, which scores on the CPU pool instead of the event loop.
+    """
+
+    model: str = Field(description="Cross-encoder model name.")
+    top_n: int = Field(description="Number of nodes to keep.")
+    score_cutoff: Optional[float] = Field(default=None, description="Minimum score to keep a node.")
+    max_length: int = Field(default=512, description="Maximum tokens per query and chunk pair.")
+    num_threads: int = Field(default=1, description="Threads used for inference.")
+
+    _tokenizer: Any = PrivateAttr()
+    _model: Any = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        with _load_lock:
+            self._tokenizer, self._model = _load_cross_encoder(self.model, self.num_threads)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    def _score(self, query: str, texts: List[str]) -> List[float]:
+        import torch
+
+        with _inference_lock, torch.inference_mode():
+            encoded = self._tokenizer(
+                [query] * len(texts),
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="pt",
+            )
+            logits = self._model(**encoded).logits
+        # Relevance models have a single logit; otherwise the last label means relevant
+        return logits[:, -1].tolist()
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+        start = time.perf_counter()
+        scores = self._score(
+            query_bundle.query_str,
+            [node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
+        )
+        reranked = [
+            NodeWithScore(node=node.node, score=score)
+            for node, score in sorted(zip(nodes, scores), key=lambda item: -item[1])
+            if self.score_cutoff is None or score >= self.score_cutoff
+        ][: self.top_n]
+        rerank_stats.record(len(nodes), len(reranked), time.perf_counter() - start)
+        return reranked
+
+    async def apostprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: QueryBundle
+    ) -> List[NodeWithScore]:
+        return await run_cpu(self.postprocess_nodes, nodes, query_bundle)
+
+
+def create_reranker(
+    top_n: Optional[int] = None, score_cutoff: Optional[float] = None
+) -> CrossEncoderRerank:
+    return CrossEncoderRerank(
+        model=settings.RERANK_MODEL,
+        top_n=top_n or settings.RERANK_TOP_N,
+        score_cutoff=score_cutoff if score_cutoff is not None else settings.RERANK_SCORE_CUTOFF,
+        max_length=settings.RERANK_MAX_LENGTH,
+        num_threads=settings.RERANK_THREADS,
+    )
+
+
+async def warm_up_reranker() -> None:
+    """
+    Loads the cross-encoder and scores one pair at startup, off the event loop.
+    """
+    start = time.perf_counter()
+    reranker = await run_cpu(create_reranker)
+    await run_cpu(reranker._score, "warm up", ["warm up"])
+    logger.info("Warmed up cross-encoder in %.2fs", time.perf_counter() - start)
@@ -0,0 +1,192 @@
+import logging
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from cachetools import LRUCache, TTLCache
+from llama_index.embeddings.base import Embedding
+
+from app.core.config import settings
+from app.schemas.base import CitationSchema
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    embedding: np.ndarray
+    result: str
+    sources: List[CitationSchema]
+    variant: str = ""
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _unit_vector(embedding: Embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """
+    Per-document cache of query answers keyed by query embedding.
+
+    A query is answered from the cache when it is textually identical to a cached one, or
+    when its embedding's cosine similarity to a cached query of the same document reaches
+    `similarity_threshold`. Only answers given with the same `variant` (the request
+    parameters that change the answer) are candidates. A document's answers are kept with
+    the `version` of its index (its `indexed_at`) and dropped on a lookup with another one,
+    so re-indexing in any worker process retires them. Entries expire after `ttl` seconds,
+    each document keeps at most `max_entries_per_document` answers and at most
+    `max_documents` documents are kept (LRU).
+    """
+
+    def __init__(
+        self,
+        max_documents: int,
+        max_entries_per_document: int,
+        ttl: float,
+        similarity_threshold: float,
+    ):
+        self.max_entries_per_document = max_entries_per_document
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._documents: LRUCache = LRUCache(maxsize=max_documents)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _entries(self, doc_id: str, version: Any) -> Optional[TTLCache]:
+        document = self._documents.get(doc_id)
+        if document is None:
+            return None
+        cached_version, entries = document
+        if cached_version != version:
+            del self._documents[doc_id]
+            self.invalidations += 1
+            logger.info("Dropped cached answers of an outdated index of document %s", doc_id)
+            return None
+        entries.expire()
+        return entries
+
+    def _find(
+        self,
+        doc_id: str,
+        query: str,
+        embedding: Optional[np.ndarray],
+        variant: str,
+        version: Any,
+    ) -> Optional[CachedAnswer]:
+        with self._lock:
+            entries = self._entries(doc_id, version)
+            if not entries:
+                return None
+            answer = entries.get((variant, _normalize_query(query)))
+            if answer is not None or embedding is None:
+                return answer
+            answers = [answer for answer in entries.values() if answer.variant == variant]
+        if not answers:
+            return None
+        similarities = np.stack([answer.embedding for answer in answers]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            logger.debug(
+                "Semantic cache match for %r: %r (similarity %.3f)",
+                query, answers[best].query, similarities[best],
+            )
+            return answers[best]
+        return None
+
+    async def alookup(
+        self,
+        doc_id: str,
+        query: str,
+        embed_query: Callable[[str], Awaitable[Embedding]],
+        variant: str = "",
+        version: Any = None,
+    ) -> Tuple[Optional[CachedAnswer], Optional[Embedding]]:
+        """
+        Returns the cached answer for the query (or None) and the query embedding, if one
+        had to be computed, so that a miss can reuse it for retrieval.
+        """
+        answer = self._find(doc_id, query, embedding=None, variant=variant, version=version)
+        embedding = None
+        with self._lock:
+            # Only embed the query up front when there is something to compare it with
+            has_entries = bool(self._entries(doc_id, version))
+        if answer is None and has_entries:
+            embedding = await embed_query(query)
+            answer = self._find(
+                doc_id, query, embedding=_unit_vector(embedding), variant=variant, version=version
+            )
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer, embedding
+
+    def set(
+        self,
+        doc_id: str,
+        query: str,
+        embedding: Embedding,
+        result: str,
+        sources: List[CitationSchema],
+        variant: str = "",
+        version: Any = None,
+    ) -> None:
+        answer = CachedAnswer(
+            query=query,
+            embedding=_unit_vector(embedding),
+            result=result,
+            sources=sources,
+            variant=variant,
+        )
+        with self._lock:
+            entries = self._entries(doc_id, version)
+            if entries is None:
+                entries = TTLCache(maxsize=self.max_entries_per_document, ttl=self.ttl)
+                self._documents[doc_id] = (version, entries)
+            entries[(variant, _normalize_query(query))] = answer
+
+    def invalidate(self, doc_id: str) -> None:
+        with self._lock:
+            if self._documents.pop(doc_id, None) is not None:
+                self.invalidations += 1
+                logger.info("Invalidated cached answers for document %s", doc_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "documents": len(self._documents),
+                "entries": sum(len(entries) for _, entries in self._documents.values()),
+                "max_documents": self._documents.maxsize,
+                "max_entries_per_document": self.max_entries_per_document,
+                "ttl": self.ttl,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+semantic_answer_cache = SemanticAnswerCache(
+    max_documents=settings.SEMANTIC_CACHE_MAX_DOCUMENTS,
+    max_entries_per_document=settings.SEMANTIC_CACHE_MAX_ENTRIES_PER_DOCUMENT,
+    ttl=settings.SEMANTIC_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+)
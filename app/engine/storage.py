@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict
+
+import s3fs
+from llama_index import StorageContext
+from llama_index.storage.docstore import SimpleDocumentStore
+from llama_index.storage.docstore.types import DEFAULT_PERSIST_FNAME as DOCSTORE_FNAME
+from llama_index.storage.index_store import SimpleIndexStore
+from llama_index.storage.index_store.types import DEFAULT_PERSIST_FNAME as INDEX_STORE_FNAME
+from llama_index.storage.kvstore.simple_kvstore import SimpleKVStore
+from llama_index.vector_stores.types import VectorStore
+
+from app.core.constants import DB_DOC_ID_KEY
+from app.core.executors import run_cpu
+
+
+logger = logging.getLogger(__name__)
+
+DOCUMENTS_PREFIX = "documents"
+
+
+async def _aread_json(fs: s3fs.S3FileSystem, path: str) -> Dict[str, Any]:
+    data = await fs._cat_file(path)
+    return await run_cpu(json.loads, data)
+
+
+async def _awrite_json(fs: s3fs.S3FileSystem, path: str, value: Dict[str, Any]) -> None:
+    data = await run_cpu(json.dumps, value)
+    await fs._pipe_file(path, data.encode("utf-8"))
+
+
+async def aload_storage_context(
+    persist_dir: str, vector_store: VectorStore, fs: s3fs.S3FileSystem
+) -> StorageContext:
+    """
+    Async counterpart of `StorageContext.from_defaults(persist_dir=...)` for the docstore
+    and index store persisted in S3. Raises FileNotFoundError when nothing was persisted yet.
+    """
+    docstore_data, index_store_data = await asyncio.gather(
+        _aread_json(fs, f"{persist_dir}/{DOCSTORE_FNAME}"),
+        _aread_json(fs, f"{persist_dir}/{INDEX_STORE_FNAME}"),
+    )
+    return StorageContext.from_defaults(
+        docstore=SimpleDocumentStore(SimpleKVStore.from_dict(docstore_data)),
+        index_store=SimpleIndexStore(SimpleKVStore.from_dict(index_store_data)),
+        vector_store=vector_store,
+    )
+
+
+async def apersist_storage_context(
+    storage_context: StorageContext, persist_dir: str, fs: s3fs.S3FileSystem
+) -> None:
+    """
+    Async counterpart of `StorageContext.persist` for the docstore and index store.
+    The vectors live in Postgres and the graph store is unused, so neither is written.
+    """
+    await asyncio.gather(
+        _awrite_json(
+            fs, f"{persist_dir}/{DOCSTORE_FNAME}", storage_context.docstore._kvstore.to_dict()
+        ),
+        _awrite_json(
+            fs, f"{persist_dir}/{INDEX_STORE_FNAME}", storage_context.index_store._kvstore.to_dict()
+        ),
+    )
+
+
+def document_persist_dir(persist_dir: str, doc_id: str) -> str:
+    """
+    Each document's docstore and index store live under their own prefix, so loading or
+    persisting one document never touches the data of the others.
+    """
+    return f"{persist_dir}/{DOCUMENTS_PREFIX}/{doc_id}"
+
+
+async def adocument_storage_exists(
+    persist_dir: str, doc_id: str, fs: s3fs.S3FileSystem
+) -> bool:
+    """
+    Whether the document's own shard was persisted, as opposed to only the legacy blob.
+    """
+    return await fs._exists(f"{document_persist_dir(persist_dir, doc_id)}/{INDEX_STORE_FNAME}")
+
+
+def extract_document_storage_context(
+    storage_context: StorageContext, doc_id: str, vector_store: VectorStore
+) -> StorageContext:
+    """
+    Copies one document's index struct and pages out of a storage context holding many.
+    """
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(
+        [
+            page
+            for page in storage_context.docstore.docs.values()
+            if page.metadata.get(DB_DOC_ID_KEY) == doc_id
+        ]
+    )
+    index_store = SimpleIndexStore()
+    index_struct = storage_context.index_store.get_index_struct(doc_id)
+    if index_struct is not None:
+        index_store.add_index_struct(index_struct)
+    return StorageContext.from_defaults(
+        docstore=docstore, index_store=index_store, vector_store=vector_store
+    )
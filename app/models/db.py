@@ -1,4 +1,7 @@
-from sqlalchemy import Column, String
+from enum import Enum
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, UUID, UniqueConstraint
 from sqlalchemy.dialects.postgresql import JSONB
 from app.models.base import Base
 
@@ -13,3 +16,50 @@ class Document(Base):
     url = Column(String, nullable=False, unique=True)
     metadata_map = Column(JSONB, nullable=True)
     assistant_id=Column(String, nullable=True, index=True)
+    # sha256 of the uploaded file contents
+    content_hash = Column(String(64), nullable=True, unique=True)
+    # content_hash of the file the current index was built from
+    indexed_content_hash = Column(String(64), nullable=True)
+    # When the current index was built, to tell cached copies of an older one apart
+    indexed_at = Column(DateTime, nullable=True)
+
+
+class IndexingJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class IndexingJob(Base):
+    """
+    A background indexing run of a document along with its per-stage progress
+    """
+
+    document_id = Column(
+        UUID, ForeignKey("document.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    status = Column(String, nullable=False, default=IndexingJobStatus.QUEUED.value)
+    # Name of the stage currently running
+    stage = Column(String, nullable=True)
+    # Per-stage status, timings and counters keyed by stage name
+    stages = Column(JSONB, nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # Refreshed by the process running the job, so jobs orphaned by a restart can be taken over
+    heartbeat_at = Column(DateTime, nullable=True)
+
+
+class EmbeddingCache(Base):
+    """
+    Embedding of a piece of text keyed by the embedding model and the sha256 of the text
+    """
+
+    __table_args__ = (UniqueConstraint("model_name", "text_hash"),)
+
+    model_name = Column(String, nullable=False)
+    text_hash = Column(String(64), nullable=False)
+    # No fixed dimension, as different models produce vectors of different sizes
+    embedding = Column(Vector(), nullable=False)
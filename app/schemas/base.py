@@ -68,4 +68,18 @@ class DocumentSchema(Base):
     url: str
     name: Optional[str]
     assistant_id: Optional[str]
-    metadata_map: Optional[DocumentMetadataMap] = None
\ No newline at end of file
+    metadata_map: Optional[DocumentMetadataMap] = None
+    content_hash: Optional[str] = None
+    indexed_content_hash: Optional[str] = None
+    indexed_at: Optional[datetime] = None
+
+class IndexingJobSchema(Base):
+    document_id: UUID
+    status: str
+    stage: Optional[str] = None
+    stages: Optional[Dict[str, Dict[str, Any]]] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
@@ -1,6 +1,7 @@
-from typing import Optional, Sequence, List
+from datetime import datetime
+from typing import Optional, Sequence, List, Union
 
-from sqlalchemy import select, update
+from sqlalchemy import func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.dialects.postgresql import insert
 
@@ -20,10 +21,14 @@ async def fetch_documents(
     ids: Optional[List[str]] = None,
     assistant_id: Optional[str] = None,
     url: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    content_hashes: Optional[List[str]] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
     limit: Optional[int] = None,
 ) -> Optional[Sequence[DocumentSchema]]:
     """
-    Fetch a document by its url or id
+    Fetch a document by its url, id or content hash(es), optionally by creation time
     """
 
     stmt = select(Document)
@@ -38,6 +43,14 @@ async def fetch_documents(
     
     if url is not None:
         stmt = stmt.where(Document.url == url)
+    if content_hash is not None:
+        stmt = stmt.where(Document.content_hash == content_hash)
+    if content_hashes is not None:
+        stmt = stmt.where(Document.content_hash.in_(content_hashes))
+    if created_after is not None:
+        stmt = stmt.where(Document.created_at >= created_after)
+    if created_before is not None:
+        stmt = stmt.where(Document.created_at < created_before)
     if limit is not None:
         stmt = stmt.limit(limit)
         
@@ -47,19 +60,33 @@ async def fetch_documents(
 
 
 
-async def upsert_single_document(doc_url: str):
+def build_document_for_url(
+    doc_url: str, content_hash: Optional[str] = None
+) -> Optional[DocumentSchema]:
+    """
+    Builds a new document for a URL, or returns None if the URL isn't http(s).
+    """
+    if not doc_url or not doc_url.startswith('http'):
+        print("DOC_URL must be an http(s) based url value")
+        return None
+    return DocumentSchema(
+        url=doc_url,
+        name=generate_name_from_url(doc_url),
+        assistant_id="",
+        metadata_map={},
+        content_hash=content_hash,
+    )
+
+
+async def upsert_single_document(doc_url: str, content_hash: Optional[str] = None):
     """
     Upserts a single SEC document into the database using its URL.
     """
     
     print("upsert_single_document called")
-    if not doc_url or not doc_url.startswith('http'):
-        print("DOC_URL must be an http(s) based url value")
+    doc = build_document_for_url(doc_url, content_hash=content_hash)
+    if doc is None:
         return
-    metadata_map = {}
-    name=generate_name_from_url(doc_url)
-    doc = DocumentSchema(url=doc_url, name=name, assistant_id="", metadata_map=metadata_map)
-
 
     async with SessionLocal() as db:
         document = await upsert_document_by_url(db, doc)
@@ -69,23 +96,43 @@ async def upsert_single_document(doc_url: str):
 
 
 
+# Columns written by the upsert, the same for every row of a multi-row statement
+UPSERT_DOCUMENT_FIELDS = {"url", "name", "assistant_id", "metadata_map", "content_hash"}
+
+
 async def upsert_document_by_url(
-    db: AsyncSession, document: DocumentSchema
-) -> DocumentSchema:
+    db: AsyncSession, document: Union[DocumentSchema, Sequence[DocumentSchema]]
+) -> Union[DocumentSchema, List[DocumentSchema]]:
     """
-    Upsert a document
+    Upsert a document, or a batch of documents in a single multi-row statement.
+    Returns the upserted document(s) in the order given.
     """
-    print(document.model_dump())
-    stmt = insert(Document).values(**document.model_dump(exclude_none=True))
+    if isinstance(document, DocumentSchema):
+        return (await upsert_document_by_url(db, [document]))[0]
+
+    # A statement can't update the same row twice, so the last document per URL wins
+    rows = {
+        doc.url: doc.model_dump(include=UPSERT_DOCUMENT_FIELDS) for doc in document
+    }
+    if not rows:
+        return []
+    print(list(rows.values()))
+    stmt = insert(Document).values(list(rows.values()))
     stmt = stmt.on_conflict_do_update(
         index_elements=[Document.url],
-        set_=document.model_dump(include={"metadata_map"}),
+        set_={
+            "metadata_map": stmt.excluded.metadata_map,
+            # Registering a URL without a hash keeps the hash of the uploaded file
+            "content_hash": func.coalesce(stmt.excluded.content_hash, Document.content_hash),
+        },
     )
     stmt = stmt.returning(Document)
     result = await db.execute(stmt)
-    upserted_doc = DocumentSchema.from_orm(result.scalars().first())
+    upserted_docs = {
+        doc.url: DocumentSchema.from_orm(doc) for doc in result.scalars().all()
+    }
     await db.commit()
-    return upserted_doc
+    return [upserted_docs[doc.url] for doc in document]
 
 
 async def update_assistant_to_document(
@@ -103,4 +150,19 @@ async def update_assistant_to_document(
     result = await db.execute(stmt)
     updated_doc = DocumentSchema.from_orm(result.scalars().first())
     await db.commit()
-    return updated_doc
\ No newline at end of file
+    return updated_doc
+
+
+async def mark_document_indexed(
+    db: AsyncSession,
+    document_id: UUID,
+    content_hash: Optional[str],
+):
+    """
+    Records which content the document's current index was built from, and when
+    """
+    stmt = update(Document).where(Document.id==document_id).values(
+        indexed_content_hash=content_hash, indexed_at=datetime.utcnow()
+    )
+    await db.execute(stmt)
+    await db.commit()
@@ -0,0 +1,84 @@
+import hashlib
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models.db import EmbeddingCache
+
+# Keeps each statement well under asyncpg's limit of 32767 bind parameters
+BULK_CHUNK_SIZE = 1000
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def fetch_cached_embeddings(
+    db: AsyncSession,
+    model_name: str,
+    text_hashes: Sequence[str],
+    created_after: Optional[datetime] = None,
+) -> Dict[str, List[float]]:
+    """
+    Bulk lookup of cached embeddings, optionally only those cached after `created_after`,
+    returned keyed by text hash
+    """
+    cached: Dict[str, List[float]] = {}
+    text_hashes = list(set(text_hashes))
+    for i in range(0, len(text_hashes), BULK_CHUNK_SIZE):
+        stmt = select(EmbeddingCache.text_hash, EmbeddingCache.embedding).where(
+            EmbeddingCache.model_name == model_name,
+            EmbeddingCache.text_hash.in_(text_hashes[i : i + BULK_CHUNK_SIZE]),
+        )
+        if created_after is not None:
+            stmt = stmt.where(EmbeddingCache.created_at > created_after)
+        result = await db.execute(stmt)
+        for text_hash, embedding in result.all():
+            cached[text_hash] = [float(value) for value in embedding]
+    return cached
+
+
+async def insert_cached_embeddings(
+    db: AsyncSession,
+    model_name: str,
+    embeddings: Dict[str, List[float]],
+    refresh: bool = False,
+) -> None:
+    """
+    Bulk insert of embeddings keyed by text hash, ignoring ones that are already cached,
+    or with `refresh` overwriting them and restarting their `created_at`
+    """
+    rows = [
+        {"model_name": model_name, "text_hash": text_hash, "embedding": embedding}
+        for text_hash, embedding in embeddings.items()
+    ]
+    index_elements = [EmbeddingCache.model_name, EmbeddingCache.text_hash]
+    for i in range(0, len(rows), BULK_CHUNK_SIZE):
+        stmt = insert(EmbeddingCache).values(rows[i : i + BULK_CHUNK_SIZE])
+        if refresh:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={"embedding": stmt.excluded.embedding, "created_at": func.now()},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+        await db.execute(stmt)
+    await db.commit()
+
+
+async def delete_cached_embeddings(
+    db: AsyncSession, model_name: str, created_before: datetime
+) -> int:
+    """
+    Deletes the model's embeddings cached before `created_before`, returning how many
+    """
+    stmt = delete(EmbeddingCache).where(
+        EmbeddingCache.model_name == model_name,
+        EmbeddingCache.created_at < created_before,
+    )
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.rowcount
@@ -0,0 +1,103 @@
+from datetime import datetime
+from typing import Iterable, List, Optional, Any
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+
+from uuid import UUID
+
+from app.models.db import IndexingJob, IndexingJobStatus
+from app.schemas.base import IndexingJobSchema
+
+
+async def create_indexing_job(db: AsyncSession, document_id: UUID) -> IndexingJobSchema:
+    """
+    Creates a queued indexing job for a document
+    """
+    stmt = insert(IndexingJob).values(
+        document_id=document_id,
+        status=IndexingJobStatus.QUEUED.value,
+        stages={},
+        heartbeat_at=datetime.utcnow(),
+    )
+    stmt = stmt.returning(IndexingJob)
+    result = await db.execute(stmt)
+    job = IndexingJobSchema.from_orm(result.scalars().first())
+    await db.commit()
+    return job
+
+
+async def update_indexing_job(db: AsyncSession, job_id: UUID, **values: Any) -> IndexingJobSchema:
+    """
+    Updates the given columns of an indexing job
+    """
+    stmt = update(IndexingJob).where(IndexingJob.id == job_id).values(**values)
+    stmt = stmt.returning(IndexingJob)
+    result = await db.execute(stmt)
+    job = IndexingJobSchema.from_orm(result.scalars().first())
+    await db.commit()
+    return job
+
+
+async def fetch_indexing_job(db: AsyncSession, job_id: UUID) -> Optional[IndexingJobSchema]:
+    """
+    Fetch an indexing job by its id
+    """
+    stmt = select(IndexingJob).where(IndexingJob.id == job_id)
+    result = await db.execute(stmt)
+    job = result.scalars().first()
+    return IndexingJobSchema.from_orm(job) if job is not None else None
+
+
+async def touch_indexing_jobs(db: AsyncSession, job_ids: Iterable[UUID]) -> None:
+    """
+    Refreshes the heartbeat of the jobs queued or running in this process
+    """
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+    stmt = (
+        update(IndexingJob)
+        .where(IndexingJob.id.in_(job_ids))
+        .values(heartbeat_at=datetime.utcnow())
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def claim_stale_indexing_jobs(
+    db: AsyncSession, stale_before: datetime, limit: int
+) -> List[IndexingJobSchema]:
+    """
+    Takes over queued or running jobs whose heartbeat stopped before `stale_before`, as
+    their process went away. They are reset to queued; rows locked by another process
+    claiming them at the same time are skipped
+    """
+    stale = (
+        select(IndexingJob.id)
+        .where(
+            IndexingJob.status.in_(
+                [IndexingJobStatus.QUEUED.value, IndexingJobStatus.RUNNING.value]
+            ),
+            func.coalesce(IndexingJob.heartbeat_at, IndexingJob.created_at) < stale_before,
+        )
+        .order_by(IndexingJob.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(IndexingJob)
+        .where(IndexingJob.id.in_(stale.scalar_subquery()))
+        .values(
+            status=IndexingJobStatus.QUEUED.value,
+            stage=None,
+            stages={},
+            heartbeat_at=datetime.utcnow(),
+        )
+        .returning(IndexingJob)
+    )
+    result = await db.execute(stmt)
+    jobs = [IndexingJobSchema.from_orm(job) for job in result.scalars().all()]
+    await db.commit()
+    return jobs
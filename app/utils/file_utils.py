@@ -5,9 +5,11 @@ import s3fs
 from fsspec.asyn import AsyncFileSystem
 from app.core.config import settings
 
+import asyncio
 import os
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
 
-from urllib.parse import urlsplit
+from urllib.parse import unquote, urlsplit
 
 def generate_name_from_url(url):
     # Parse the URL
@@ -35,19 +37,191 @@ def generate_name_from_url(url):
 #     return s3_client
 
 
-def get_s3_fs(bucket_name: str = settings.S3_BUCKET_NAME) -> AsyncFileSystem:
-    s3 = s3fs.S3FileSystem(
+# Buckets already known to exist, so the check only costs a round trip once per process
+_checked_buckets = set()
+
+# Process-wide async filesystem, opened and closed by the app lifespan
+_async_s3_fs: Optional[s3fs.S3FileSystem] = None
+
+
+def get_s3_fs_kwargs() -> Dict[str, Any]:
+    return dict(
         key=settings.AWS_KEY,
         secret=settings.AWS_SECRET,
         endpoint_url=settings.S3_ENDPOINT_URL,
-        client_kwargs={'region_name': settings.AWS_DEFAULT_REGION} if settings.RENDER else {}
+        client_kwargs={'region_name': settings.AWS_DEFAULT_REGION} if settings.RENDER else {},
+        # Keep enough pooled connections around for concurrent uploads and index loads
+        config_kwargs={"max_pool_connections": settings.S3_MAX_POOL_CONNECTIONS},
     )
+
+
+def get_s3_fs(bucket_name: str = settings.S3_BUCKET_NAME) -> AsyncFileSystem:
+    """
+    Blocking filesystem for sync code such as scripts. Async code uses `get_async_s3_fs`.
+    """
+    s3 = s3fs.S3FileSystem(**get_s3_fs_kwargs())
     
-    if not (settings.RENDER or s3.exists(bucket_name)):
-        s3.mkdir(bucket_name)
+    if not settings.RENDER and bucket_name not in _checked_buckets:
+        if not s3.exists(bucket_name):
+            s3.mkdir(bucket_name)
+        _checked_buckets.add(bucket_name)
     return s3
 
 
+async def start_async_s3_fs(bucket_names: Iterable[str]) -> s3fs.S3FileSystem:
+    """
+    Opens the shared async filesystem and makes sure the buckets exist.
+    """
+    global _async_s3_fs
+    if _async_s3_fs is not None:
+        return _async_s3_fs
+    s3 = s3fs.S3FileSystem(asynchronous=True, skip_instance_cache=True, **get_s3_fs_kwargs())
+    await s3.set_session()
+    if not settings.RENDER:
+        for bucket_name in bucket_names:
+            if not await s3._exists(bucket_name):
+                await s3._mkdir(bucket_name)
+            _checked_buckets.add(bucket_name)
+    _async_s3_fs = s3
+    return s3
+
+
+async def close_async_s3_fs() -> None:
+    global _async_s3_fs
+    if _async_s3_fs is not None and _async_s3_fs._s3 is not None:
+        await _async_s3_fs._s3.close()
+    _async_s3_fs = None
+
+
+def get_async_s3_fs() -> s3fs.S3FileSystem:
+    """
+    The shared async filesystem. Its pooled connections are reused across requests,
+    so use its native coroutines (`_cat_file`, `_pipe_file`, `_get_file`, ...).
+    """
+    if _async_s3_fs is None:
+        raise RuntimeError("The S3 filesystem has not been started")
+    return _async_s3_fs
+
+
+def get_s3_path_from_url(url: str) -> Optional[str]:
+    """
+    Returns the `bucket/key` path of a URL built by `get_Document_url`, or None for other URLs.
+    """
+    prefix = settings.S3_ENDPOINT_URL + "/"
+    if not url.startswith(prefix):
+        return None
+    return unquote(url[len(prefix):])
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def upload_stream(
+    path: str,
+    chunks: AsyncIterator[bytes],
+    part_size: int = settings.S3_UPLOAD_PART_SIZE,
+    concurrency: int = settings.S3_UPLOAD_CONCURRENCY,
+    max_size: Optional[int] = None,
+) -> int:
+    """
+    Streams chunks into an S3 object, as a multipart upload once more than one part's
+    worth of data has arrived. At most `concurrency` parts are uploaded at a time, so
+    memory use is bounded by about `(concurrency + 1) * part_size` whatever the file size.
+    Raises UploadTooLarge, leaving nothing behind, once more than `max_size` bytes arrive.
+    Returns the number of bytes written.
+    """
+    s3 = get_async_s3_fs()
+    bucket, key, _ = s3.split_path(path)
+    # Chunks are only joined once per part; a chunk of exactly one part is sent as is
+    pending: List[bytes] = []
+    pending_size = 0
+    parts: List[Dict[str, Any]] = []
+    # Every part's task, kept until the end so no failure goes unnoticed
+    tasks: List[asyncio.Task] = []
+    slots = asyncio.Semaphore(concurrency)
+    upload_id = None
+    part_count = 0
+    size = 0
+
+    async def upload_part(part_number: int, body: bytes) -> None:
+        try:
+            response = await s3._call_s3(
+                "upload_part",
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+            parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        finally:
+            slots.release()
+
+    async def start_part(body: bytes) -> None:
+        nonlocal upload_id, part_count
+        if upload_id is None:
+            upload = await s3._call_s3("create_multipart_upload", Bucket=bucket, Key=key)
+            upload_id = upload["UploadId"]
+        # Wait for a free slot before reading on, which is what bounds the buffered parts
+        await slots.acquire()
+        part_count += 1
+        tasks.append(asyncio.create_task(upload_part(part_count, body)))
+        # Surface failures of finished parts early instead of after the whole file
+        for task in tasks:
+            if task.done():
+                task.result()
+
+    def take(length: int) -> bytes:
+        nonlocal pending, pending_size
+        data = pending[0] if len(pending) == 1 else b"".join(pending)
+        body, rest = data[:length], data[length:]
+        pending, pending_size = ([rest] if rest else []), len(rest)
+        return body
+
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise UploadTooLarge(f"Upload exceeds the maximum size of {max_size} bytes")
+            pending.append(chunk)
+            pending_size += len(chunk)
+            while pending_size >= part_size:
+                await start_part(take(part_size))
+
+        if upload_id is None:
+            await s3._pipe_file(path, take(pending_size))
+        else:
+            if pending_size:
+                await start_part(take(pending_size))
+            await asyncio.gather(*tasks)
+            if len(parts) != part_count:
+                raise RuntimeError(
+                    f"Uploaded {len(parts)} of {part_count} parts of {path}, not completing it"
+                )
+            await s3._call_s3(
+                "complete_multipart_upload",
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": sorted(parts, key=lambda part: part["PartNumber"])
+                },
+            )
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if upload_id is not None:
+            await s3._call_s3(
+                "abort_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id
+            )
+        raise
+    finally:
+        s3.invalidate_cache(path)
+    return size
+
+
 # async def get_s3_fs():
 #     s3_client = get_s3_client()
 #     return await fsspec.filesystem("s3", client=s3_client, anon=False)
@@ -10,7 +10,8 @@ import sys
 from fastapi import FastAPI, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -30,6 +31,14 @@ from app.core.config import settings,AppEnvironment
 from app.api.api import api_router
 from app.db.wait_for_db import check_database_connection
 from app.db.pg_vector import get_vector_store_singleton, CustomPGVectorStore
+from app.core.executors import loop_lag_monitor, shutdown_executors
+from app.core.metrics import MetricsMiddleware, register_runtime_collector, render_metrics
+from app.core.serving import run_preloaded_workers
+from app.db.session import engine as db_engine
+from app.engine.jobs import indexing_queue
+from app.engine.local_embeddings import warm_up_local_embedding
+from app.engine.rerank import warm_up_reranker
+from app.utils.file_utils import close_async_s3_fs, start_async_s3_fs
 from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
@@ -81,9 +90,23 @@ async def lifespan(app: FastAPI):
     except FileExistsError:
         # Sometimes seen in deployments, should be benign.
         logger.info("Tried to re-download NLTK files but already exists.")
+
+    if settings.EMBEDDING_BACKEND == "local":
+        await warm_up_local_embedding()
+    if settings.RERANK_ENABLED:
+        await warm_up_reranker()
+
+    # One pooled S3 client for the whole process, buckets are checked once here
+    await start_async_s3_fs([settings.S3_BUCKET_NAME, settings.S3_ASSET_BUCKET_NAME])
+    loop_lag_monitor.start()
+    await indexing_queue.start()
     yield
     # This section is run on app shutdown
+    await indexing_queue.stop()
+    await loop_lag_monitor.stop()
     await vector_store.close()
+    await close_async_s3_fs()
+    shutdown_executors()
 
 
 
@@ -108,6 +131,14 @@ if settings.BACKEND_CORS_ORIGINS:
 
 app.include_router(api_router, prefix=settings.API_PREFIX)
 
+app.add_middleware(MetricsMiddleware)
+register_runtime_collector(db_engine)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 
 
 # Handler for status code: 5xx
@@ -150,12 +181,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     )
 
 
-def start():
-    print("Running in AppEnvironment: " + settings.ENVIRONMENT.value)
-    __setup_logging(settings.LOG_LEVEL)
-    """Launched with `poetry run start` at root level"""
-    
-    PORT = int(settings.PORT)
+def __run_migrations():
     if settings.RENDER:
         # on render.com deployments, run migrations
         logger.debug("Running migrations")
@@ -164,6 +190,15 @@ def start():
         logger.debug("Migrations complete")
     else:
         logger.debug("Skipping migrations")
+
+
+def start():
+    print("Running in AppEnvironment: " + settings.ENVIRONMENT.value)
+    __setup_logging(settings.LOG_LEVEL)
+    """Launched with `poetry run start` at root level"""
+    
+    PORT = int(settings.PORT)
+    __run_migrations()
     live_reload = not settings.RENDER
     uvicorn.run(
         "main:app",
@@ -174,3 +209,13 @@ def start():
     )
 
 
+def serve():
+    """
+    Launched through `poetry run serve` (app.core.serving.serve): gunicorn workers forked
+    from a master that preloaded the app, sized to the available memory.
+    """
+    print("Running in AppEnvironment: " + settings.ENVIRONMENT.value)
+    __setup_logging(settings.LOG_LEVEL)
+    __run_migrations()
+    PORT = int(settings.PORT)
+    run_preloaded_workers(f"0.0.0.0:{8000 if not PORT else PORT}")
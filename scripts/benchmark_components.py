@@ -0,0 +1,430 @@
+from fire import Fire
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from llama_index import ServiceContext, StorageContext, VectorStoreIndex, load_indices_from_storage
+from llama_index.ingestion import run_transformations
+from llama_index.llms import MockLLM
+from llama_index.node_parser import SentenceSplitter
+from llama_index.schema import Document as LlamaIndexDocument, NodeWithScore
+from llama_index.vector_stores.types import (
+    ExactMatchFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+)
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from app.core.config import settings
+from app.core.constants import DB_DOC_ID_KEY
+from app.db.pg_vector import CustomPGVectorStore, get_vector_store_singleton
+from app.engine.constants import NODE_PARSER_CHUNK_OVERLAP, NODE_PARSER_CHUNK_SIZE
+from app.engine.embeddings import StandInEmbedding
+from app.engine.indexing import fetch_and_read_document, load_document_storage_context
+from app.engine.ingestion import iter_pdf_pages
+from app.engine.storage import apersist_storage_context, document_persist_dir
+from app.schemas.base import CitationSchema, DocumentSchema
+from app.utils.file_utils import (
+    close_async_s3_fs,
+    get_async_s3_fs,
+    get_Document_url,
+    start_async_s3_fs,
+)
+
+
+COMPONENTS = ["chunking", "pdf_parse", "citations", "retrieval", "index_load", "fetch_and_read"]
+
+WORDS = (
+    "the agreement party shall provide notice within days of termination clause revenue "
+    "quarter report section payment obligations liability insurance schedule amendment "
+    "warranty delivery customer supplier invoice tax period annual board approval"
+).split()
+
+
+def _make_pages(num_pages: int, doc_id: str, seed: int = 0) -> List[LlamaIndexDocument]:
+    """
+    Deterministic pseudo-English pages shaped like parsed PDF pages, with the exact
+    identifiers (section numbers, figures) that show up in real documents.
+    """
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(num_pages):
+        sentences = []
+        for _ in range(30):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+            words.insert(rng.randint(0, len(words)), f"section {rng.randint(1, 40)}.{rng.randint(1, 9)}")
+            sentences.append(" ".join(words).capitalize() + ".")
+        pages.append(
+            LlamaIndexDocument(
+                text=" ".join(sentences),
+                metadata={"page_label": str(page_number + 1), DB_DOC_ID_KEY: doc_id},
+            )
+        )
+    return pages
+
+
+def _write_pdf(path: Path, pages: List[LlamaIndexDocument], chars_per_line: int = 90) -> None:
+    """
+    Writes a minimal text PDF (Helvetica, one content stream per page) that pypdf parses.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # the page tree, once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for page in pages:
+        lines = [
+            page.text[i : i + chars_per_line] for i in range(0, len(page.text), chars_per_line)
+        ]
+        stream = "BT /F1 9 Tf 11 TL 40 760 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream.encode("latin-1")))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{ref} 0 R" for ref in page_refs).encode(),
+        len(page_refs),
+    )
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref_offset,
+    )
+    path.write_bytes(bytes(data))
+
+
+def _create_service_context() -> ServiceContext:
+    # Deterministic offline stand-ins for OpenAI, so runs are comparable and free
+    return ServiceContext.from_defaults(
+        llm=MockLLM(),
+        embed_model=StandInEmbedding(dimensions=settings.VECTOR_STORE_EMBED_DIM),
+        node_parser=SentenceSplitter.from_defaults(
+            chunk_size=NODE_PARSER_CHUNK_SIZE,
+            chunk_overlap=NODE_PARSER_CHUNK_OVERLAP,
+        ),
+    )
+
+
+def _summarize(samples_ms: List[float], **extra: Any) -> Dict[str, Any]:
+    samples_ms = sorted(samples_ms)
+    return {
+        "rounds": len(samples_ms),
+        "mean_ms": round(statistics.mean(samples_ms), 3),
+        "median_ms": round(statistics.median(samples_ms), 3),
+        "p95_ms": round(samples_ms[max(0, int(len(samples_ms) * 0.95) - 1)], 3),
+        "min_ms": round(samples_ms[0], 3),
+        "stdev_ms": round(statistics.stdev(samples_ms), 3) if len(samples_ms) > 1 else 0.0,
+        **extra,
+    }
+
+
+async def _time(func: Callable[[], Awaitable[Any]], rounds: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        await func()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def bench_chunking(rounds: int, pages: int) -> Dict[str, Any]:
+    documents = _make_pages(pages, str(uuid.uuid4()))
+    splitter = SentenceSplitter.from_defaults(
+        chunk_size=NODE_PARSER_CHUNK_SIZE, chunk_overlap=NODE_PARSER_CHUNK_OVERLAP
+    )
+    chunks = len(run_transformations(documents, [splitter]))
+
+    async def run() -> None:
+        run_transformations(documents, [splitter])
+
+    return _summarize(await _time(run, rounds), pages=pages, chunks=chunks)
+
+
+async def bench_pdf_parse(rounds: int, pages: int) -> Dict[str, Any]:
+    with TemporaryDirectory() as temp_dir:
+        path = Path(temp_dir) / "benchmark.pdf"
+        _write_pdf(path, _make_pages(pages, "pdf"))
+
+        async def run() -> None:
+            [page async for page in iter_pdf_pages(path, extra_info={DB_DOC_ID_KEY: "pdf"})]
+
+        # The warmup round also starts the parser processes
+        return _summarize(await _time(run, rounds), pages=pages)
+
+
+async def bench_citations(rounds: int, nodes: int) -> Dict[str, Any]:
+    documents = _make_pages(max(1, nodes // 4), str(uuid.uuid4()))
+    splitter = SentenceSplitter.from_defaults(
+        chunk_size=NODE_PARSER_CHUNK_SIZE, chunk_overlap=NODE_PARSER_CHUNK_OVERLAP
+    )
+    scored = [
+        NodeWithScore(node=node, score=0.8)
+        for node in run_transformations(documents, [splitter])[:nodes]
+    ]
+
+    async def run() -> None:
+        [CitationSchema.from_node(node_w_score=node).dict() for node in scored]
+
+    return _summarize(await _time(run, rounds), nodes=len(scored))
+
+
+async def bench_retrieval(rounds: int, pages: int, documents: int) -> Dict[str, Any]:
+    """
+    Filtered top-5 retrieval in vector and hybrid mode against a scratch table in the
+    configured Postgres, holding `documents` documents of `pages` pages each.
+    """
+    url = make_url(settings.DATABASE_URL)
+    table_name = f"benchmark_{uuid.uuid4().hex[:8]}"
+    vector_store = CustomPGVectorStore.from_params(
+        url.host,
+        url.port or 5432,
+        url.database,
+        url.username,
+        url.password,
+        table_name,
+        embed_dim=settings.VECTOR_STORE_EMBED_DIM,
+        hybrid_search=True,
+        text_search_config=settings.TEXT_SEARCH_CONFIG,
+    )
+    embed_model = StandInEmbedding(dimensions=settings.VECTOR_STORE_EMBED_DIM)
+    splitter = SentenceSplitter.from_defaults(
+        chunk_size=NODE_PARSER_CHUNK_SIZE, chunk_overlap=NODE_PARSER_CHUNK_OVERLAP
+    )
+    await vector_store.run_setup()
+    try:
+        doc_ids = [str(uuid.uuid4()) for _ in range(documents)]
+        chunks = 0
+        for seed, doc_id in enumerate(doc_ids):
+            nodes = run_transformations(_make_pages(pages, doc_id, seed=seed), [splitter])
+            embeddings = await embed_model.aget_text_embedding_batch(
+                [node.get_content() for node in nodes]
+            )
+            for node, embedding in zip(nodes, embeddings):
+                node.embedding = embedding
+            await vector_store.areplace_document_nodes(doc_id, nodes)
+            chunks += len(nodes)
+
+        query_str = "termination notice within days section 12.3"
+        query_embedding = await embed_model.aget_query_embedding(query_str)
+        results = {}
+        for mode in (VectorStoreQueryMode.DEFAULT, VectorStoreQueryMode.HYBRID):
+            query = VectorStoreQuery(
+                query_embedding=query_embedding,
+                query_str=query_str,
+                similarity_top_k=5,
+                filters=MetadataFilters(
+                    filters=[ExactMatchFilter(key=DB_DOC_ID_KEY, value=doc_ids[0])]
+                ),
+                mode=mode,
+            )
+
+            async def run() -> None:
+                await vector_store.aquery(query, hnsw_ef_search=settings.PGVECTOR_HNSW_EF_SEARCH)
+
+            results[mode.value] = _summarize(
+                await _time(run, rounds), documents=documents, chunks=chunks
+            )
+        return results
+    finally:
+        async with vector_store._async_session() as session, session.begin():
+            await session.execute(text(f"DROP TABLE IF EXISTS data_{table_name}"))
+
+
+async def bench_index_load(rounds: int, pages: int) -> Dict[str, Any]:
+    """
+    Loads a persisted per-document docstore and index store from the S3 stand-in and
+    rebuilds the index from them, as the first query for a document does.
+    """
+    service_context = _create_service_context()
+    vector_store = await get_vector_store_singleton()
+    persist_dir = f"{settings.S3_BUCKET_NAME}/.benchmark/{uuid.uuid4()}"
+    doc_id = str(uuid.uuid4())
+    fs = get_async_s3_fs()
+
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    storage_context.docstore.add_documents(_make_pages(pages, doc_id))
+    index = VectorStoreIndex(nodes=[], storage_context=storage_context, service_context=service_context)
+    index.set_index_id(doc_id)
+    await apersist_storage_context(storage_context, document_persist_dir(persist_dir, doc_id), fs)
+    try:
+
+        async def run() -> None:
+            loaded = await load_document_storage_context(persist_dir, doc_id, vector_store, fs)
+            load_indices_from_storage(loaded, index_ids=[doc_id], service_context=service_context)
+
+        return _summarize(await _time(run, rounds), pages=pages)
+    finally:
+        await fs._rm(persist_dir, recursive=True)
+
+
+async def bench_fetch_and_read(rounds: int, pages: int) -> Dict[str, Any]:
+    """
+    `fetch_and_read_document` for a PDF uploaded to the S3 stand-in: download and parse.
+    """
+    key = f".benchmark/{uuid.uuid4()}.pdf"
+    fs = get_async_s3_fs()
+    with TemporaryDirectory() as temp_dir:
+        path = Path(temp_dir) / "benchmark.pdf"
+        _write_pdf(path, _make_pages(pages, "fetch"))
+        await fs._pipe_file(f"{settings.S3_ASSET_BUCKET_NAME}/{key}", path.read_bytes())
+        size = path.stat().st_size
+    document = DocumentSchema(
+        id=uuid.uuid4(),
+        url=get_Document_url(settings.S3_ASSET_BUCKET_NAME, key),
+        name="benchmark",
+        assistant_id="",
+    )
+    try:
+
+        async def run() -> None:
+            await fetch_and_read_document(document)
+
+        return _summarize(await _time(run, rounds), pages=pages, bytes=size)
+    finally:
+        await fs._rm(f"{settings.S3_ASSET_BUCKET_NAME}/{key}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, Dict[str, Any]]:
+    flat = {}
+    for name, result in results.items():
+        if "median_ms" in result:
+            flat[prefix + name] = result
+        elif "skipped" not in result:
+            flat.update(_flatten(result, prefix=f"{prefix}{name}."))
+    return flat
+
+
+def _compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> None:
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    baseline_results = _flatten(baseline["results"])
+    for name, result in _flatten(current["results"]).items():
+        if name not in baseline_results:
+            continue
+        before, after = baseline_results[name]["median_ms"], result["median_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:>24}: {before:9.2f} -> {after:9.2f} ms median ({change:+.1%}){flag}")
+
+
+async def benchmark_components(
+    components: List[str],
+    rounds: int,
+    pages: int,
+    citation_nodes: int,
+    documents: int,
+) -> Dict[str, Any]:
+    benchmarks = {
+        "chunking": lambda: bench_chunking(rounds, pages),
+        "pdf_parse": lambda: bench_pdf_parse(rounds, pages),
+        "citations": lambda: bench_citations(rounds, citation_nodes),
+        "retrieval": lambda: bench_retrieval(rounds, pages, documents),
+        "index_load": lambda: bench_index_load(rounds, pages),
+        "fetch_and_read": lambda: bench_fetch_and_read(rounds, pages),
+    }
+    results: Dict[str, Any] = {}
+    if {"index_load", "fetch_and_read"} & set(components):
+        await start_async_s3_fs([settings.S3_BUCKET_NAME, settings.S3_ASSET_BUCKET_NAME])
+    try:
+        for name in components:
+            print(f"Running {name}...")
+            try:
+                results[name] = await benchmarks[name]()
+            except Exception as e:
+                # Components needing Postgres or S3 are skipped when those aren't running
+                print(f"Skipped {name}: {e!r}")
+                results[name] = {"skipped": repr(e)}
+    finally:
+        await close_async_s3_fs()
+    return results
+
+
+def main_benchmark_components(
+    components: str = ",".join(COMPONENTS),
+    rounds: int = 20,
+    pages: int = 20,
+    citation_nodes: int = 500,
+    documents: int = 20,
+    output: str = "benchmark_results.json",
+    compare: Optional[str] = None,
+    threshold: float = 0.1,
+):
+    """
+    Times the hot components in isolation with deterministic offline stand-ins for the
+    LLM and embedding models: chunking, PDF parsing, citation serialization, filtered
+    vector/hybrid retrieval against Postgres+pgvector and index loading / document
+    fetching from the S3 stand-in (`docker compose up db localstack`).
+
+    Results are written as JSON to `output`. Pass an earlier results file as `compare`
+    to print the change in median latency per component, flagging slowdowns beyond
+    `threshold`.
+    """
+    names = components.split(",") if isinstance(components, str) else list(components)
+    unknown = set(names) - set(COMPONENTS)
+    if unknown:
+        raise ValueError(f"Unknown components {sorted(unknown)}, expected some of {COMPONENTS}")
+    results = asyncio.run(
+        benchmark_components(
+            components=names,
+            rounds=rounds,
+            pages=pages,
+            citation_nodes=citation_nodes,
+            documents=documents,
+        )
+    )
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parameters": {
+            "rounds": rounds,
+            "pages": pages,
+            "citation_nodes": citation_nodes,
+            "documents": documents,
+        },
+        "results": results,
+    }
+    Path(output).write_text(json.dumps(report, indent=2))
+    for name, result in _flatten(results).items():
+        print(f"{name:>24}: median {result['median_ms']:9.2f} ms, p95 {result['p95_ms']:9.2f} ms")
+    print(f"Results written to {output}")
+    if compare is not None:
+        _compare(report, json.loads(Path(compare).read_text()), threshold)
+
+
+if __name__ == "__main__":
+    Fire(main_benchmark_components)
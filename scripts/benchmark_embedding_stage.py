@@ -0,0 +1,69 @@
+from fire import Fire
+import asyncio
+import time
+
+from app.engine.embeddings import EmbeddingStage, EmbeddingStats, StandInEmbedding
+
+
+async def benchmark_embedding_stage(
+    num_texts: int,
+    text_length: int,
+    batch_size: int,
+    max_in_flight: int,
+    requests_per_minute: float,
+    tokens_per_minute: float,
+    latency_seconds: float,
+    error_rate: float,
+):
+    embed_model = StandInEmbedding(latency_seconds=latency_seconds, error_rate=error_rate)
+    stage = EmbeddingStage(
+        embed_model=embed_model,
+        batch_size=batch_size,
+        max_in_flight=max_in_flight,
+        requests_per_minute=requests_per_minute or None,
+        tokens_per_minute=tokens_per_minute or None,
+        # Keep the benchmark snappy, the backoff shape is what matters here
+        backoff_base_seconds=0.1,
+    )
+    texts = [f"chunk {i} " + "lorem ipsum " * (text_length // 12) for i in range(num_texts)]
+
+    stats = EmbeddingStats()
+    start = time.perf_counter()
+    await stage.aembed_texts(texts, stats=stats)
+    elapsed = time.perf_counter() - start
+
+    print(f"Embedded {stats.texts} texts in {stats.batches} batches in {elapsed:.2f}s")
+    print(f"Throughput: {stats.texts / elapsed:.1f} texts/s, {stats.estimated_tokens / elapsed:.0f} tokens/s")
+    print(f"Retries: {stats.retries}")
+
+
+def main_benchmark_embedding_stage(
+    num_texts: int = 5000,
+    text_length: int = 2000,
+    batch_size: int = 64,
+    max_in_flight: int = 4,
+    requests_per_minute: float = 3000,
+    tokens_per_minute: float = 1000000,
+    latency_seconds: float = 0.2,
+    error_rate: float = 0.0,
+):
+    """
+    Benchmarks the embedding stage offline against the stand-in embedding model.
+    Simulated per-request latency and 429 error rate are configurable.
+    """
+    asyncio.run(
+        benchmark_embedding_stage(
+            num_texts=num_texts,
+            text_length=text_length,
+            batch_size=batch_size,
+            max_in_flight=max_in_flight,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            latency_seconds=latency_seconds,
+            error_rate=error_rate,
+        )
+    )
+
+
+if __name__ == "__main__":
+    Fire(main_benchmark_embedding_stage)
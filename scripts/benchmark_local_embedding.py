@@ -0,0 +1,111 @@
+from fire import Fire
+import asyncio
+import statistics
+import time
+
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.embeddings.openai import (
+    OpenAIEmbedding,
+    OpenAIEmbeddingMode,
+    OpenAIEmbeddingModelType,
+)
+
+from app.core.config import settings
+from app.engine.embeddings import EmbeddingStage, EmbeddingStats, StandInEmbedding
+from app.engine.local_embeddings import create_local_embedding, warm_up_local_embedding
+
+
+async def _benchmark(
+    name: str, stage: EmbeddingStage, texts: list, queries: list
+) -> None:
+    stats = EmbeddingStats()
+    start = time.perf_counter()
+    await stage.aembed_texts(texts, stats=stats)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        await stage.embed_model.aget_query_embedding(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    print(
+        f"{name:>8}: {stats.texts / elapsed:8.1f} texts/s, "
+        f"{stats.estimated_tokens / elapsed:9.0f} tokens/s | query "
+        f"p50 {statistics.median(latencies):7.1f} ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.1f} ms"
+    )
+
+
+async def benchmark_local_embedding(
+    num_texts: int,
+    text_length: int,
+    num_queries: int,
+    remote: str,
+    remote_latency_seconds: float,
+):
+    texts = [f"chunk {i} " + "lorem ipsum " * (text_length // 12) for i in range(num_texts)]
+    # Distinct queries, so nothing is served from a cache
+    queries = [f"what does section {i} say about revenue?" for i in range(num_queries)]
+
+    if remote == "openai":
+        remote_model: BaseEmbedding = OpenAIEmbedding(
+            mode=OpenAIEmbeddingMode.SIMILARITY_MODE,
+            model_type=OpenAIEmbeddingModelType.TEXT_EMBED_ADA_002,
+            api_key=settings.OPENAI_API_KEY,
+            max_retries=0,
+        )
+    else:
+        remote_model = StandInEmbedding(latency_seconds=remote_latency_seconds)
+    remote_stage = EmbeddingStage(
+        embed_model=remote_model,
+        batch_size=settings.EMBEDDING_BATCH_SIZE,
+        max_in_flight=settings.EMBEDDING_MAX_IN_FLIGHT,
+        requests_per_minute=settings.EMBEDDING_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.EMBEDDING_TOKENS_PER_MINUTE,
+    )
+
+    await warm_up_local_embedding()
+    local_stage = EmbeddingStage(
+        embed_model=create_local_embedding(),
+        batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE,
+        max_in_flight=1,
+    )
+
+    print(
+        f"{num_texts} texts of ~{text_length} chars, {num_queries} queries; local model "
+        f"{settings.LOCAL_EMBEDDING_MODEL} ({settings.LOCAL_EMBEDDING_RUNTIME}, "
+        f"{settings.LOCAL_EMBEDDING_THREADS} threads"
+        f"{', int8' if settings.LOCAL_EMBEDDING_QUANTIZE else ''})"
+    )
+    await _benchmark(remote, remote_stage, texts, queries)
+    await _benchmark("local", local_stage, texts, queries)
+
+
+def main_benchmark_local_embedding(
+    num_texts: int = 1000,
+    text_length: int = 2000,
+    num_queries: int = 100,
+    remote: str = "stand_in",
+    remote_latency_seconds: float = 0.2,
+):
+    """
+    Compares chunk embedding throughput and single-query latency of the local CPU
+    embedding backend (configured through LOCAL_EMBEDDING_*) with the remote path.
+    `remote` is "openai", which needs OPENAI_API_KEY and spends quota, or "stand_in",
+    which simulates the API with `remote_latency_seconds` per request.
+    """
+    asyncio.run(
+        benchmark_local_embedding(
+            num_texts=num_texts,
+            text_length=text_length,
+            num_queries=num_queries,
+            remote=remote,
+            remote_latency_seconds=remote_latency_seconds,
+        )
+    )
+
+
+if __name__ == "__main__":
+    Fire(main_benchmark_local_embedding)
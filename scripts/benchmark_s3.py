@@ -0,0 +1,91 @@
+from fire import Fire
+import asyncio
+import statistics
+import time
+import uuid
+
+import s3fs
+
+from app.core.config import settings
+from app.core.executors import run_io
+from app.utils.file_utils import (
+    get_s3_fs_kwargs,
+    close_async_s3_fs,
+    get_async_s3_fs,
+    start_async_s3_fs,
+)
+
+
+def _per_request_roundtrip(path: str, payload: bytes, bucket_name: str) -> None:
+    # What every request used to do: a fresh filesystem and connection pool plus a bucket check
+    s3 = s3fs.S3FileSystem(skip_instance_cache=True, **get_s3_fs_kwargs())
+    if not s3.exists(bucket_name):
+        s3.mkdir(bucket_name)
+    s3.pipe_file(path, payload)
+    s3.cat_file(path)
+
+
+async def _shared_roundtrip(path: str, payload: bytes) -> None:
+    s3 = get_async_s3_fs()
+    await s3._pipe_file(path, payload)
+    await s3._cat_file(path)
+
+
+async def _run(name: str, roundtrip, requests: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await roundtrip(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{name:>12}: {requests / elapsed:8.1f} req/s, "
+        f"p50 {statistics.median(latencies):7.1f} ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.1f} ms"
+    )
+
+
+async def benchmark_s3(requests: int, concurrency: int, payload_size: int):
+    bucket_name = settings.S3_BUCKET_NAME
+    prefix = f"{bucket_name}/.benchmark/{uuid.uuid4()}"
+    payload = b"x" * payload_size
+
+    await start_async_s3_fs([bucket_name])
+    try:
+        await _run(
+            "per-request",
+            lambda i: run_io(_per_request_roundtrip, f"{prefix}/old-{i}", payload, bucket_name),
+            requests,
+            concurrency,
+        )
+        await _run(
+            "shared async",
+            lambda i: _shared_roundtrip(f"{prefix}/new-{i}", payload),
+            requests,
+            concurrency,
+        )
+    finally:
+        await get_async_s3_fs()._rm(prefix, recursive=True)
+        await close_async_s3_fs()
+
+
+def main_benchmark_s3(requests: int = 200, concurrency: int = 16, payload_size: int = 64 * 1024):
+    """
+    Compares a write+read round trip through a per-request S3 filesystem (the old
+    `get_s3_fs` behaviour) with the shared async filesystem. Run against localstack
+    from docker-compose.yml (`docker compose up localstack`).
+    """
+    asyncio.run(
+        benchmark_s3(requests=requests, concurrency=concurrency, payload_size=payload_size)
+    )
+
+
+if __name__ == "__main__":
+    Fire(main_benchmark_s3)
@@ -0,0 +1,164 @@
+from fire import Fire
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import asyncpg
+import numpy as np
+from pgvector.asyncpg import register_vector
+
+from app.core.config import settings
+from app.core.constants import DB_DOC_ID_KEY
+
+TABLE_NAME = "data_benchmark_pg_vector_store"
+
+
+def _percentile(values, percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+async def _create_table(conn: asyncpg.Connection, dims: int) -> None:
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+    # Same layout as the llama-index pg vector store table plus the indexes from the migration
+    await conn.execute(
+        f"""
+        CREATE TABLE {TABLE_NAME} (
+            id BIGSERIAL PRIMARY KEY,
+            text VARCHAR NOT NULL,
+            metadata_ JSON,
+            node_id VARCHAR,
+            embedding VECTOR({dims})
+        )
+        """
+    )
+    await conn.execute(
+        f"CREATE INDEX ON {TABLE_NAME} USING hnsw (embedding vector_cosine_ops) "
+        f"WITH (m = {settings.PGVECTOR_HNSW_M}, ef_construction = {settings.PGVECTOR_HNSW_EF_CONSTRUCTION})"
+    )
+    await conn.execute(f"CREATE INDEX ON {TABLE_NAME} ((metadata_->>'{DB_DOC_ID_KEY}'))")
+
+
+async def _insert_rows(
+    conn: asyncpg.Connection, count: int, dims: int, doc_ids, batch_size: int, rng: np.random.Generator
+) -> None:
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        vectors = rng.standard_normal((size, dims), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        records = [
+            (
+                f"chunk {start + i}",
+                json.dumps({DB_DOC_ID_KEY: doc_ids[rng.integers(len(doc_ids))]}),
+                str(uuid.uuid4()),
+                vectors[i],
+            )
+            for i in range(size)
+        ]
+        await conn.copy_records_to_table(
+            TABLE_NAME, records=records, columns=["text", "metadata_", "node_id", "embedding"]
+        )
+
+
+async def _time_queries(
+    conn: asyncpg.Connection,
+    mode: str,
+    queries: int,
+    dims: int,
+    doc_ids,
+    top_k: int,
+    ef_search: int,
+    rng: np.random.Generator,
+):
+    latencies = []
+    returned = []
+    for _ in range(queries):
+        vector = rng.standard_normal(dims, dtype=np.float32)
+        doc_id = doc_ids[rng.integers(len(doc_ids))]
+        async with conn.transaction():
+            if mode == "exact":
+                await conn.execute("SET LOCAL enable_indexscan = off")
+                await conn.execute("SET LOCAL enable_bitmapscan = off")
+            else:
+                await conn.execute(f"SET LOCAL hnsw.ef_search = {ef_search}")
+            start = time.perf_counter()
+            rows = await conn.fetch(
+                f"SELECT id FROM {TABLE_NAME} WHERE metadata_->>'{DB_DOC_ID_KEY}' = $1 "
+                f"ORDER BY embedding <=> $2 LIMIT $3",
+                doc_id,
+                vector,
+                top_k,
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            returned.append(len(rows))
+    return latencies, returned
+
+
+async def benchmark_vector_index(
+    sizes, dims: int, num_docs: int, queries: int, top_k: int, ef_search: int, batch_size: int, keep_table: bool
+):
+    rng = np.random.default_rng(42)
+    doc_ids = [str(uuid.uuid4()) for _ in range(num_docs)]
+    conn = await asyncpg.connect(settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://"))
+    try:
+        await register_vector(conn)
+        await _create_table(conn, dims)
+
+        print(f"{'rows':>10} {'mode':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'avg hits':>9}")
+        rows = 0
+        for size in sorted(sizes):
+            start = time.perf_counter()
+            await _insert_rows(conn, size - rows, dims, doc_ids, batch_size, rng)
+            rows = size
+            await conn.execute(f"ANALYZE {TABLE_NAME}")
+            print(f"# loaded {rows} rows in {time.perf_counter() - start:.1f}s")
+            for mode in ("indexed", "exact"):
+                latencies, returned = await _time_queries(
+                    conn, mode, queries, dims, doc_ids, top_k, ef_search, rng
+                )
+                print(
+                    f"{rows:>10} {mode:>8} {_percentile(latencies, 0.5):>9.2f} "
+                    f"{_percentile(latencies, 0.95):>9.2f} {_percentile(latencies, 0.99):>9.2f} "
+                    f"{statistics.mean(returned):>9.2f}"
+                )
+    finally:
+        if not keep_table:
+            await conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+        await conn.close()
+
+
+def main_benchmark_vector_index(
+    sizes=(10_000, 100_000, 1_000_000),
+    dims: int = 1536,
+    num_docs: int = 1000,
+    queries: int = 200,
+    top_k: int = 5,
+    ef_search: int = settings.PGVECTOR_HNSW_EF_SEARCH,
+    batch_size: int = 10_000,
+    keep_table: bool = False,
+):
+    """
+    Measures filtered top-k query latency on a scratch copy of the pg vector store table
+    as it grows, with the HNSW/doc-id indexes ("indexed") and with index scans disabled
+    ("exact", i.e. the sequential scan every query did before the indexes existed).
+    "avg hits" shows how many of the top_k rows came back, to spot ef_search being too low.
+    """
+    asyncio.run(
+        benchmark_vector_index(
+            sizes=[int(size) for size in sizes],
+            dims=dims,
+            num_docs=num_docs,
+            queries=queries,
+            top_k=top_k,
+            ef_search=ef_search,
+            batch_size=batch_size,
+            keep_table=keep_table,
+        )
+    )
+
+
+if __name__ == "__main__":
+    Fire(main_benchmark_vector_index)
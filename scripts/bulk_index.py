@@ -0,0 +1,273 @@
+from fire import Fire
+import asyncio
+import json
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, List, Optional, Set, Union
+
+from llama_index import StorageContext, VectorStoreIndex
+
+from app.core.config import settings
+from app.core.constants import DB_DOC_ID_KEY
+from app.db.pg_vector import get_vector_store_singleton
+from app.db.session import SessionLocal
+from app.engine.context import create_tool_service_context
+from app.engine.embeddings import EmbeddingStats, get_embedding_stage
+from app.engine.ingestion import download_document, parse_and_chunk_pdf
+from app.engine.progress import IndexingProgress
+from app.engine.storage import (
+    adocument_storage_exists,
+    apersist_storage_context,
+    document_persist_dir,
+)
+from app.schemas.base import DocumentSchema
+from app.services.document import fetch_documents, mark_document_indexed
+from app.utils.file_utils import close_async_s3_fs, get_async_s3_fs, start_async_s3_fs
+
+
+STAGES = ["fetch", "parse", "embed", "write", "persist"]
+
+
+def _parse_ids(ids: Union[None, str, List[str]]) -> Optional[List[str]]:
+    if ids is None:
+        return None
+    if isinstance(ids, str):
+        ids = ids.split(",")
+    return [str(id).strip() for id in ids if str(id).strip()]
+
+
+def _parse_datetime(value: Optional[Any]) -> Optional[datetime]:
+    return None if value is None else datetime.fromisoformat(str(value))
+
+
+def _read_checkpoint(checkpoint: Path) -> Set[str]:
+    if not checkpoint.exists():
+        return set()
+    with open(checkpoint) as file:
+        return {json.loads(line)["doc_id"] for line in file if line.strip()}
+
+
+async def _needs_indexing(document: DocumentSchema) -> bool:
+    if document.content_hash is not None and document.content_hash != document.indexed_content_hash:
+        return True
+    return not await adocument_storage_exists(
+        settings.S3_BUCKET_NAME, str(document.id), get_async_s3_fs()
+    )
+
+
+async def select_documents(
+    selection: str,
+    ids: Optional[List[str]],
+    created_after: Optional[datetime],
+    created_before: Optional[datetime],
+    limit: Optional[int],
+) -> List[DocumentSchema]:
+    async with SessionLocal() as db:
+        documents = await fetch_documents(
+            db,
+            ids=ids,
+            created_after=created_after,
+            created_before=created_before,
+            limit=limit,
+        )
+    if selection == "unindexed":
+        needs_indexing = await asyncio.gather(*(_needs_indexing(doc) for doc in documents))
+        documents = [doc for doc, needed in zip(documents, needs_indexing) if needed]
+    return documents
+
+
+async def index_document(
+    document: DocumentSchema,
+    process_pool: ProcessPoolExecutor,
+    insert_batch_size: int,
+) -> IndexingProgress:
+    """
+    Indexes one document the way `create_index_from_doc(force_rebuild=True)` does, but
+    parses on the process pool and replaces the document's vector rows in bulk.
+    """
+    doc_id = str(document.id)
+    progress = IndexingProgress()
+    vector_store = await get_vector_store_singleton()
+
+    with TemporaryDirectory() as temp_dir:
+        temp_file_path = Path(temp_dir) / f"{doc_id}.pdf"
+        async with progress.stage("fetch") as stage:
+            stage["bytes"] = await download_document(document.url, temp_file_path)
+        async with progress.stage("parse") as stage:
+            pages, nodes = await asyncio.get_running_loop().run_in_executor(
+                process_pool, parse_and_chunk_pdf, str(temp_file_path), {DB_DOC_ID_KEY: doc_id}
+            )
+            stage.update(pages=len(pages), chunks=len(nodes))
+
+    async with progress.stage("embed") as stage:
+        embedding_stats = EmbeddingStats()
+        nodes = await get_embedding_stage().aembed_nodes(nodes, stats=embedding_stats)
+        stage["embedding"] = embedding_stats.to_dict()
+
+    async with progress.stage("write"):
+        await vector_store.areplace_document_nodes(doc_id, nodes, batch_size=insert_batch_size)
+
+    async with progress.stage("persist"):
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        storage_context.docstore.add_documents(pages)
+        index = VectorStoreIndex(
+            nodes=[],
+            storage_context=storage_context,
+            service_context=create_tool_service_context(),
+        )
+        index.set_index_id(doc_id)
+        await apersist_storage_context(
+            storage_context,
+            document_persist_dir(settings.S3_BUCKET_NAME, doc_id),
+            get_async_s3_fs(),
+        )
+        async with SessionLocal() as db:
+            await mark_document_indexed(db, document.id, document.content_hash)
+    return progress
+
+
+def _print_summary(
+    progresses: List[IndexingProgress], failures: int, skipped: int, elapsed: float
+) -> None:
+    docs = len(progresses)
+    chunks = sum(p.stages["parse"].get("chunks", 0) for p in progresses)
+    pages = sum(p.stages["parse"].get("pages", 0) for p in progresses)
+    print(
+        f"Indexed {docs} documents ({pages} pages, {chunks} chunks) in {elapsed:.1f}s, "
+        f"{failures} failed, {skipped} skipped from the checkpoint"
+    )
+    if not docs:
+        return
+    print(f"{docs / elapsed:.2f} docs/sec, {chunks / elapsed:.1f} chunks/sec")
+    totals: Dict[str, float] = defaultdict(float)
+    for progress in progresses:
+        for name in STAGES:
+            totals[name] += progress.stages[name]["duration_seconds"]
+    # Stages of different documents overlap, so totals add up to more than the wall time
+    for name in STAGES:
+        print(f"{name:>8}: {totals[name]:9.1f}s total, {totals[name] / docs:7.3f}s per document")
+    hits = sum(p.stages["embed"]["embedding"]["cache_hits"] for p in progresses)
+    retries = sum(p.stages["embed"]["embedding"]["retries"] for p in progresses)
+    print(f"embedding cache hits: {hits}, retries: {retries}")
+
+
+async def bulk_index(
+    selection: str,
+    ids: Optional[List[str]],
+    created_after: Optional[datetime],
+    created_before: Optional[datetime],
+    limit: Optional[int],
+    concurrency: int,
+    workers: int,
+    insert_batch_size: int,
+    checkpoint: Path,
+    reset: bool,
+):
+    await start_async_s3_fs([settings.S3_BUCKET_NAME])
+    vector_store = await get_vector_store_singleton()
+    await vector_store.run_setup()
+    try:
+        documents = await select_documents(selection, ids, created_after, created_before, limit)
+        if reset and checkpoint.exists():
+            checkpoint.unlink()
+        done = _read_checkpoint(checkpoint)
+        pending = [doc for doc in documents if str(doc.id) not in done]
+        skipped = len(documents) - len(pending)
+        print(f"Selected {len(documents)} documents, {len(pending)} to index")
+
+        semaphore = asyncio.Semaphore(concurrency)
+        progresses: List[IndexingProgress] = []
+        failures = 0
+        start = time.perf_counter()
+
+        # Spawned like app.core.executors' pool: forking would copy the asyncio, asyncpg
+        # and s3fs state already set up by this process
+        process_pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        with process_pool, open(checkpoint, "a") as checkpoint_file:
+
+            async def run(document: DocumentSchema) -> None:
+                nonlocal failures
+                async with semaphore:
+                    try:
+                        progress = await index_document(document, process_pool, insert_batch_size)
+                    except Exception as e:
+                        failures += 1
+                        print(f"Failed to index document {document.id}: {e!r}")
+                        return
+                progresses.append(progress)
+                checkpoint_file.write(
+                    json.dumps(
+                        {
+                            "doc_id": str(document.id),
+                            "indexed_at": datetime.utcnow().isoformat(),
+                            "stages": progress.stages,
+                        }
+                    )
+                    + "\n"
+                )
+                checkpoint_file.flush()
+                print(
+                    f"[{len(progresses) + failures}/{len(pending)}] {document.id}: "
+                    f"{progress.stages['parse']['chunks']} chunks"
+                )
+
+            await asyncio.gather(*(run(document) for document in pending))
+
+        _print_summary(progresses, failures, skipped, time.perf_counter() - start)
+    finally:
+        await vector_store.close()
+        await close_async_s3_fs()
+
+
+def main_bulk_index(
+    selection: str = "unindexed",
+    ids: Union[None, str, List[str]] = None,
+    created_after: Optional[str] = None,
+    created_before: Optional[str] = None,
+    limit: Optional[int] = None,
+    concurrency: int = 8,
+    workers: int = 4,
+    insert_batch_size: int = 500,
+    checkpoint: str = "bulk_index_checkpoint.jsonl",
+    reset: bool = False,
+):
+    """
+    Re-indexes documents in bulk, e.g. to backfill after an embedding model or chunking change.
+
+    `selection` is "all" or "unindexed" (content changed since the last index, or no
+    per-document index in S3), narrowed down by `ids` and the ISO `created_after` /
+    `created_before` dates. Up to `concurrency` documents are in flight at a time, PDFs
+    are parsed on `workers` processes and all embedding goes through the shared embedding
+    stage. Each indexed document is appended to `checkpoint`, so a rerun picks up where
+    the last one stopped; pass `reset` to start over.
+
+    App servers drop their cached indices and answers of a re-indexed document on its next
+    query, as its `indexed_at` changed.
+    """
+    if selection not in ("all", "unindexed"):
+        raise ValueError(f"Unknown selection {selection!r}, expected 'all' or 'unindexed'")
+    asyncio.run(
+        bulk_index(
+            selection=selection,
+            ids=_parse_ids(ids),
+            created_after=_parse_datetime(created_after),
+            created_before=_parse_datetime(created_before),
+            limit=limit,
+            concurrency=concurrency,
+            workers=workers,
+            insert_batch_size=insert_batch_size,
+            checkpoint=Path(checkpoint),
+            reset=reset,
+        )
+    )
+
+
+if __name__ == "__main__":
+    Fire(main_bulk_index)
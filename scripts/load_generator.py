@@ -0,0 +1,536 @@
+from fire import Fire
+import asyncio
+import base64
+import json
+import os
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.engine.embeddings import StandInEmbedding, estimate_tokens
+from app.services.document import fetch_documents
+
+
+# Latencies of the mocked services, passed to the mock server process through its env
+MOCK_LLM_FIRST_TOKEN_SECONDS = float(os.environ.get("MOCK_LLM_FIRST_TOKEN_SECONDS", 0.4))
+MOCK_LLM_TOKEN_SECONDS = float(os.environ.get("MOCK_LLM_TOKEN_SECONDS", 0.02))
+MOCK_EMBEDDING_SECONDS = float(os.environ.get("MOCK_EMBEDDING_SECONDS", 0.1))
+MOCK_VAPI_SECONDS = float(os.environ.get("MOCK_VAPI_SECONDS", 0.3))
+
+MOCK_ANSWER = (
+    "According to the document, either party may terminate the agreement with thirty "
+    "days written notice [1], and outstanding invoices remain payable [2]."
+)
+
+QUESTIONS = [
+    "What does section {n} say about termination?",
+    "How much notice is required under section {n}?",
+    "Summarize the payment obligations in section {n}.",
+    "Who is liable for damages according to section {n}?",
+    "When does the agreement in section {n} expire?",
+    "What are the warranty terms of section {n}?",
+]
+
+
+# Stand-ins for the OpenAI and Vapi APIs, served by `uvicorn scripts.load_generator:mock_app`
+mock_app = FastAPI()
+_mock_embedding = StandInEmbedding(dimensions=settings.VECTOR_STORE_EMBED_DIM)
+
+
+def _completion_chunk(completion_id: str, created: int, delta: Dict[str, Any], finish_reason: Optional[str]) -> str:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": "mock",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@mock_app.post("/v1/chat/completions")
+async def mock_chat_completions(request: Request) -> Any:
+    body = await request.json()
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    tokens = [f" {word}" if i else word for i, word in enumerate(MOCK_ANSWER.split())]
+    prompt_tokens = sum(estimate_tokens(str(message.get("content") or "")) for message in body["messages"])
+
+    if body.get("stream"):
+
+        async def stream() -> AsyncIterator[str]:
+            await asyncio.sleep(MOCK_LLM_FIRST_TOKEN_SECONDS)
+            yield _completion_chunk(completion_id, created, {"role": "assistant", "content": ""}, None)
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(MOCK_LLM_TOKEN_SECONDS)
+                yield _completion_chunk(completion_id, created, {"content": token}, None)
+            yield _completion_chunk(completion_id, created, {}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    await asyncio.sleep(MOCK_LLM_FIRST_TOKEN_SECONDS + MOCK_LLM_TOKEN_SECONDS * (len(tokens) - 1))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": "mock",
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": MOCK_ANSWER},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        },
+    }
+
+
+@mock_app.post("/v1/embeddings")
+async def mock_embeddings(request: Request) -> Dict[str, Any]:
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    texts = [text if isinstance(text, str) else json.dumps(text) for text in inputs]
+    await asyncio.sleep(MOCK_EMBEDDING_SECONDS)
+    data = []
+    for i, text in enumerate(texts):
+        embedding: Any = _mock_embedding._embed(text)
+        if body.get("encoding_format") == "base64":
+            embedding = base64.b64encode(struct.pack(f"<{len(embedding)}f", *embedding)).decode()
+        data.append({"object": "embedding", "index": i, "embedding": embedding})
+    tokens = sum(estimate_tokens(text) for text in texts)
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "mock"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+@mock_app.post("/vapi/assistant", status_code=201)
+async def mock_vapi_assistant(request: Request) -> Dict[str, Any]:
+    body = await request.json()
+    await asyncio.sleep(MOCK_VAPI_SECONDS)
+    # Stable per assistant name, so repeated /assistant calls keep a document's assistant id
+    return {"id": str(uuid.uuid5(uuid.NAMESPACE_URL, body["name"])), "name": body["name"]}
+
+
+@dataclass
+class LoadRequest:
+    # "query" or "assistant"
+    endpoint: str
+    document_id: Optional[str] = None
+    # Recorded traffic may name the assistant directly instead of the document
+    assistant_id: Optional[str] = None
+    query: Optional[str] = None
+    stream: bool = False
+    # Arrival time relative to the start of the recording
+    offset_seconds: Optional[float] = None
+
+
+@dataclass
+class Sample:
+    name: str
+    start: float
+    latency: float
+    first_byte: Optional[float]
+    status: Optional[int]
+    error: Optional[str]
+    semantic_cache: Optional[str] = None
+
+
+def _read_recording(path: str) -> List[LoadRequest]:
+    """
+    One JSON request per line, with the fields of `LoadRequest`.
+    """
+    with open(path) as file:
+        return [LoadRequest(**json.loads(line)) for line in file if line.strip()]
+
+
+def _synthetic_requests(
+    document_ids: List[str], count: int, assistant_ratio: float, stream_ratio: float, seed: int
+) -> List[LoadRequest]:
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(count):
+        document_id = rng.choice(document_ids)
+        if rng.random() < assistant_ratio:
+            requests.append(LoadRequest(endpoint="assistant", document_id=document_id))
+        else:
+            question = rng.choice(QUESTIONS).format(n=rng.randint(1, 20))
+            requests.append(
+                LoadRequest(
+                    endpoint="query",
+                    document_id=document_id,
+                    query=question,
+                    stream=rng.random() < stream_ratio,
+                )
+            )
+    return requests
+
+
+async def _indexed_document_ids(document_ids: Optional[List[str]], num_documents: int) -> List[str]:
+    async with SessionLocal() as db:
+        if document_ids:
+            documents = await fetch_documents(db=db, ids=document_ids)
+        else:
+            documents = await fetch_documents(db=db)
+    indexed = [str(document.id) for document in documents or [] if document.indexed_content_hash]
+    return indexed[:num_documents]
+
+
+async def _send(client: httpx.AsyncClient, request: LoadRequest, assistant_ids: Dict[str, str]) -> Sample:
+    if request.endpoint == "assistant":
+        name = "GET /api/assistant/{document_id}"
+        method, url, body = "GET", f"/api/assistant/{request.document_id}", None
+    else:
+        name = "POST /api/query" + (" (stream)" if request.stream else "")
+        assistant_id = request.assistant_id or assistant_ids[request.document_id]
+        method, url = "POST", "/api/query"
+        body = {"query": request.query, "assistant_id": assistant_id, "stream": request.stream}
+
+    start = time.perf_counter()
+    first_byte = None
+    try:
+        async with client.stream(method, url, json=body) as response:
+            chunks = []
+            async for chunk in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+                chunks.append(chunk)
+        latency = time.perf_counter() - start
+        error = None
+        if response.status_code >= 400:
+            error = f"HTTP {response.status_code}"
+        elif request.stream and b"event: error" in b"".join(chunks):
+            # Failures after the headers were sent are reported in-band
+            error = "stream error"
+        return Sample(
+            name=name,
+            start=start,
+            latency=latency,
+            first_byte=first_byte,
+            status=response.status_code,
+            error=error,
+            semantic_cache=response.headers.get("X-Semantic-Cache"),
+        )
+    except httpx.HTTPError as e:
+        return Sample(
+            name=name,
+            start=start,
+            latency=time.perf_counter() - start,
+            first_byte=first_byte,
+            status=None,
+            error=type(e).__name__,
+        )
+
+
+async def _run_closed_loop(
+    client: httpx.AsyncClient,
+    requests: List[LoadRequest],
+    assistant_ids: Dict[str, str],
+    concurrency: int,
+    think_time_seconds: float,
+) -> List[Sample]:
+    """
+    `concurrency` simulated sessions, each sending its next request once the previous
+    one has completed.
+    """
+    pending = iter(requests)
+    samples: List[Sample] = []
+
+    async def session() -> None:
+        for request in pending:
+            samples.append(await _send(client, request, assistant_ids))
+            if think_time_seconds:
+                await asyncio.sleep(random.expovariate(1 / think_time_seconds))
+
+    await asyncio.gather(*(session() for _ in range(concurrency)))
+    return samples
+
+
+async def _run_open_loop(
+    client: httpx.AsyncClient,
+    requests: List[LoadRequest],
+    assistant_ids: Dict[str, str],
+    rate: Optional[float],
+    speed: float,
+) -> List[Sample]:
+    """
+    Sends requests on schedule whether or not earlier ones have completed: at the recorded
+    offsets (sped up by `speed`) when `rate` is None, otherwise as a Poisson process of
+    `rate` requests per second.
+    """
+    tasks = []
+    start = time.perf_counter()
+    next_at = 0.0
+    for request in requests:
+        if rate is None:
+            next_at = (request.offset_seconds or 0.0) / speed
+        else:
+            next_at += random.expovariate(rate)
+        delay = next_at - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_send(client, request, assistant_ids)))
+    return list(await asyncio.gather(*tasks))
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile))]
+
+
+def _report(samples: List[Sample], elapsed: float) -> Dict[str, Dict[str, Any]]:
+    by_name: Dict[str, List[Sample]] = defaultdict(list)
+    for sample in samples:
+        by_name[sample.name].append(sample)
+    by_name["all"] = samples
+
+    report = {}
+    for name, group in by_name.items():
+        ok = [sample for sample in group if sample.error is None]
+        latencies = sorted(sample.latency * 1000 for sample in ok)
+        first_bytes = sorted(sample.first_byte * 1000 for sample in ok if sample.first_byte is not None)
+        cached = [sample.semantic_cache for sample in group if sample.semantic_cache]
+        errors: Dict[str, int] = defaultdict(int)
+        for sample in group:
+            if sample.error is not None:
+                errors[sample.error] += 1
+        report[name] = {
+            "requests": len(group),
+            "errors": dict(errors),
+            "error_rate": round(1 - len(ok) / len(group), 4),
+            "throughput_rps": round(len(ok) / elapsed, 2),
+            **(
+                {
+                    "p50_ms": round(_percentile(latencies, 0.5), 1),
+                    "p90_ms": round(_percentile(latencies, 0.9), 1),
+                    "p99_ms": round(_percentile(latencies, 0.99), 1),
+                    "max_ms": round(latencies[-1], 1),
+                    "mean_ms": round(statistics.mean(latencies), 1),
+                }
+                if latencies
+                else {}
+            ),
+            **(
+                {
+                    "first_byte_p50_ms": round(_percentile(first_bytes, 0.5), 1),
+                    "first_byte_p99_ms": round(_percentile(first_bytes, 0.99), 1),
+                }
+                if first_bytes
+                else {}
+            ),
+            **(
+                {"semantic_cache_hit_rate": round(cached.count("hit") / len(cached), 3)}
+                if cached
+                else {}
+            ),
+        }
+    return report
+
+
+def _print_report(report: Dict[str, Dict[str, Any]], elapsed: float) -> None:
+    print(f"\n{'endpoint':<42}{'reqs':>6}{'err%':>7}{'rps':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'ttfb p50':>10}")
+    for name, stats in report.items():
+        print(
+            f"{name:<42}{stats['requests']:>6}{stats['error_rate'] * 100:>6.1f}%"
+            f"{stats['throughput_rps']:>8.2f}{stats.get('p50_ms', 0):>9.0f}"
+            f"{stats.get('p90_ms', 0):>9.0f}{stats.get('p99_ms', 0):>9.0f}"
+            f"{stats.get('first_byte_p50_ms', 0):>10.0f}"
+        )
+        if stats["errors"]:
+            print(f"{'':<42}errors: {stats['errors']}")
+    print(f"Latencies in ms over {elapsed:.1f}s")
+
+
+def _start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    print("Starting", " ".join(args))
+    return subprocess.Popen(args, env={**os.environ, **env})
+
+
+def _stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def _wait_until_ready(url: str, process: subprocess.Popen, timeout_seconds: float) -> None:
+    deadline = time.monotonic() + timeout_seconds
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Process exited with {process.returncode} before {url} was up")
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"{url} wasn't up after {timeout_seconds}s")
+
+
+async def _provision_assistants(client: httpx.AsyncClient, document_ids: List[str]) -> Dict[str, str]:
+    """
+    Creates (mock) Vapi assistants for the documents through /assistant, giving every
+    document the stable assistant id /query is then called with.
+    """
+    assistant_ids = {}
+    for document_id in document_ids:
+        response = await client.get(f"/api/assistant/{document_id}")
+        response.raise_for_status()
+        assistant_ids[document_id] = response.json()["assistant_id"]
+    return assistant_ids
+
+
+async def load_test(
+    base_url: str,
+    requests: List[LoadRequest],
+    document_ids: List[str],
+    mode: str,
+    concurrency: int,
+    rate: Optional[float],
+    speed: float,
+    think_time_seconds: float,
+    timeout_seconds: float,
+) -> Dict[str, Dict[str, Any]]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_seconds, limits=limits) as client:
+        assistant_ids = await _provision_assistants(client, document_ids)
+        print(f"Sending {len(requests)} requests ({mode} loop)")
+        start = time.perf_counter()
+        if mode == "closed":
+            samples = await _run_closed_loop(client, requests, assistant_ids, concurrency, think_time_seconds)
+        else:
+            samples = await _run_open_loop(client, requests, assistant_ids, rate, speed)
+        elapsed = time.perf_counter() - start
+    report = _report(samples, elapsed)
+    _print_report(report, elapsed)
+    return report
+
+
+def main_load_test(
+    recording: Optional[str] = None,
+    num_requests: int = 200,
+    num_documents: int = 5,
+    document_ids: Optional[str] = None,
+    assistant_ratio: float = 0.05,
+    stream_ratio: float = 0.5,
+    mode: str = "closed",
+    concurrency: int = 10,
+    rate: Optional[float] = None,
+    speed: float = 1.0,
+    think_time_seconds: float = 0.0,
+    timeout_seconds: float = 60.0,
+    boot: bool = True,
+    base_url: str = "http://127.0.0.1:8100",
+    mock_port: int = 8101,
+    workers: int = 1,
+    output: Optional[str] = None,
+    seed: int = 0,
+):
+    """
+    Replays Vapi-style traffic (/query, streamed or not, and /assistant/{id}) against the
+    app and reports latency percentiles, time to first byte, throughput and error rates
+    per endpoint.
+
+    With `boot` the app from main.py is started on `base_url`'s port with `workers`
+    workers, talking to a mock OpenAI and Vapi API served on `mock_port` (latencies set
+    with the MOCK_* environment variables) and to the Postgres and localstack of the
+    environment (`docker compose up db localstack`). Otherwise `base_url` is an already
+    running app.
+
+    Traffic is the `recording` JSONL file (fields of `LoadRequest`) or `num_requests`
+    synthetic requests spread over `num_documents` indexed documents (or `document_ids`).
+    Documents get their assistants (re)created through /assistant before the run.
+    `mode` "closed" runs `concurrency` sessions back to back; "open" sends requests at
+    `rate` per second (Poisson), or at the recorded offsets sped up by `speed`.
+    """
+    if mode not in ("closed", "open"):
+        raise ValueError(f"Unknown mode {mode!r}, expected 'closed' or 'open'")
+    ids = document_ids.split(",") if isinstance(document_ids, str) else document_ids
+    if recording is not None:
+        requests = _read_recording(recording)
+        if mode == "open" and rate is None and any(r.offset_seconds is None for r in requests):
+            raise ValueError("Replaying recorded timing needs an offset_seconds on every request")
+        ids = ids or sorted({r.document_id for r in requests if r.document_id})
+    elif mode == "open" and rate is None:
+        raise ValueError("Open loop synthetic traffic needs a rate")
+    ids = asyncio.run(_indexed_document_ids(ids, len(ids) if ids else num_documents))
+    if not ids:
+        raise ValueError("No indexed documents to query, index some first")
+    if recording is None:
+        requests = _synthetic_requests(ids, num_requests, assistant_ratio, stream_ratio, seed)
+    else:
+        skipped = [r for r in requests if not r.assistant_id and r.document_id not in ids]
+        if skipped:
+            print(f"Skipping {len(skipped)} recorded requests for documents that aren't indexed")
+            requests = [r for r in requests if r not in skipped]
+    random.seed(seed)
+
+    processes = []
+    try:
+        if boot:
+            mock_url = f"http://127.0.0.1:{mock_port}"
+            mock = _start_process(
+                [sys.executable, "-m", "uvicorn", "scripts.load_generator:mock_app",
+                 "--port", str(mock_port), "--log-level", "warning"],
+                env={},
+            )
+            processes.append(mock)
+            asyncio.run(_wait_until_ready(f"{mock_url}/docs", mock, timeout_seconds))
+            app = _start_process(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(httpx.URL(base_url).port),
+                 "--workers", str(workers), "--log-level", "warning"],
+                env={
+                    "OPENAI_API_BASE": f"{mock_url}/v1",
+                    "EMBEDDING_BACKEND": "openai",
+                    "VAPI_BASE_URL": f"{mock_url}/vapi",
+                },
+            )
+            processes.append(app)
+            asyncio.run(_wait_until_ready(f"{base_url}/metrics", app, 120))
+        report = asyncio.run(
+            load_test(
+                base_url=base_url,
+                requests=requests,
+                document_ids=ids,
+                mode=mode,
+                concurrency=concurrency,
+                rate=rate,
+                speed=speed,
+                think_time_seconds=think_time_seconds,
+                timeout_seconds=timeout_seconds,
+            )
+        )
+    finally:
+        for process in reversed(processes):
+            _stop_process(process)
+
+    if output is not None:
+        Path(output).write_text(json.dumps(report, indent=2))
+        print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    Fire(main_load_test)
@@ -0,0 +1,105 @@
+from typing import List
+
+import pytest
+from llama_index.schema import MetadataMode, NodeWithScore, TextNode
+
+from app.core.constants import DB_DOC_ID_KEY
+from app.engine import context_assembly
+from app.engine.context_assembly import (
+    MIN_OVERLAP_CHARS,
+    MIN_TRUNCATED_TOKENS,
+    _merge_overlapping,
+    assemble_context,
+    dedupe_nodes,
+)
+
+
+class WordEncoding:
+    """
+    One token per word, so budgets in the tests can be counted by hand.
+    """
+
+    def __init__(self):
+        self._words: List[str] = []
+
+    def encode(self, text: str, disallowed_special=()) -> List[int]:
+        tokens = []
+        for word in text.split():
+            self._words.append(word)
+            tokens.append(len(self._words) - 1)
+        return tokens
+
+    def decode(self, tokens: List[int]) -> str:
+        return " ".join(self._words[token] for token in tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_encoding(monkeypatch):
+    monkeypatch.setattr(context_assembly, "get_encoding", WordEncoding)
+    # Counts memoized with another encoding would be off
+    context_assembly._token_counts.clear()
+
+
+def _words(count: int, prefix: str = "word") -> str:
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def _node(text: str, score: float = 1.0, page: str = "1") -> NodeWithScore:
+    node = TextNode(text=text, metadata={DB_DOC_ID_KEY: "doc", "page_label": page})
+    return NodeWithScore(node=node, score=score)
+
+
+def _text(node: NodeWithScore) -> str:
+    return node.node.get_content(metadata_mode=MetadataMode.NONE)
+
+
+def test_merge_joins_the_overlapping_tail_and_head():
+    overlap = "x" * MIN_OVERLAP_CHARS
+    assert _merge_overlapping("start " + overlap, overlap + " end") == "start " + overlap + " end"
+
+
+def test_merge_keeps_the_chunk_containing_the_other():
+    assert _merge_overlapping("a b c d", "b c") == "a b c d"
+    assert _merge_overlapping("b c", "a b c d") == "a b c d"
+
+
+def test_merge_ignores_overlaps_too_short_to_be_neighbours():
+    assert _merge_overlapping("first chunk ends", "ends the second chunk") is None
+
+
+def test_dedupe_only_merges_chunks_of_the_same_page():
+    overlap = "y" * MIN_OVERLAP_CHARS
+    nodes = [
+        _node("start " + overlap, score=0.5),
+        _node(overlap + " end", score=0.9),
+        _node(overlap + " end", score=0.7, page="2"),
+    ]
+    kept, merged = dedupe_nodes(nodes)
+    assert merged == 1
+    assert [_text(node) for node in kept] == ["start " + overlap + " end", overlap + " end"]
+    # The merged chunk keeps the rank of the first and the best score
+    assert kept[0].score == 0.9
+
+
+def test_assemble_keeps_chunks_within_the_budget():
+    nodes = [_node(_words(40, "a")), _node(_words(40, "b"))]
+    context = assemble_context(nodes, token_budget=100)
+    assert len(context.nodes) == 2
+    assert context.tokens == 80
+    assert context.truncated == context.dropped == 0
+
+
+def test_assemble_truncates_the_chunk_crossing_the_budget():
+    nodes = [_node(_words(40, "a")), _node(_words(100, "b"))]
+    context = assemble_context(nodes, token_budget=40 + MIN_TRUNCATED_TOKENS + 8)
+    assert context.truncated == 1
+    assert context.tokens == 40 + MIN_TRUNCATED_TOKENS + 8
+    assert _text(context.nodes[1]) == _words(MIN_TRUNCATED_TOKENS + 8, "b")
+
+
+def test_assemble_drops_chunks_when_too_little_budget_is_left():
+    nodes = [_node(_words(40, "a")), _node(_words(100, "b")), _node(_words(100, "c"))]
+    context = assemble_context(nodes, token_budget=40 + MIN_TRUNCATED_TOKENS - 1)
+    assert [_text(node) for node in context.nodes] == [_words(40, "a")]
+    assert context.tokens == 40
+    assert context.dropped == 2
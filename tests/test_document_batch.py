@@ -0,0 +1,160 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from app.api.routers import documents
+from app.core.config import settings
+from app.models.db import Document
+from app.schemas.base import DocumentSchema
+from app.services import document as document_service
+
+
+class FakeS3:
+    def __init__(self, calls):
+        self.calls = calls
+
+    async def _cp_file(self, source, destination):
+        self.calls.append(("copy", source, destination))
+
+    async def _rm(self, path):
+        self.calls.append(("remove", path))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    async def stage_upload(file, concurrency):
+        return f"staging/{file.filename}", file.filename.ljust(64, "0")
+
+    async def fetch_documents(db, content_hashes):
+        return []
+
+    monkeypatch.setattr(documents, "get_async_s3_fs", lambda: FakeS3(calls))
+    monkeypatch.setattr(documents, "_stage_upload", stage_upload)
+    monkeypatch.setattr(documents, "fetch_documents", fetch_documents)
+    return calls
+
+
+def _upload_batch(*names):
+    files = [UploadFile(file=None, filename=name, size=10) for name in names]
+    return asyncio.run(
+        documents.upload_documents_batch(files=files, urls=[], index=False, db=None)
+    )
+
+
+def test_batch_files_are_moved_into_place_after_the_upsert(calls, monkeypatch):
+    async def upsert_document_by_url(db, docs):
+        calls.append(("upsert", len(docs)))
+        return [doc.copy(update={"id": uuid4()}) for doc in docs]
+
+    monkeypatch.setattr(documents, "upsert_document_by_url", upsert_document_by_url)
+    result = _upload_batch("a.pdf", "b.pdf")
+
+    assert calls[0] == ("upsert", 2)
+    copies = {call[2] for call in calls if call[0] == "copy"}
+    assert copies == {f"{settings.S3_ASSET_BUCKET_NAME}/a.pdf", f"{settings.S3_ASSET_BUCKET_NAME}/b.pdf"}
+    assert len(result.documents) == 2
+
+
+def test_conflicting_batch_leaves_no_files_behind(calls, monkeypatch):
+    async def upsert_document_by_url(db, docs):
+        calls.append(("upsert", len(docs)))
+        raise IntegrityError("insert", {}, Exception("duplicate content_hash"))
+
+    monkeypatch.setattr(documents, "upsert_document_by_url", upsert_document_by_url)
+    with pytest.raises(HTTPException) as error:
+        _upload_batch("a.pdf", "b.pdf")
+
+    assert error.value.status_code == 409
+    assert not any(call[0] == "copy" for call in calls)
+    assert {call[1] for call in calls if call[0] == "remove"} == {"staging/a.pdf", "staging/b.pdf"}
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """
+    Records the statement and returns a row per document the statement writes.
+    """
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.statements = []
+
+    async def execute(self, stmt):
+        self.statements.append(stmt)
+        return FakeResult(
+            [
+                Document(
+                    id=uuid4(),
+                    created_at=datetime.utcnow(),
+                    updated_at=datetime.utcnow(),
+                    url=doc.url,
+                    name=doc.name,
+                    assistant_id=doc.assistant_id,
+                    content_hash=doc.content_hash,
+                )
+                for doc in self.docs
+            ]
+        )
+
+    async def commit(self):
+        pass
+
+
+def _document(url, content_hash=None):
+    return DocumentSchema(url=url, name=url, assistant_id="", content_hash=content_hash)
+
+
+def _upsert(docs):
+    db = FakeSession(list({doc.url: doc for doc in docs}.values()))
+    result = asyncio.run(document_service.upsert_document_by_url(db, docs))
+    return db.statements[0], result
+
+
+def test_upsert_keeps_the_stored_hash_when_none_is_given():
+    stmt, _ = _upsert([_document("http://localhost/a.pdf")])
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (url) DO UPDATE" in sql
+    assert "content_hash = coalesce(excluded.content_hash, document.content_hash)" in sql
+
+
+def test_batch_upsert_is_one_multi_row_statement_in_the_given_order():
+    docs = [
+        _document("http://localhost/a.pdf", "a" * 64),
+        _document("http://localhost/b.pdf"),
+        _document("http://localhost/c.pdf", "c" * 64),
+    ]
+    stmt, result = _upsert(docs)
+    params = stmt.compile(dialect=postgresql.dialect()).params
+    assert [params[f"url_m{i}"] for i in range(3)] == [doc.url for doc in docs]
+    assert [params[f"content_hash_m{i}"] for i in range(3)] == ["a" * 64, None, "c" * 64]
+    assert [doc.url for doc in result] == [doc.url for doc in docs]
+
+
+def test_batch_upsert_writes_a_repeated_url_once():
+    docs = [
+        _document("http://localhost/a.pdf", "1" * 64),
+        _document("http://localhost/a.pdf", "2" * 64),
+    ]
+    stmt, result = _upsert(docs)
+    params = stmt.compile(dialect=postgresql.dialect()).params
+    assert "url_m1" not in params
+    # The last document of a URL wins
+    assert params["content_hash_m0"] == "2" * 64
+    assert len(result) == 2
@@ -0,0 +1,101 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+from fastapi import UploadFile
+from sqlalchemy.exc import IntegrityError
+
+from app.api.routers import documents
+from app.core.config import settings
+from app.schemas.base import DocumentSchema
+
+
+CONTENT_HASH = "a" * 64
+
+
+class FakeS3:
+    def __init__(self, calls):
+        self.calls = calls
+
+    async def _cp_file(self, source, destination):
+        self.calls.append(("copy", source, destination))
+
+    async def _rm(self, path):
+        self.calls.append(("remove", path))
+
+
+def _document(url: str) -> DocumentSchema:
+    return DocumentSchema(
+        id=uuid4(), url=url, name=url.rsplit("/", 1)[-1], assistant_id="",
+        content_hash=CONTENT_HASH,
+    )
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    async def stage_upload(file, concurrency):
+        calls.append(("stage", file.filename))
+        return "staging/path", CONTENT_HASH
+
+    async def fetch_documents(db, content_hash):
+        calls.append(("fetch", content_hash))
+        return []
+
+    monkeypatch.setattr(documents, "get_async_s3_fs", lambda: FakeS3(calls))
+    monkeypatch.setattr(documents, "_stage_upload", stage_upload)
+    monkeypatch.setattr(documents, "fetch_documents", fetch_documents)
+    return calls
+
+
+def _upload(name: str = "report.pdf"):
+    file = UploadFile(file=None, filename=name, size=10)
+    return asyncio.run(documents.upload_file_to_s3(file=file, db=None))
+
+
+def test_upload_is_moved_into_place_after_its_row_is_upserted(calls, monkeypatch):
+    async def upsert_single_document(url, content_hash):
+        calls.append(("upsert", url, content_hash))
+        return _document(url)
+
+    monkeypatch.setattr(documents, "upsert_single_document", upsert_single_document)
+    result = _upload()
+
+    final_path = f"{settings.S3_ASSET_BUCKET_NAME}/report.pdf"
+    assert [call[0] for call in calls] == ["stage", "fetch", "upsert", "copy", "remove"]
+    assert calls[3] == ("copy", "staging/path", final_path)
+    assert result["content_hash"] == CONTENT_HASH
+
+
+def test_conflicting_upload_leaves_the_existing_file_untouched(calls, monkeypatch):
+    existing = _document("http://localhost/other.pdf")
+
+    async def upsert_single_document(url, content_hash):
+        calls.append(("upsert", url, content_hash))
+        raise IntegrityError("insert", {}, Exception("duplicate content_hash"))
+
+    async def fetch_documents(db, content_hash):
+        calls.append(("fetch", content_hash))
+        # Empty before the upsert, then the concurrently uploaded document
+        return [existing] if any(call[0] == "upsert" for call in calls) else []
+
+    monkeypatch.setattr(documents, "upsert_single_document", upsert_single_document)
+    monkeypatch.setattr(documents, "fetch_documents", fetch_documents)
+    result = _upload()
+
+    assert not any(call[0] == "copy" for call in calls)
+    assert calls[-1] == ("remove", "staging/path")
+    assert result["id"] == str(existing.id)
+
+
+def test_failed_upsert_removes_the_staged_upload(calls, monkeypatch):
+    async def upsert_single_document(url, content_hash):
+        raise ConnectionError("database went away")
+
+    monkeypatch.setattr(documents, "upsert_single_document", upsert_single_document)
+    with pytest.raises(ConnectionError):
+        _upload()
+
+    assert not any(call[0] == "copy" for call in calls)
+    assert calls[-1] == ("remove", "staging/path")
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from app.engine import indexing
+from app.engine.cache import IndexCache
+from app.schemas.base import DocumentSchema
+
+
+@pytest.fixture
+def cache():
+    return IndexCache(maxsize=2, ttl=3600)
+
+
+def test_get_counts_hits_and_misses(cache):
+    index = object()
+    assert cache.get("doc") is None
+    cache.set("doc", index)
+    assert cache.get("doc") is index
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_peek_does_not_count(cache):
+    cache.set("doc", object())
+    cache.peek("doc")
+    cache.peek("other")
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
+
+
+def test_index_of_an_older_version_is_dropped(cache):
+    indexed_at = datetime(2024, 1, 1)
+    index = object()
+    cache.set("doc", index, version=indexed_at)
+    assert cache.get("doc", version=indexed_at) is index
+
+    assert cache.get("doc", version=datetime(2024, 2, 1)) is None
+    assert cache.stats()["invalidations"] == 1
+    # Dropped rather than kept for the old version
+    assert cache.peek("doc", version=indexed_at) is None
+
+
+def test_invalidate(cache):
+    cache.set("doc", object())
+    cache.invalidate("doc")
+    cache.invalidate("doc")
+    assert cache.get("doc") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_load_lock_is_shared_per_document(cache):
+    async def locks():
+        return cache.load_lock("doc"), cache.load_lock("doc"), cache.load_lock("other")
+
+    first, second, other = asyncio.run(locks())
+    assert first is second
+    assert first is not other
+
+
+def test_concurrent_misses_load_the_document_once(cache, monkeypatch):
+    loads = []
+
+    async def create_index_from_doc(service_context, document):
+        await asyncio.sleep(0.01)
+        index = object()
+        loads.append((document.id, document.indexed_at))
+        return {str(document.id): index}
+
+    monkeypatch.setattr(indexing, "index_cache", cache)
+    monkeypatch.setattr(indexing, "create_index_from_doc", create_index_from_doc)
+    monkeypatch.setattr(indexing, "create_tool_service_context", lambda: None)
+    document = DocumentSchema(
+        id=uuid4(), url="http://localhost/a.pdf", name="a.pdf", assistant_id="assistant",
+        indexed_at=datetime(2024, 1, 1),
+    )
+
+    # Re-indexed by another worker: the next queries load the new index once
+    reindexed = document.copy(update={"indexed_at": datetime(2024, 2, 1)})
+
+    async def query(document):
+        return await asyncio.gather(
+            *(indexing.get_index_for_document(document) for _ in range(5))
+        )
+
+    async def run():
+        return await query(document), await query(reindexed)
+
+    indices, new_indices = asyncio.run(run())
+    assert loads == [(document.id, document.indexed_at), (document.id, reindexed.indexed_at)]
+    assert all(index is indices[0] for index in indices)
+    assert all(index is new_indices[0] for index in new_indices)
+    assert new_indices[0] is not indices[0]
+
+
+def test_idle_load_locks_of_uncached_documents_are_dropped(cache):
+    async def run():
+        cache.load_lock("evicted")
+        cache.set("cached", object())
+        cache.load_lock("cached")
+        cache.load_lock("doc")
+
+    asyncio.run(run())
+    assert set(cache._load_locks) == {"cached", "doc"}
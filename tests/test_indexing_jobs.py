@@ -0,0 +1,165 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+
+from app.core.config import settings
+from app.engine import jobs
+from app.engine.jobs import IndexingJobQueue
+from app.models.db import IndexingJobStatus
+from app.schemas.base import DocumentSchema, IndexingJobSchema
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def _job(document_id) -> IndexingJobSchema:
+    return IndexingJobSchema(
+        id=uuid4(), document_id=document_id, status=IndexingJobStatus.QUEUED.value
+    )
+
+
+def _document() -> DocumentSchema:
+    return DocumentSchema(id=uuid4(), url="http://localhost/a.pdf", name="a.pdf", assistant_id="a")
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """
+    Replaces the job and document tables with in-memory state.
+    """
+    state = {"stale_jobs": [], "documents": {}, "updates": [], "touched": [], "claims": []}
+
+    async def claim_stale_indexing_jobs(db, stale_before, limit):
+        state["claims"].append((stale_before, limit))
+        claimed, state["stale_jobs"] = state["stale_jobs"][:limit], state["stale_jobs"][limit:]
+        return claimed
+
+    async def fetch_documents(db, id):
+        document = state["documents"].get(id)
+        return [document] if document else []
+
+    async def update_indexing_job(db, job_id, **values):
+        state["updates"].append((job_id, values))
+
+    async def touch_indexing_jobs(db, job_ids):
+        state["touched"].append(set(job_ids))
+
+    monkeypatch.setattr(jobs, "SessionLocal", FakeSession)
+    monkeypatch.setattr(jobs, "claim_stale_indexing_jobs", claim_stale_indexing_jobs)
+    monkeypatch.setattr(jobs, "fetch_documents", fetch_documents)
+    monkeypatch.setattr(jobs, "update_indexing_job", update_indexing_job)
+    monkeypatch.setattr(jobs, "touch_indexing_jobs", touch_indexing_jobs)
+    return state
+
+
+def _queue(max_queue_size: int = 10) -> IndexingJobQueue:
+    queue = IndexingJobQueue(worker_count=0, max_queue_size=max_queue_size)
+    queue._queue = asyncio.Queue(maxsize=max_queue_size)
+    return queue
+
+
+def test_recovered_jobs_are_queued_again(db):
+    document = _document()
+    db["documents"][str(document.id)] = document
+    job = _job(document.id)
+    db["stale_jobs"] = [job]
+    queue = _queue()
+
+    asyncio.run(queue._recover_stale_jobs())
+
+    assert queue._queue.get_nowait() == (job.id, document)
+    assert job.id in queue._done_events
+    assert db["updates"] == []
+
+
+def test_jobs_of_deleted_documents_fail(db):
+    job = _job(uuid4())
+    db["stale_jobs"] = [job]
+    queue = _queue()
+
+    asyncio.run(queue._recover_stale_jobs())
+
+    assert queue._queue.empty()
+    [(job_id, values)] = db["updates"]
+    assert job_id == job.id
+    assert values["status"] == IndexingJobStatus.FAILED.value
+
+
+def test_recovery_only_claims_the_free_queue_slots(db):
+    documents = [_document() for _ in range(3)]
+    for document in documents:
+        db["documents"][str(document.id)] = document
+    db["stale_jobs"] = [_job(document.id) for document in documents]
+    queue = _queue(max_queue_size=2)
+    queue._queue.put_nowait((uuid4(), _document()))
+
+    asyncio.run(queue._recover_stale_jobs())
+
+    [(stale_before, limit)] = db["claims"]
+    assert limit == 1
+    assert stale_before < datetime.utcnow()
+    assert queue._queue.full()
+    assert len(db["stale_jobs"]) == 2
+
+
+def test_recovery_skips_claiming_with_a_full_queue(db):
+    queue = _queue(max_queue_size=1)
+    queue._queue.put_nowait((uuid4(), _document()))
+
+    asyncio.run(queue._recover_stale_jobs())
+
+    assert db["claims"] == []
+
+
+def test_heartbeat_touches_this_process_jobs_then_recovers(db, monkeypatch):
+    document = _document()
+    db["documents"][str(document.id)] = document
+    stale_job = _job(document.id)
+    db["stale_jobs"] = [stale_job]
+    queue = _queue()
+    running_job_id = uuid4()
+    queue._done_events[running_job_id] = asyncio.Event()
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 2:
+            raise asyncio.CancelledError()
+
+    monkeypatch.setattr(jobs.asyncio, "sleep", sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(queue._heartbeat())
+
+    # The recovered job is heartbeated from the next beat on
+    assert db["touched"] == [{running_job_id}, {running_job_id, stale_job.id}]
+    assert sleeps == [settings.INDEXING_JOB_HEARTBEAT_SECONDS] * 2
+
+
+def test_heartbeat_keeps_going_after_a_failure(db, monkeypatch):
+    queue = _queue()
+    beats = []
+
+    async def touch_indexing_jobs(db, job_ids):
+        beats.append(job_ids)
+        if len(beats) == 1:
+            raise ConnectionError("database went away")
+
+    async def sleep(seconds):
+        if len(beats) == 2:
+            raise asyncio.CancelledError()
+
+    monkeypatch.setattr(jobs, "touch_indexing_jobs", touch_indexing_jobs)
+    monkeypatch.setattr(jobs.asyncio, "sleep", sleep)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(queue._heartbeat())
+
+    assert len(beats) == 2
+    # Recovery only ran on the beat that didn't fail
+    assert len(db["claims"]) == 1
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import app.db.session
+from app.engine.query_embedding_cache import PostgresQueryEmbeddingBackend
+from app.services import embedding_cache
+
+
+class FakeSession:
+    def __init__(self, statements):
+        self.statements = statements
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, stmt):
+        self.statements.append(stmt)
+
+    async def commit(self):
+        pass
+
+
+def _sql(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def test_insert_keeps_existing_chunk_embeddings():
+    statements = []
+    asyncio.run(
+        embedding_cache.insert_cached_embeddings(FakeSession(statements), "model", {"hash": [0.1]})
+    )
+    assert "ON CONFLICT (model_name, text_hash) DO NOTHING" in _sql(statements[0])
+
+
+def test_refreshing_insert_overwrites_and_restarts_the_ttl():
+    statements = []
+    asyncio.run(
+        embedding_cache.insert_cached_embeddings(
+            FakeSession(statements), "model", {"hash": [0.1]}, refresh=True
+        )
+    )
+    sql = _sql(statements[0])
+    assert "ON CONFLICT (model_name, text_hash) DO UPDATE" in sql
+    assert "embedding = excluded.embedding" in sql
+    assert "created_at = now()" in sql
+
+
+@pytest.fixture
+def database(monkeypatch):
+    state = {"rows": {}, "inserts": [], "deletes": []}
+
+    async def fetch_cached_embeddings(db, model_name, text_hashes, created_after=None):
+        return {
+            text_hash: embedding
+            for (name, text_hash), (embedding, created_at) in state["rows"].items()
+            if name == model_name and text_hash in text_hashes and created_at > created_after
+        }
+
+    async def insert_cached_embeddings(db, model_name, embeddings, refresh=False):
+        state["inserts"].append(refresh)
+        for text_hash, embedding in embeddings.items():
+            if refresh or (model_name, text_hash) not in state["rows"]:
+                state["rows"][(model_name, text_hash)] = (embedding, datetime.utcnow())
+
+    async def delete_cached_embeddings(db, model_name, created_before):
+        state["deletes"].append(created_before)
+        return 0
+
+    monkeypatch.setattr(app.db.session, "SessionLocal", lambda: FakeSession([]))
+    monkeypatch.setattr(embedding_cache, "fetch_cached_embeddings", fetch_cached_embeddings)
+    monkeypatch.setattr(embedding_cache, "insert_cached_embeddings", insert_cached_embeddings)
+    monkeypatch.setattr(embedding_cache, "delete_cached_embeddings", delete_cached_embeddings)
+    return state
+
+
+def test_expired_query_embedding_is_cached_again(database):
+    backend = PostgresQueryEmbeddingBackend(ttl=60, prune_interval=3600)
+    key = ("model#query", embedding_cache.hash_text("query"))
+    database["rows"][key] = ([0.1], datetime.utcnow() - timedelta(seconds=120))
+
+    async def run():
+        assert await backend.get("model", "query") is None
+        await backend.set("model", "query", [0.2])
+        return await backend.get("model", "query")
+
+    assert asyncio.run(run()) == [0.2]
+    assert database["inserts"] == [True]
+
+
+def test_expired_rows_are_pruned_at_most_every_interval(database):
+    backend = PostgresQueryEmbeddingBackend(ttl=60, prune_interval=3600)
+
+    async def run():
+        for query in ("first", "second", "third"):
+            await backend.set("model", query, [0.1])
+
+    asyncio.run(run())
+    [created_before] = database["deletes"]
+    assert created_before < datetime.utcnow() - timedelta(seconds=59)
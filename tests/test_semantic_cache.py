@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime
+from typing import List
+
+import pytest
+
+from app.api.routers import query
+from app.core.config import settings
+from app.engine.semantic_cache import SemanticAnswerCache
+
+
+EMBEDDINGS = {
+    "what is the refund policy?": [1.0, 0.0, 0.0],
+    "how do refunds work?": [0.99, 0.1, 0.0],
+    "who is the ceo?": [0.0, 1.0, 0.0],
+}
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, query: str) -> List[float]:
+        self.calls += 1
+        return EMBEDDINGS[query.lower()]
+
+
+@pytest.fixture
+def cache():
+    return SemanticAnswerCache(
+        max_documents=2, max_entries_per_document=10, ttl=3600, similarity_threshold=0.98
+    )
+
+
+def _set(cache, query, doc_id="doc", variant="", version=None):
+    cache.set(
+        doc_id,
+        query,
+        EMBEDDINGS[query.lower()],
+        result=f"answer to {query}",
+        sources=[],
+        variant=variant,
+        version=version,
+    )
+
+
+def _lookup(cache, query, doc_id="doc", variant="", version=None, embedder=None):
+    embedder = embedder or FakeEmbedder()
+    answer, _ = asyncio.run(
+        cache.alookup(doc_id, query, embedder, variant=variant, version=version)
+    )
+    return answer
+
+
+def test_empty_cache_misses_without_embedding(cache):
+    embedder = FakeEmbedder()
+    assert _lookup(cache, "what is the refund policy?", embedder=embedder) is None
+    assert embedder.calls == 0
+    assert cache.misses == 1
+
+
+def test_identical_query_hits_without_embedding(cache):
+    _set(cache, "What is the refund policy?")
+    embedder = FakeEmbedder()
+    answer = _lookup(cache, "  what is THE refund   policy? ", embedder=embedder)
+    assert answer.result == "answer to What is the refund policy?"
+    assert embedder.calls == 0
+
+
+def test_similar_query_hits_above_the_threshold(cache):
+    _set(cache, "What is the refund policy?")
+    answer = _lookup(cache, "How do refunds work?")
+    assert answer is not None
+    assert answer.query == "What is the refund policy?"
+
+
+def test_dissimilar_query_misses(cache):
+    _set(cache, "What is the refund policy?")
+    assert _lookup(cache, "Who is the CEO?") is None
+
+
+def test_similar_query_misses_below_the_threshold(cache):
+    cache.similarity_threshold = 0.999
+    _set(cache, "What is the refund policy?")
+    assert _lookup(cache, "How do refunds work?") is None
+
+
+def test_answers_are_per_document(cache):
+    _set(cache, "What is the refund policy?", doc_id="doc")
+    assert _lookup(cache, "What is the refund policy?", doc_id="other") is None
+
+
+def test_answers_are_only_reused_for_the_same_variant(cache):
+    _set(cache, "What is the refund policy?", variant="rerank")
+    assert _lookup(cache, "What is the refund policy?") is None
+    assert _lookup(cache, "How do refunds work?") is None
+    assert _lookup(cache, "How do refunds work?", variant="rerank") is not None
+
+
+def test_answers_of_an_older_index_version_are_dropped(cache):
+    indexed_at = datetime(2024, 1, 1)
+    _set(cache, "What is the refund policy?", version=indexed_at)
+    assert _lookup(cache, "What is the refund policy?", version=indexed_at) is not None
+
+    assert _lookup(cache, "What is the refund policy?", version=datetime(2024, 2, 1)) is None
+    assert cache.invalidations == 1
+    assert _lookup(cache, "What is the refund policy?", version=indexed_at) is None
+
+
+def test_invalidate_drops_the_document(cache):
+    _set(cache, "What is the refund policy?")
+    cache.invalidate("doc")
+    assert _lookup(cache, "What is the refund policy?") is None
+    assert cache.stats()["documents"] == 0
+
+
+def _variant(**fields) -> str:
+    return query._answer_variant(query._QueryData(query="q", assistant_id="a", **fields))
+
+
+@pytest.fixture
+def defaults(monkeypatch):
+    monkeypatch.setattr(settings, "RERANK_ENABLED", False)
+    monkeypatch.setattr(settings, "PGVECTOR_HNSW_EF_SEARCH", 40)
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 3000)
+
+
+def test_variant_applies_the_defaults(defaults):
+    assert _variant() == _variant(ef_search=40, context_token_budget=3000, rerank=False)
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"ef_search": 200},
+        {"context_token_budget": 500},
+        {"rerank": True},
+    ],
+)
+def test_variant_changes_with_the_answer_parameters(defaults, fields):
+    assert _variant(**fields) != _variant()
+
+
+def test_variant_keys_rerank_settings_only_when_reranking(defaults):
+    assert _variant(rerank_top_n=2) == _variant(rerank_top_n=3)
+    assert _variant(rerank=True, rerank_top_n=2) != _variant(rerank=True, rerank_top_n=3)
+    assert _variant(rerank=True, rerank_score_cutoff=0.5) != _variant(rerank=True)
+
+
+def test_variant_ignores_streaming(defaults):
+    assert _variant(stream=True) == _variant()
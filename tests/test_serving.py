@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.core import serving
+from app.core.config import settings
+from app.core.serving import MB, MemoryUsage, worker_count_for_memory, worker_private_memory
+
+
+@pytest.fixture(autouse=True)
+def sizing_settings(monkeypatch):
+    monkeypatch.setattr(settings, "SERVING_MEMORY_HEADROOM_FRACTION", 0.1)
+    monkeypatch.setattr(settings, "SERVING_WORKER_MEMORY_GROWTH_FACTOR", 2.0)
+    monkeypatch.setattr(settings, "SERVING_MAX_WORKERS", 8)
+    monkeypatch.setattr(settings, "PDF_PARSER_PROCESSES", 0)
+    monkeypatch.setattr(settings, "SERVING_PDF_PARSER_PROCESS_MEMORY_MB", 300)
+
+
+def _usage(private: int) -> MemoryUsage:
+    return MemoryUsage(rss=private, pss=private, shared=0, private=private)
+
+
+def test_adds_the_workers_fitting_under_the_headroom():
+    # 900MB usable, 300MB used: 600MB left at 2 x 100MB per new worker
+    count = worker_count_for_memory(1000 * MB, 300 * MB, current_workers=1, worker_private=100 * MB)
+    assert count == 4
+
+
+def test_rounds_down_partial_workers():
+    count = worker_count_for_memory(1000 * MB, 300 * MB, current_workers=1, worker_private=110 * MB)
+    assert count == 3
+
+
+def test_is_capped_at_the_max_workers():
+    count = worker_count_for_memory(100_000 * MB, 0, current_workers=1, worker_private=10 * MB)
+    assert count == settings.SERVING_MAX_WORKERS
+
+
+def test_keeps_at_least_one_worker_over_the_limit():
+    count = worker_count_for_memory(1000 * MB, 1200 * MB, current_workers=2, worker_private=100 * MB)
+    assert count == 1
+
+
+def test_shrinks_when_running_workers_use_more_than_fits():
+    # 100MB over the usable memory takes away one 2 x 100MB worker
+    count = worker_count_for_memory(1000 * MB, 1000 * MB, current_workers=4, worker_private=100 * MB)
+    assert count == 3
+
+
+def test_worker_memory_without_parser_processes():
+    assert worker_private_memory(_usage(100 * MB), []) == 100 * MB
+
+
+def test_worker_memory_budgets_parser_processes_not_started_yet(monkeypatch):
+    monkeypatch.setattr(settings, "PDF_PARSER_PROCESSES", 3)
+    private = worker_private_memory(_usage(100 * MB), [_usage(200 * MB)])
+    # One measured parser process and two more at the configured budget
+    assert private == 100 * MB + 200 * MB + 2 * 300 * MB
+
+
+def test_child_pids_lists_started_processes():
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        assert child.pid in serving.child_pids(os.getpid())
+    finally:
+        child.kill()
+        child.wait()
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from app.engine import embeddings
+from app.engine.embeddings import TokenBucket
+
+
+class FakeClock:
+    """
+    Stands in for time.monotonic and asyncio.sleep, sleeping only moves the clock.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(embeddings.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(embeddings.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def test_full_bucket_does_not_wait(clock):
+    bucket = TokenBucket(rate_per_minute=60)
+
+    async def acquire_all():
+        for _ in range(60):
+            await bucket.acquire()
+
+    asyncio.run(acquire_all())
+    assert clock.slept == 0
+
+
+def test_empty_bucket_waits_for_the_refill(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+
+    async def acquire():
+        await bucket.acquire(10)
+        await bucket.acquire(5)
+
+    asyncio.run(acquire())
+    # 5 tokens at 1 token per second
+    assert clock.slept == pytest.approx(5)
+
+
+def test_refill_is_capped_at_the_capacity(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+
+    async def acquire():
+        await bucket.acquire(10)
+        clock.now += 3600
+        await bucket.acquire(10)
+        await bucket.acquire(1)
+
+    asyncio.run(acquire())
+    assert clock.slept == pytest.approx(1)
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=10)
+
+    async def acquire():
+        await bucket.acquire(5)
+        await bucket.acquire(100)
+
+    asyncio.run(acquire())
+    assert clock.slept == pytest.approx(5)
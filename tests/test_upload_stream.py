@@ -0,0 +1,115 @@
+import asyncio
+from typing import AsyncIterator, List
+
+import pytest
+
+from app.utils import file_utils
+from app.utils.file_utils import UploadTooLarge, upload_stream
+
+
+PART_SIZE = 8
+
+
+class FakeS3:
+    """
+    Records the multipart calls; `failing_parts` fail, after `delays[part]` seconds.
+    """
+
+    def __init__(self, failing_parts=(), delays=None):
+        self.failing_parts = set(failing_parts)
+        self.delays = delays or {}
+        self.calls: List[str] = []
+        self.completed_parts: List[int] = []
+        self.piped = None
+
+    def split_path(self, path):
+        bucket, key = path.split("/", 1)
+        return bucket, key, None
+
+    async def _call_s3(self, method, **kwargs):
+        self.calls.append(method)
+        if method == "create_multipart_upload":
+            return {"UploadId": "upload"}
+        if method == "upload_part":
+            part_number = kwargs["PartNumber"]
+            await asyncio.sleep(self.delays.get(part_number, 0))
+            if part_number in self.failing_parts:
+                raise ConnectionError(f"part {part_number} failed")
+            return {"ETag": f"etag-{part_number}"}
+        if method == "complete_multipart_upload":
+            self.completed_parts = [
+                part["PartNumber"] for part in kwargs["MultipartUpload"]["Parts"]
+            ]
+        return {}
+
+    async def _pipe_file(self, path, data):
+        self.piped = data
+
+    def invalidate_cache(self, path):
+        pass
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(file_utils, "get_async_s3_fs", lambda: s3)
+    return s3
+
+
+async def _chunks(size: int, chunk_size: int = 3, delay: float = 0) -> AsyncIterator[bytes]:
+    data = bytes(range(256)) * (size // 256 + 1)
+    for start in range(0, size, chunk_size):
+        yield data[start:min(start + chunk_size, size)]
+        await asyncio.sleep(delay)
+
+
+def _upload(size: int, concurrency: int = 4, max_size=None, read_delay: float = 0) -> int:
+    return asyncio.run(
+        upload_stream(
+            "bucket/key",
+            _chunks(size, delay=read_delay),
+            part_size=PART_SIZE,
+            concurrency=concurrency,
+            max_size=max_size,
+        )
+    )
+
+
+def test_small_upload_is_a_single_put(s3):
+    assert _upload(PART_SIZE - 1) == PART_SIZE - 1
+    assert s3.calls == []
+    assert len(s3.piped) == PART_SIZE - 1
+
+
+def test_large_upload_completes_with_every_part(s3):
+    assert _upload(5 * PART_SIZE - 2) == 5 * PART_SIZE - 2
+    assert s3.completed_parts == [1, 2, 3, 4, 5]
+    assert "abort_multipart_upload" not in s3.calls
+
+
+def test_failed_part_aborts_the_upload(s3, caplog):
+    # Part 2 fails and finishes while the next part is still being read
+    s3.failing_parts = {2}
+    with pytest.raises(ConnectionError):
+        _upload(5 * PART_SIZE, read_delay=0.005)
+
+    assert "complete_multipart_upload" not in s3.calls
+    assert s3.calls[-1] == "abort_multipart_upload"
+    assert "exception was never retrieved" not in caplog.text
+
+
+def test_failed_last_part_aborts_the_upload(s3):
+    s3.failing_parts = {5}
+    with pytest.raises(ConnectionError):
+        _upload(5 * PART_SIZE, concurrency=1)
+
+    assert "complete_multipart_upload" not in s3.calls
+    assert s3.calls[-1] == "abort_multipart_upload"
+
+
+def test_too_large_upload_aborts(s3):
+    with pytest.raises(UploadTooLarge):
+        _upload(5 * PART_SIZE, max_size=3 * PART_SIZE)
+
+    assert "complete_multipart_upload" not in s3.calls
+    assert s3.calls[-1] == "abort_multipart_upload"